@@ -0,0 +1,105 @@
+"""Bulk loader throughput.
+
+Writes --products synthetic listings to a CSV (and NDJSON) file, then loads
+them into a fresh SQLite database with the bulk loader and reports rows per
+second against the 100k products/s target.  --orm-rows also times the same
+rows added through the ORM session, the way seeding used to work.
+
+Usage: python benchmarks/bench_bulk_import.py [--products 500000] [--format csv] [--orm-rows 20000]
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.main import create_app
+from src.cli import init_db
+from src.models.user import db, Product
+from src.services.bulk_import import import_file
+
+TARGET_ROWS_PER_SECOND = 100000
+FIELDS = ['title', 'description', 'price', 'category', 'brand', 'condition', 'location',
+          'latitude', 'longitude', 'status', 'views', 'seller_id', 'created_at']
+
+def write_inputs(directory, products, sellers):
+    rng = random.Random(42)
+    csv_path = os.path.join(directory, 'products.csv')
+    ndjson_path = os.path.join(directory, 'products.ndjson')
+    with open(csv_path, 'w', newline='', encoding='utf-8') as csv_file, \
+            open(ndjson_path, 'w', encoding='utf-8') as ndjson_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(FIELDS)
+        for i in range(products):
+            row = [f'Article {i}', 'Très bon état, envoi possible.', round(rng.uniform(1, 500), 2),
+                   rng.choice(['mode', 'electronique', 'maison', 'sport']), rng.choice(['Nike', 'Zara', '']),
+                   rng.choice(['new', 'excellent', 'good', 'fair']), 'Paris, France',
+                   round(48.85 + rng.gauss(0, 0.05), 6), round(2.35 + rng.gauss(0, 0.07), 6),
+                   'active', rng.randint(0, 500), rng.randint(1, sellers),
+                   f'2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:15:00']
+            writer.writerow(row)
+            ndjson_file.write(json.dumps(dict(zip(FIELDS, row))) + '\n')
+    return csv_path, ndjson_path
+
+def write_users(directory, sellers):
+    path = os.path.join(directory, 'users.csv')
+    with open(path, 'w', newline='', encoding='utf-8') as users_file:
+        writer = csv.writer(users_file)
+        writer.writerow(['username', 'email', 'first_name', 'last_name', 'user_type', 'password_hash'])
+        for i in range(sellers):
+            writer.writerow([f'seller{i}', f'seller{i}@example.com', 'Bench', str(i), 'seller', 'imported'])
+    return path
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--products', type=int, default=500000)
+    parser.add_argument('--sellers', type=int, default=5000)
+    parser.add_argument('--format', choices=['csv', 'ndjson'], default='csv')
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    parser.add_argument('--orm-rows', type=int, default=20000, help='0 to skip the ORM comparison')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path, ndjson_path = write_inputs(tmp, args.products, args.sellers)
+        users_path = write_users(tmp, args.sellers)
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.join(tmp, "bulk.db")}',
+            'SESSION_BACKEND': 'memory',
+            'START_BACKGROUND_SERVICES': False
+        })
+        with app.app_context():
+            init_db()
+            users = import_file('users', users_path)
+            print(f'users: {users["inserted"]} rows, {users["rows_per_second"]} rows/s')
+
+            path = csv_path if args.format == 'csv' else ndjson_path
+            report = import_file('products', path, chunk_size=args.chunk_size, defer_indexes=True)
+            print(f'products ({args.format}): {report["inserted"]} rows in {report["seconds"]}s, '
+                  f'{report["rows_per_second"]} rows/s, {report["rejected"]} rejected')
+            verdict = 'OK' if report['rows_per_second'] >= TARGET_ROWS_PER_SECOND else 'below target'
+            print(f'target {TARGET_ROWS_PER_SECOND} rows/s: {verdict}')
+
+            if args.orm_rows:
+                with open(csv_path, newline='', encoding='utf-8') as csv_file:
+                    reader = csv.DictReader(csv_file)
+                    rows = [next(reader) for _ in range(min(args.orm_rows, args.products))]
+                started = time.perf_counter()
+                for row in rows:
+                    db.session.add(Product(
+                        title=row['title'], description=row['description'], price=float(row['price']),
+                        category=row['category'], brand=row['brand'] or None, condition=row['condition'],
+                        location=row['location'], latitude=float(row['latitude']),
+                        longitude=float(row['longitude']), status=row['status'], views=int(row['views']),
+                        seller_id=int(row['seller_id'])
+                    ))
+                db.session.commit()
+                elapsed = time.perf_counter() - started
+                print(f'ORM session.add for comparison: {len(rows) / elapsed:.0f} rows/s')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""Mixed read/write load against the database runtime.
+
+Reader threads page through the catalog while writer threads bump view
+counters, toggle favorites and insert messages, like production traffic.
+Run once with the tuned runtime and once with --baseline (default journaling,
+no pragmas) to compare throughput, latency and "database is locked" errors.
+
+Usage: python benchmarks/bench_db_mixed.py [--readers 8] [--writers 4] [--seconds 5] [--baseline]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import update, select, func
+from src.models.user import db, User, Product, Message, Favorite
+from src.services import database
+
+def make_app(db_path, baseline):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    if baseline:
+        database.SQLITE_PRAGMAS.clear()
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'timeout': 0.1}}
+    else:
+        database.configure_database(app)
+    db.init_app(app)
+    return app
+
+def seed(app, products):
+    with app.app_context():
+        db.create_all()
+        users = [User(username=f'user{i}', email=f'user{i}@example.com', password_hash='x',
+                      first_name='Bench', last_name=str(i)) for i in range(50)]
+        db.session.add_all(users)
+        db.session.flush()
+        db.session.add_all([
+            Product(title=f'Produit {i}', description='Description', price=random.uniform(5, 500),
+                    category=random.choice(['mode', 'electronique', 'maison']), condition='good',
+                    seller_id=random.choice(users).id)
+            for i in range(products)
+        ])
+        db.session.commit()
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--baseline', action='store_true')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(os.path.join(tmp, 'bench.db'), args.baseline)
+        seed(app, args.products)
+
+        deadline = time.perf_counter() + args.seconds
+        results = {'read': [], 'write': [], 'errors': 0}
+        results_lock = threading.Lock()
+
+        def reader():
+            latencies = []
+            with app.app_context():
+                while time.perf_counter() < deadline:
+                    started = time.perf_counter()
+                    try:
+                        db.session.execute(
+                            select(Product).where(Product.status == 'active')
+                            .order_by(Product.created_at.desc())
+                            .offset(random.randint(0, args.products - 20)).limit(20)
+                        ).scalars().all()
+                        db.session.execute(select(func.count(Product.id))).scalar()
+                        latencies.append(time.perf_counter() - started)
+                    except Exception:
+                        db.session.rollback()
+                        with results_lock:
+                            results['errors'] += 1
+                    db.session.remove()
+            with results_lock:
+                results['read'].extend(latencies)
+
+        def writer():
+            latencies = []
+            with app.app_context():
+                while time.perf_counter() < deadline:
+                    started = time.perf_counter()
+                    product_id = random.randint(1, args.products)
+                    user_id = random.randint(1, 50)
+                    try:
+                        action = random.random()
+                        if action < 0.6:
+                            db.session.execute(update(Product).where(Product.id == product_id)
+                                               .values(views=Product.views + 1))
+                        elif action < 0.8:
+                            db.session.add(Favorite(user_id=user_id, product_id=product_id))
+                        else:
+                            db.session.add(Message(content='Toujours disponible ?', sender_id=user_id,
+                                                   receiver_id=random.randint(1, 50), product_id=product_id))
+                        db.session.commit()
+                        latencies.append(time.perf_counter() - started)
+                    except Exception:
+                        db.session.rollback()
+                        with results_lock:
+                            results['errors'] += 1
+                    db.session.remove()
+            with results_lock:
+                results['write'].extend(latencies)
+
+        threads = [threading.Thread(target=reader) for _ in range(args.readers)]
+        threads += [threading.Thread(target=writer) for _ in range(args.writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        mode = 'baseline' if args.baseline else 'tuned'
+        print(f'mode={mode} readers={args.readers} writers={args.writers} errors={results["errors"]}')
+        for kind in ('read', 'write'):
+            samples = results[kind]
+            print(f'{kind:>5}: {len(samples) / args.seconds:8.1f} ops/s  '
+                  f'p50={percentile(samples, 50) * 1000:6.2f}ms  p99={percentile(samples, 99) * 1000:7.2f}ms')
+        if not args.baseline:
+            with app.app_context():
+                print(database.get_database_stats(db.engine))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+"""Endpoint benchmark suite on a synthetic marketplace.
+
+Generates a dataset of --products listings (see datasets.py), then drives the
+main endpoints of every blueprint through the Flask test client.  Each
+scenario reports throughput, p50/p95/p99 latency, SQL statements per request
+and the process peak RSS; the results are saved as JSON so a later run can be
+compared with --compare (exit status 1 when p95 or throughput regress by
+more than --tolerance).
+
+Datasets of 100k+ products take a while to build: pass --db to keep the
+database file and reuse it on the next run.
+
+Usage:
+    python benchmarks/bench_endpoints.py --products 10000
+    python benchmarks/bench_endpoints.py --products 100000 --db /tmp/bench100k.db --requests 100
+    python benchmarks/bench_endpoints.py --products 10000 --compare benchmarks/results/old.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+from src.main import create_app
+from src.cli import init_db
+from src.models.user import db
+from datasets import generate_dataset, busiest_user, BENCH_PASSWORD, CITIES, CATEGORIES
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+def scenarios(products, users, partner_id):
+    """name -> (needs login, function returning a request path)"""
+    categories = list(CATEGORIES)
+    cities = list(CITIES.values())
+    return {
+        'products.list': (False, lambda rng: f'/api/products/?page={rng.randint(1, 20)}'),
+        'products.list_filtered': (False, lambda rng: (
+            f'/api/products/?category={rng.choice(categories)}&min_price=10&max_price=200&sort_by=price')),
+        'products.search': (False, lambda rng: f'/api/products/?search={rng.choice(["Nike", "article 1", "iPhone"])}'),
+        'products.detail': (False, lambda rng: f'/api/products/{rng.randint(1, products)}'),
+        'products.price_history': (False, lambda rng: f'/api/products/price-history/{rng.randint(1, products)}'),
+        'products.market_analysis': (False, lambda rng: f'/api/products/market-analysis?category={rng.choice(categories)}'),
+        'products.categories': (False, lambda rng: '/api/products/categories'),
+        'products.brands': (False, lambda rng: '/api/products/brands'),
+        'products.trending': (False, lambda rng: '/api/products/trending'),
+        'location.nearby_products': (False, lambda rng: '/api/location/nearby-products?lat={}&lon={}&radius=5'.format(
+            *rng.choice(cities)[1:])),
+        'messages.conversations': (True, lambda rng: '/api/messages/conversations'),
+        'messages.conversation': (True, lambda rng: f'/api/messages/conversation/{partner_id}'),
+        'messages.unread_count': (True, lambda rng: '/api/messages/unread-count'),
+        'orders.my_orders': (True, lambda rng: '/api/orders/my-orders'),
+        'orders.my_sales': (True, lambda rng: '/api/orders/my-sales'),
+        'products.user_favorites': (True, lambda rng: '/api/products/user-favorites'),
+        'users.list': (False, lambda rng: '/api/users/users'),
+        'users.detail': (False, lambda rng: f'/api/users/users/{rng.randint(1, users)}')
+    }
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def run_scenario(app, path_for, email, requests_count, concurrency, seed):
+    statements = threading.local()
+    latencies, query_counts, statuses = [], [], {}
+    lock = threading.Lock()
+
+    def count(*args):
+        statements.count = getattr(statements, 'count', 0) + 1
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'after_cursor_execute', count)
+
+    def worker(worker_id, iterations):
+        rng = random.Random(seed + worker_id)
+        client = app.test_client()
+        if email:
+            client.post('/api/auth/login', json={'email': email, 'password': BENCH_PASSWORD})
+        for _ in range(iterations):
+            path = path_for(rng)
+            statements.count = 0
+            started = time.perf_counter()
+            response = client.get(path)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                query_counts.append(statements.count)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    per_worker = max(1, requests_count // concurrency)
+    threads = [threading.Thread(target=worker, args=(index, per_worker)) for index in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    event.remove(engine, 'after_cursor_execute', count)
+
+    return {
+        'requests': len(latencies),
+        'throughput_rps': round(len(latencies) / wall, 2),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'queries_avg': round(statistics.mean(query_counts), 2),
+        'queries_max': max(query_counts),
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+def compare(results, baseline_path, tolerance):
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+    regressions = []
+    print(f'\ncompared with {baseline_path} ({baseline["started_at"]}, {baseline["dataset"]["products"]} products)')
+    for name, current in results['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if not before:
+            continue
+        p95_change = current['p95_ms'] / before['p95_ms'] - 1 if before['p95_ms'] else 0
+        rps_change = current['throughput_rps'] / before['throughput_rps'] - 1 if before['throughput_rps'] else 0
+        flag = ''
+        if p95_change > tolerance or rps_change < -tolerance:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f'{name:28} p95 {p95_change:+7.1%}  throughput {rps_change:+7.1%}  '
+              f'queries {before["queries_avg"]:.1f} -> {current["queries_avg"]:.1f}{flag}')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=1, help='client threads per scenario')
+    parser.add_argument('--only', help='comma-separated scenario names')
+    parser.add_argument('--db', help='database file to build once and reuse')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='results file (default benchmarks/results/...)')
+    parser.add_argument('--compare', help='previous results file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = args.db or os.path.join(tmp, 'bench.db')
+        existing = os.path.exists(db_path)
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+            'SESSION_BACKEND': 'memory',
+            'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+            'PROFILE_SLOW_THRESHOLD': None,
+            # One client hammering market-analysis is exactly what the limiter refuses
+            'RATE_LIMIT_ENABLED': False,
+            'START_BACKGROUND_SERVICES': False
+        })
+        with app.app_context():
+            init_db()
+            if existing:
+                print(f'reusing dataset in {db_path}')
+                counts = {'products': args.products, 'reused': True}
+            else:
+                started = time.perf_counter()
+                counts = generate_dataset(db.engine, args.products, seed=args.seed)
+                print(f'generated {counts} in {time.perf_counter() - started:.1f}s')
+            user_id, email = busiest_user(db.engine)
+            users = counts.get('users') or db.session.execute(db.text('SELECT COUNT(*) FROM user')).scalar()
+
+        with app.app_context():
+            partner_id = db.session.execute(db.text(
+                'SELECT sender_id FROM message WHERE receiver_id = :user_id GROUP BY sender_id '
+                'ORDER BY COUNT(*) DESC LIMIT 1'), {'user_id': user_id}).scalar()
+
+        selected = scenarios(args.products, users, partner_id)
+        if args.only:
+            selected = {name: selected[name] for name in args.only.split(',')}
+
+        results = {
+            'started_at': datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'dataset': dict(counts, products=args.products, seed=args.seed),
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'scenarios': {}
+        }
+        print(f'{"scenario":28} {"rps":>8} {"p50":>9} {"p95":>9} {"p99":>9} {"queries":>8} {"rss":>8}')
+        for name, (needs_login, path_for) in selected.items():
+            result = run_scenario(app, path_for, email if needs_login else None,
+                                  args.requests, args.concurrency, args.seed)
+            results['scenarios'][name] = result
+            print(f'{name:28} {result["throughput_rps"]:8.1f} {result["p50_ms"]:7.2f}ms {result["p95_ms"]:7.2f}ms '
+                  f'{result["p99_ms"]:7.2f}ms {result["queries_avg"]:8.1f} {result["peak_rss_mb"]:6.0f}MB')
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f'endpoints-{args.products}-{datetime.utcnow().strftime("%Y%m%dT%H%M%S")}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f'\nresults saved to {output}')
+
+    if args.compare and compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
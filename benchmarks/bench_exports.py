@@ -0,0 +1,129 @@
+"""Memory profile of the streaming exports.
+
+Gives one seller a growing number of sales (1k, 10k, 100k... up to --max-rows)
+and streams /api/orders/my-sales/export at every size, reporting throughput,
+output size and the Python heap peak (tracemalloc) while the response is
+consumed.  The peak should stay flat as the row count grows; the script exits
+with status 1 when the largest export peaks above --tolerance times the
+smallest.  RSS is printed too but also counts SQLite's mmap and page cache,
+which grow with the database file rather than with the export.
+
+Usage: python benchmarks/bench_exports.py [--max-rows 1000000] [--format csv] [--gzip]
+"""
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.main import create_app
+from src.cli import init_db
+from src.models.user import db, User
+from datasets import BENCH_PASSWORD
+
+CHUNK_SIZE = 10000
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def create_users(connection):
+    for user_id, username in ((1, 'seller'), (2, 'buyer')):
+        user = User(username=username, email=f'{username}@example.com', first_name='Bench', last_name=username)
+        user.set_password(BENCH_PASSWORD)
+        connection.exec_driver_sql(
+            'INSERT INTO user (id, username, email, password_hash, first_name, last_name, user_type, '
+            'is_verified, is_active, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, 1, 1, ?)',
+            (user_id, username, user.email, user.password_hash, 'Bench', username, 'both', datetime.utcnow()))
+
+def add_sales(connection, start, stop):
+    """Sales start..stop-1 of user 1 to user 2, one listing each"""
+    base = datetime(2024, 1, 1)
+    for chunk_start in range(start, stop, CHUNK_SIZE):
+        ids = range(chunk_start + 1, min(chunk_start + CHUNK_SIZE, stop) + 1)
+        stamps = [str(base + timedelta(minutes=i)) for i in ids]
+        connection.exec_driver_sql(
+            'INSERT INTO product (id, title, description, price, category, condition, status, views, '
+            'favorites_count, seller_id, created_at, updated_at) '
+            "VALUES (?, ?, 'Article vendu', ?, 'mode', 'good', 'sold', 0, 0, 1, ?, ?)",
+            [(i, f'Article {i}', 10 + i % 90, stamp, stamp) for i, stamp in zip(ids, stamps)])
+        connection.exec_driver_sql(
+            'INSERT INTO "order" (id, buyer_id, seller_id, product_id, quantity, total_price, shipping_address, '
+            "payment_method, payment_status, order_status, tracking_number, created_at, updated_at) "
+            "VALUES (?, 2, 1, ?, 1, ?, '1 rue de la Paix, Paris', 'card', 'paid', 'delivered', ?, ?, ?)",
+            [(i, i, 10 + i % 90, f'KM{i:08d}', stamp, stamp) for i, stamp in zip(ids, stamps)])
+
+def stream_export(client, path):
+    tracemalloc.reset_peak()
+    started = time.perf_counter()
+    response = client.get(path)
+    size = lines = 0
+    for chunk in response.iter_encoded():
+        size += len(chunk)
+        lines += chunk.count(b'\n')
+    response.close()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    return response.status_code, lines, size, elapsed, peak
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--max-rows', type=int, default=100000)
+    parser.add_argument('--format', choices=['ndjson', 'csv'], default='ndjson')
+    parser.add_argument('--gzip', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=2.0)
+    args = parser.parse_args()
+
+    sizes = []
+    size = 1000
+    while size <= args.max_rows:
+        sizes.append(size)
+        size *= 10
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.join(tmp, "exports.db")}',
+            'SESSION_BACKEND': 'memory',
+            'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+            'PROFILE_SLOW_THRESHOLD': None,
+            'START_BACKGROUND_SERVICES': False
+        })
+        with app.app_context():
+            init_db()
+            with db.engine.begin() as connection:
+                create_users(connection)
+
+        client = app.test_client()
+        client.post('/api/auth/login', json={'email': 'seller@example.com', 'password': BENCH_PASSWORD})
+        path = f'/api/orders/my-sales/export?format={args.format}&gzip={int(args.gzip)}'
+
+        tracemalloc.start()
+        peaks = []
+        loaded = 0
+        print(f'{"rows":>9} {"seconds":>8} {"rows/s":>9} {"output":>10} {"heap peak":>10} {"rss":>8}')
+        for size in sizes:
+            tracemalloc.stop()
+            with app.app_context(), db.engine.begin() as connection:
+                add_sales(connection, loaded, size)
+            loaded = size
+            tracemalloc.start()
+
+            status, lines, output, elapsed, peak = stream_export(client, path)
+            peaks.append(peak)
+            detail = f'status {status}' if args.gzip else f'status {status}, {lines} lines'
+            print(f'{size:9d} {elapsed:8.2f} {size / elapsed:9.0f} {output / 1048576:8.1f}MB '
+                  f'{peak / 1048576:8.2f}MB {peak_rss_mb():6.0f}MB  ({detail})')
+        tracemalloc.stop()
+
+    if len(peaks) > 1 and peaks[-1] > peaks[0] * args.tolerance:
+        print(f'heap peak grew {peaks[-1] / peaks[0]:.1f}x from {sizes[0]} to {sizes[-1]} rows')
+        sys.exit(1)
+    print('heap peak flat across sizes')
+
+if __name__ == '__main__':
+    main()
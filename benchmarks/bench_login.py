@@ -0,0 +1,70 @@
+"""Measure password verification throughput per hashing worker.
+
+Runs concurrent verifications through the hashing service with 1..N pool
+workers and reports logins/second in total and per core.
+
+Usage: python benchmarks/bench_login.py [--method scrypt:32768:8:1] [--seconds 3]
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from src.services import hashing
+
+def measure(workers, method, seconds):
+    app = Flask(__name__)
+    app.config.update(
+        PASSWORD_HASH_WORKERS=workers,
+        PASSWORD_HASH_MAX_QUEUE=workers * 4,
+        PASSWORD_HASH_METHOD=method
+    )
+    hashing.init_hashing(app)
+
+    with app.app_context():
+        pwhash = hashing.hash_password('password123')
+    deadline = time.perf_counter() + seconds
+    done = 0
+
+    def client():
+        count = 0
+        # The hashing service reads its pool from the app
+        with app.app_context():
+            while time.perf_counter() < deadline:
+                try:
+                    hashing.verify_password(pwhash, 'password123')
+                    count += 1
+                except hashing.HashingBusyError:
+                    time.sleep(0.001)
+        return count
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers * 2) as executor:
+        done = sum(executor.map(lambda _: client(), range(workers * 2)))
+    elapsed = time.perf_counter() - started
+
+    pool = app.extensions['hashing']['pool']
+    if pool is not None:
+        pool.shutdown()
+    return done / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--method', default=None, help='hash method (default: calibrated)')
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    method = args.method or hashing.calibrate_hash_method()
+    print(f'method={method}')
+    print(f'{"workers":>8} {"logins/s":>10} {"per core":>10}')
+    for workers in sorted({1, 2, max(1, args.max_workers // 2), args.max_workers}):
+        rate = measure(workers, method, args.seconds)
+        print(f'{workers:>8} {rate:>10.1f} {rate / workers:>10.1f}')
+
+if __name__ == '__main__':
+    main()
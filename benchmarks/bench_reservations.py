@@ -0,0 +1,93 @@
+"""Fire concurrent checkouts at a single listing and check it is sold once.
+
+Usage: python benchmarks/bench_reservations.py [--buyers 300]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from src.models.user import db, User, Product, Order, ProductReservation
+from src.routes.orders import orders_bp
+from src.services.reservations import get_reservation_stats
+
+def make_app(db_path):
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = 'bench'
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'timeout': 30}, 'pool_size': 20, 'max_overflow': 50}
+    db.init_app(app)
+    app.register_blueprint(orders_bp, url_prefix='/api/orders')
+    return app
+
+def seed(app, buyers):
+    with app.app_context():
+        db.create_all()
+        users = [
+            User(username=f'user{i}', email=f'user{i}@example.com', password_hash='x',
+                 first_name='Bench', last_name=str(i), user_type='both')
+            for i in range(buyers + 1)
+        ]
+        db.session.add_all(users)
+        db.session.commit()
+
+        product = Product(title='Objet unique', description='Un seul exemplaire', price=100.0,
+                          category='electronique', condition='new', seller_id=users[0].id)
+        db.session.add(product)
+        db.session.commit()
+        return product.id, [u.id for u in users[1:]]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--buyers', type=int, default=300)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(os.path.join(tmp, 'bench.db'))
+        product_id, buyer_ids = seed(app, args.buyers)
+
+        barrier = threading.Barrier(len(buyer_ids))
+        statuses = []
+        statuses_lock = threading.Lock()
+
+        def checkout(buyer_id):
+            client = app.test_client()
+            with client.session_transaction() as sess:
+                sess['user_id'] = buyer_id
+            barrier.wait()
+            response = client.post('/api/orders/create', json={
+                'product_id': product_id,
+                'shipping_address': '1 rue du Test'
+            })
+            with statuses_lock:
+                statuses.append(response.status_code)
+
+        threads = [threading.Thread(target=checkout, args=(buyer_id,)) for buyer_id in buyer_ids]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        with app.app_context():
+            orders = Order.query.filter_by(product_id=product_id).count()
+            holds = ProductReservation.query.filter_by(product_id=product_id).count()
+            stats = get_reservation_stats()
+
+        summary = {status: statuses.count(status) for status in sorted(set(statuses))}
+        print(f'{len(buyer_ids)} checkouts in {elapsed:.2f}s -> responses {summary}')
+        print(f'orders={orders} reservations={holds} stats={stats}')
+
+        if orders != 1 or holds != 1:
+            print('FAIL: listing was oversold')
+            sys.exit(1)
+        print('OK: exactly one buyer got the listing')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Per-endpoint JSON serialization cost.
+
+Seeds a scratch database, then calls the main list endpoints through the test
+client with Flask's stdlib provider and with FastJSONProvider.  For each one it
+reports the time spent encoding the payload (inside jsonify), the whole request
+time, and the response size raw and gzip-compressed.
+
+Usage: python benchmarks/bench_serialization.py [--products 2000] [--repeat 30]
+"""
+import argparse
+import gzip
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask.json.provider import DefaultJSONProvider
+from src.main import create_app
+from src.cli import init_db
+from src.models.user import db, User, Product, Message, Order
+from src.services.serialization import FastJSONProvider, orjson
+
+ENDPOINTS = [
+    '/api/products/?per_page=100',
+    '/api/products/trending',
+    '/api/orders/my-orders?per_page=50',
+    '/api/messages/conversations',
+    '/api/users/users'
+]
+
+def seed(app, products):
+    with app.app_context():
+        init_db()
+        users = [User(username=f'user{i}', email=f'user{i}@example.com', first_name='Bench',
+                      last_name=str(i), address=f'{i} rue du Marché, Kinshasa', is_verified=True)
+                 for i in range(200)]
+        for user in users:
+            user.set_password('password123')
+        db.session.add_all(users)
+        db.session.flush()
+        items = [Product(title=f'Produit {i}', description='Très bon état, peu servi. ' * 4,
+                         price=round(random.uniform(5, 500), 2), views=random.randint(0, 5000),
+                         category=random.choice(['mode', 'electronique', 'maison']), condition='good',
+                         brand=random.choice(['Nike', 'Samsung', 'Zara', None]), seller_id=random.choice(users).id)
+                 for i in range(products)]
+        db.session.add_all(items)
+        db.session.flush()
+        buyer = users[0]
+        db.session.add_all([Order(buyer_id=buyer.id, seller_id=product.seller_id, product_id=product.id,
+                                  total_price=product.price, payment_method='mtn_mobile_money')
+                            for product in items[:50]])
+        db.session.add_all([Message(content='Toujours disponible ?', sender_id=random.choice(users).id,
+                                    receiver_id=buyer.id, product_id=random.choice(items).id)
+                            for _ in range(300)])
+        db.session.commit()
+        return buyer.email
+
+def measure(app, provider_class, email, repeat):
+    app.json = provider_class(app)
+    encode_times = []
+    original = app.json.response
+
+    def timed_response(*args, **kwargs):
+        started = time.perf_counter()
+        response = original(*args, **kwargs)
+        encode_times.append(time.perf_counter() - started)
+        return response
+
+    app.json.response = timed_response
+    client = app.test_client()
+    client.post('/api/auth/login', json={'email': email, 'password': 'password123'})
+
+    results = {}
+    for endpoint in ENDPOINTS:
+        client.get(endpoint)  # warm up
+        del encode_times[:]
+        request_times = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            response = client.get(endpoint)
+            request_times.append(time.perf_counter() - started)
+        body = response.get_data()
+        results[endpoint] = {
+            'encode': statistics.median(encode_times),
+            'request': statistics.median(request_times),
+            'bytes': len(body),
+            'gzip_bytes': len(gzip.compress(body, 6))
+        }
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=30)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.join(tmp, "bench.db")}',
+            'SESSION_BACKEND': 'memory',
+            'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+            'COMPRESS_RESPONSES': False,
+            'START_BACKGROUND_SERVICES': False
+        })
+        email = seed(app, args.products)
+        stdlib = measure(app, DefaultJSONProvider, email, args.repeat)
+        fast = measure(app, FastJSONProvider, email, args.repeat)
+
+    print(f'encoder: {"orjson " + orjson.__version__ if orjson else "stdlib json (orjson not installed)"}')
+    print(f'{"endpoint":36} {"stdlib enc":>10} {"fast enc":>9} {"speedup":>7} '
+          f'{"stdlib req":>10} {"fast req":>9} {"bytes":>8} {"gzip":>7}')
+    for endpoint in ENDPOINTS:
+        before, after = stdlib[endpoint], fast[endpoint]
+        print(f'{endpoint:36} {before["encode"] * 1000:8.2f}ms {after["encode"] * 1000:7.2f}ms '
+              f'{before["encode"] / after["encode"]:6.1f}x {before["request"] * 1000:8.2f}ms '
+              f'{after["request"] * 1000:7.2f}ms {after["bytes"]:8} {after["gzip_bytes"]:7}')
+
+if __name__ == '__main__':
+    main()
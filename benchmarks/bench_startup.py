@@ -0,0 +1,79 @@
+"""Measure application cold start.
+
+Each run starts a fresh interpreter that imports the app module, builds the app
+with create_app(), creates the schema on a scratch database and serves one
+request through the test client.  The median import, create_app and first
+request times are reported; the script exits with a non-zero status when the median cold start exceeds --budget, so it can guard
+against heavy imports or startup work creeping back in.
+
+Usage: python benchmarks/bench_startup.py [--runs 7] [--budget 1.5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = '''
+import json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, {root!r})
+from src.main import create_app
+from src.cli import init_db
+imported = time.perf_counter()
+app = create_app({config!r})
+created = time.perf_counter()
+with app.app_context():
+    init_db()
+schema = time.perf_counter()
+app.test_client().get('/api/products/categories')
+served = time.perf_counter()
+print(json.dumps({{
+    'import': imported - started,
+    'create_app': created - imported,
+    'first_request': served - schema,
+    'heavy_modules': sorted(name for name in ('PIL', 'requests', 'authlib') if name in sys.modules)
+}}))
+'''
+
+def run_once(config):
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD.format(root=ROOT, config=config)],
+        check=True, capture_output=True, text=True, cwd=ROOT
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--budget', type=float, default=1.5, help='seconds, import + create_app')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config = {
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.join(tmp, "startup.db")}',
+            'SESSION_BACKEND': 'memory',
+            'START_BACKGROUND_SERVICES': False
+        }
+        results = [run_once(config) for _ in range(args.runs)]
+
+    medians = {key: statistics.median(result[key] for result in results)
+               for key in ('import', 'create_app', 'first_request')}
+    cold_start = medians['import'] + medians['create_app']
+    print(f'runs={args.runs} import={medians["import"] * 1000:.0f}ms '
+          f'create_app={medians["create_app"] * 1000:.0f}ms '
+          f'first_request={medians["first_request"] * 1000:.0f}ms')
+    print(f'heavy modules loaded at startup: {results[0]["heavy_modules"] or "none"}')
+    print(f'cold start {cold_start * 1000:.0f}ms, budget {args.budget * 1000:.0f}ms')
+
+    if cold_start > args.budget:
+        print('FAIL: cold start over budget')
+        sys.exit(1)
+    print('OK')
+
+if __name__ == '__main__':
+    main()
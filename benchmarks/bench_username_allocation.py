@@ -0,0 +1,108 @@
+"""OAuth signup latency when many users share a username base.
+
+Seeds --existing users named contact, contact1 ... contactN-1, then signs up
+--signups new contact@... users through create_or_get_oauth_user and reports
+the per-signup latency and the number of SQL statements per signup.  The
+linear probe the allocator replaced (one SELECT per taken suffix) is timed
+on the same data for comparison, without inserting.
+
+Usage: python benchmarks/bench_username_allocation.py [--existing 10000] [--signups 200]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event, insert
+
+from src.main import create_app
+from src.cli import init_db
+from src.models.user import db, User
+from src.routes.oauth import create_or_get_oauth_user
+
+BASE = 'contact'
+CHUNK_SIZE = 10000
+
+def seed_users(count):
+    now = datetime.utcnow()
+    rows = [{
+        'username': BASE if i == 0 else f'{BASE}{i}',
+        'email': f'{BASE}.{i}@seed.example.com',
+        'password_hash': 'x',
+        'first_name': 'Seed',
+        'last_name': str(i),
+        'user_type': 'buyer',
+        'is_verified': True,
+        'is_active': True,
+        'created_at': now
+    } for i in range(count)]
+    with db.engine.begin() as connection:
+        for start in range(0, len(rows), CHUNK_SIZE):
+            connection.execute(insert(User.__table__), rows[start:start + CHUNK_SIZE])
+
+def linear_probe(base):
+    """The previous allocation: SELECT base, base1, base2... until one is free"""
+    username = base
+    counter = 1
+    while User.query.filter_by(username=username).first():
+        username = f'{base}{counter}'
+        counter += 1
+    return username
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--existing', type=int, default=10000)
+    parser.add_argument('--signups', type=int, default=200)
+    parser.add_argument('--probes', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.join(tmp, "usernames.db")}',
+            'SESSION_BACKEND': 'memory',
+            'START_BACKGROUND_SERVICES': False
+        })
+        statements = [0]
+        with app.app_context():
+            init_db()
+            seed_users(args.existing)
+            event.listen(db.engine, 'before_cursor_execute', lambda *_: statements.__setitem__(0, statements[0] + 1))
+
+            timings = []
+            for i in range(args.signups):
+                started = time.perf_counter()
+                user, error = create_or_get_oauth_user('google', {
+                    'email': f'{BASE}@signup{i}.example.com', 'sub': f'bench-{i}',
+                    'given_name': 'Bench', 'family_name': str(i)
+                })
+                timings.append(time.perf_counter() - started)
+                if error:
+                    sys.exit(f'signup failed: {error}')
+                last_username = user.username
+                db.session.remove()
+            allocator_statements = statements[0] / args.signups
+            print(f'allocator     {args.signups} signups over {args.existing} "{BASE}" users: '
+                  f'median {statistics.median(timings) * 1000:.2f}ms, p95 {percentile(timings, 0.95) * 1000:.2f}ms, '
+                  f'{allocator_statements:.1f} statements/signup, last {last_username}')
+
+            statements[0] = 0
+            probes = []
+            for _ in range(args.probes):
+                started = time.perf_counter()
+                linear_probe(BASE)
+                probes.append(time.perf_counter() - started)
+                db.session.remove()
+            print(f'linear probe  median {statistics.median(probes) * 1000:.2f}ms, '
+                  f'{statements[0] / args.probes:.0f} statements/signup (lookup only)')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+"""Synthetic marketplace datasets for the benchmarks.
+
+generate_dataset() fills an empty database with users, products, messages,
+orders and favorites whose shapes follow what a marketplace looks like at
+scale rather than uniform noise:
+
+- a few sellers own most listings (Pareto-distributed listing counts)
+- categories, brands and conditions follow fixed popularity weights and
+  prices are log-normal around a per-category median
+- listings cluster around French cities with a gaussian scatter
+- message threads have power-law lengths: most are one or two messages,
+  a handful run into the hundreds
+- about a third of the listings were marked down one to three times since
+  they were published
+
+Rows are written with Core ``executemany`` in chunks, so a million products
+take minutes rather than hours.  The same seed always gives the same data.
+"""
+import math
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from src.models.user import User, Product, Message, Order, Favorite, PriceHistory
+from src.services.hashing import hash_password
+
+BENCH_PASSWORD = 'password123'
+CHUNK_SIZE = 10000
+
+# category -> (weight, median price, brands with weights)
+CATEGORIES = {
+    'mode': (40, 35, [('Zara', 20), ('Nike', 18), ('Adidas', 15), ('H&M', 15), ('Levi\'s', 8), (None, 24)]),
+    'electronique': (20, 180, [('Apple', 30), ('Samsung', 25), ('Sony', 10), ('Xiaomi', 10), (None, 25)]),
+    'maison': (15, 60, [('Ikea', 35), ('Maisons du Monde', 15), (None, 50)]),
+    'sport': (10, 70, [('Decathlon', 40), ('Nike', 15), ('Adidas', 15), (None, 30)]),
+    'auto': (5, 250, [('Michelin', 20), ('Bosch', 20), (None, 60)]),
+    'livres': (10, 8, [(None, 100)])
+}
+CONDITIONS = [('new', 10), ('excellent', 25), ('good', 45), ('fair', 20)]
+STATUSES = [('active', 80), ('sold', 15), ('draft', 3), ('suspended', 2)]
+# city -> (weight, latitude, longitude)
+CITIES = {
+    'Paris': (35, 48.8566, 2.3522),
+    'Lyon': (12, 45.7640, 4.8357),
+    'Marseille': (12, 43.2965, 5.3698),
+    'Toulouse': (8, 43.6047, 1.4442),
+    'Bordeaux': (7, 44.8378, -0.5792),
+    'Lille': (7, 50.6292, 3.0573),
+    'Nantes': (6, 47.2184, -1.5536),
+    'Strasbourg': (5, 48.5734, 7.7521),
+    'Rennes': (4, 48.1173, -1.6778),
+    'Montpellier': (4, 43.6108, 3.8767)
+}
+MESSAGE_LINES = [
+    'Bonjour, est-ce toujours disponible ?',
+    'Oui, toujours disponible.',
+    'Vous pouvez faire un prix ?',
+    'Je peux descendre un peu, que proposez-vous ?',
+    'Envoi possible ou remise en main propre ?',
+    'Merci, je réfléchis et je reviens vers vous.'
+]
+
+def _choices(rng, weighted, k):
+    values = [value for value, _ in weighted]
+    weights = [weight for _, weight in weighted]
+    return rng.choices(values, weights=weights, k=k)
+
+def _insert_chunked(connection, table, rows):
+    for start in range(0, len(rows), CHUNK_SIZE):
+        connection.execute(insert(table), rows[start:start + CHUNK_SIZE])
+
+def dataset_sizes(products):
+    """Row counts derived from the product count"""
+    return {
+        'users': max(100, products // 10),
+        'products': products,
+        'threads': max(50, products // 4),
+        'orders': max(50, products // 20),
+        'favorites': max(100, products // 2)
+    }
+
+def generate_dataset(engine, products, seed=42):
+    """Insert a synthetic marketplace into an empty schema, returns the row counts"""
+    rng = random.Random(seed)
+    sizes = dataset_sizes(products)
+    now = datetime.utcnow()
+    password_hash = hash_password(BENCH_PASSWORD)
+
+    def past(days):
+        return now - timedelta(seconds=rng.uniform(0, days * 86400))
+
+    users = []
+    for i in range(sizes['users']):
+        users.append({
+            'id': i + 1,
+            'username': f'user{i}',
+            'email': f'user{i}@example.com',
+            'password_hash': password_hash,
+            'first_name': 'Bench',
+            'last_name': str(i),
+            'user_type': _choices(rng, [('buyer', 60), ('seller', 15), ('both', 25)], 1)[0],
+            'rating': round(rng.uniform(3, 5), 1),
+            'total_reviews': int(rng.paretovariate(1.5)) - 1,
+            'is_verified': rng.random() < 0.6,
+            'is_active': True,
+            'created_at': past(730)
+        })
+
+    # Pareto weights: a few power sellers own most listings
+    seller_weights = [rng.paretovariate(1.16) for _ in users]
+    category_names = list(CATEGORIES)
+    category_weights = [CATEGORIES[name][0] for name in category_names]
+    city_names = list(CITIES)
+    city_weights = [CITIES[name][0] for name in city_names]
+
+    # Per-product columns the later tables depend on; full rows are built per chunk
+    sellers = rng.choices(range(1, len(users) + 1), weights=seller_weights, k=products)
+    created = [past(365) for _ in range(products)]
+    statuses = _choices(rng, STATUSES, products)
+    views = [int(rng.paretovariate(1.1) * 5) for _ in range(products)]
+    prices = []
+    categories = rng.choices(category_names, weights=category_weights, k=products)
+    for category in categories:
+        prices.append(round(math.exp(rng.gauss(math.log(CATEGORIES[category][1]), 0.8)), 2))
+
+    price_rows = []
+    for index in range(products):
+        steps = 0 if rng.random() < 0.65 else rng.randint(1, 3)
+        price = round(prices[index] * (1 + 0.1 * steps * rng.uniform(0.5, 1.5)), 2)
+        changed_at = created[index]
+        for step in range(steps + 1):
+            if step == steps:
+                price = prices[index]
+            price_rows.append({'product_id': index + 1, 'ts': changed_at, 'price': price})
+            changed_at = changed_at + (now - changed_at) * rng.uniform(0.1, 0.5)
+            price = round(price * rng.uniform(0.85, 0.97), 2)
+
+    message_rows = []
+    for _ in range(sizes['threads']):
+        index = rng.randrange(products)
+        seller_id = sellers[index]
+        buyer_id = rng.randint(1, len(users))
+        if buyer_id == seller_id:
+            continue
+        length = min(200, int(rng.paretovariate(1.3)))
+        sent_at = created[index]
+        for turn in range(length):
+            sent_at = sent_at + timedelta(minutes=rng.expovariate(1 / 90))
+            from_buyer = turn % 2 == 0
+            message_rows.append({
+                'content': rng.choice(MESSAGE_LINES),
+                'sender_id': buyer_id if from_buyer else seller_id,
+                'receiver_id': seller_id if from_buyer else buyer_id,
+                'product_id': index + 1,
+                'is_read': rng.random() < 0.8,
+                'created_at': sent_at
+            })
+
+    order_rows = []
+    sold = [index for index, status in enumerate(statuses) if status == 'sold']
+    for index in rng.sample(sold, min(len(sold), sizes['orders'])):
+        ordered_at = created[index] + timedelta(days=rng.uniform(0, 30))
+        order_rows.append({
+            'buyer_id': rng.randint(1, len(users)),
+            'seller_id': sellers[index],
+            'product_id': index + 1,
+            'quantity': 1,
+            'total_price': prices[index],
+            'payment_method': _choices(rng, [('mtn_mobile_money', 50), ('card', 35), ('cash', 15)], 1)[0],
+            'payment_status': 'paid',
+            'order_status': _choices(rng, [('confirmed', 20), ('shipped', 30), ('delivered', 50)], 1)[0],
+            'created_at': ordered_at,
+            'updated_at': ordered_at
+        })
+
+    # Popular listings collect most favorites
+    favorite_pairs = set()
+    for index in rng.choices(range(products), weights=views, k=sizes['favorites']):
+        favorite_pairs.add((rng.randint(1, len(users)), index + 1))
+    favorite_rows = [{'user_id': user_id, 'product_id': product_id, 'created_at': past(180)}
+                     for user_id, product_id in favorite_pairs]
+    favorites_count = [0] * products
+    for _, product_id in favorite_pairs:
+        favorites_count[product_id - 1] += 1
+
+    with engine.begin() as connection:
+        _insert_chunked(connection, User.__table__, users)
+        for start in range(0, products, CHUNK_SIZE):
+            chunk = range(start, min(start + CHUNK_SIZE, products))
+            cities = rng.choices(city_names, weights=city_weights, k=len(chunk))
+            conditions = _choices(rng, CONDITIONS, len(chunk))
+            rows = []
+            for offset, index in enumerate(chunk):
+                category = categories[index]
+                brands = CATEGORIES[category][2]
+                city = cities[offset]
+                _, latitude, longitude = CITIES[city]
+                rows.append({
+                    'id': index + 1,
+                    'title': f'{category.capitalize()} article {index}',
+                    'description': 'Article en bon état, envoi possible. ' * rng.randint(1, 4),
+                    'price': prices[index],
+                    'category': category,
+                    'brand': _choices(rng, brands, 1)[0],
+                    'condition': conditions[offset],
+                    'location': f'{city}, France',
+                    'latitude': latitude + rng.gauss(0, 0.05),
+                    'longitude': longitude + rng.gauss(0, 0.07),
+                    'status': statuses[index],
+                    'views': views[index],
+                    'favorites_count': favorites_count[index],
+                    'seller_id': sellers[index],
+                    'created_at': created[index],
+                    'updated_at': created[index]
+                })
+            connection.execute(insert(Product.__table__), rows)
+        _insert_chunked(connection, Message.__table__, message_rows)
+        _insert_chunked(connection, Order.__table__, order_rows)
+        _insert_chunked(connection, Favorite.__table__, favorite_rows)
+        _insert_chunked(connection, PriceHistory.__table__, price_rows)
+
+    return {
+        'users': len(users),
+        'products': products,
+        'messages': len(message_rows),
+        'orders': len(order_rows),
+        'favorites': len(favorite_rows),
+        'price_points': len(price_rows)
+    }
+
+def busiest_user(engine):
+    """Id and email of the user with the most messages, for authenticated scenarios"""
+    with engine.connect() as connection:
+        row = connection.exec_driver_sql(
+            'SELECT u.id, u.email FROM user u JOIN message m ON m.receiver_id = u.id '
+            'GROUP BY u.id ORDER BY COUNT(*) DESC LIMIT 1'
+        ).first()
+    return row.id, row.email
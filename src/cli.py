@@ -0,0 +1,242 @@
+import click
+from sqlalchemy import delete, func, select, update
+from src.models.user import db, User, Product, Message, Favorite
+from src.services.bulk_import import ENTITIES, DEFAULT_CHUNK_SIZE, BulkImportError, import_file
+from src.services.price_history import compact_price_history, refresh_category_medians
+from src.services.events import flush_events, roll_up_events, prune_events
+from src.services.counters import reconcile_counters
+from src.services.archive import run_archival
+
+def init_db():
+    """Create missing tables, and the indexes added since on existing ones"""
+    db.create_all()
+    # create_all() skips tables that already exist, their new indexes included
+    with db.engine.begin() as connection:
+        _remove_duplicate_favorites(connection)
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+
+def _remove_duplicate_favorites(connection):
+    """Keep the first of duplicate favorites so ux_favorite_user_product can be built"""
+    first = select(func.min(Favorite.id)).group_by(Favorite.user_id, Favorite.product_id)
+    duplicates = select(Favorite.product_id).where(Favorite.id.not_in(first)).distinct()
+    product_ids = connection.execute(duplicates).scalars().all()
+    if not product_ids:
+        return
+    connection.execute(delete(Favorite).where(Favorite.id.not_in(first)))
+    connection.execute(
+        update(Product)
+        .where(Product.id.in_(product_ids))
+        .values(favorites_count=select(func.count()).where(Favorite.product_id == Product.id)
+                .scalar_subquery())
+    )
+
+def seed_sample_data():
+    """Create sample users, products and messages if the database is empty"""
+    if User.query.count() > 0:
+        return False
+    
+    # Create sample users
+    user1 = User(
+        username='jeandupont',
+        email='jean.dupont@email.com',
+        first_name='Jean',
+        last_name='Dupont',
+        user_type='both',
+        phone='+33 6 12 34 56 78',
+        address='123 Rue de la Paix, 75001 Paris',
+        rating=4.8,
+        total_reviews=127,
+        is_verified=True
+    )
+    user1.set_password('password123')
+
+    user2 = User(
+        username='marieleblanc',
+        email='marie.leblanc@email.com',
+        first_name='Marie',
+        last_name='Leblanc',
+        user_type='buyer',
+        phone='+33 6 98 76 54 32',
+        address='456 Avenue des Champs, 69000 Lyon',
+        rating=4.9,
+        total_reviews=89,
+        is_verified=True
+    )
+    user2.set_password('password123')
+
+    user3 = User(
+        username='pierremartin',
+        email='pierre.martin@email.com',
+        first_name='Pierre',
+        last_name='Martin',
+        user_type='seller',
+        phone='+33 6 11 22 33 44',
+        address='789 Boulevard Saint-Michel, 13000 Marseille',
+        rating=4.7,
+        total_reviews=156,
+        is_verified=True
+    )
+    user3.set_password('password123')
+
+    db.session.add_all([user1, user2, user3])
+    db.session.commit()
+
+    # Create sample products
+    product1 = Product(
+        title='iPhone 13 Pro Max 256GB Bleu',
+        description='iPhone 13 Pro Max en excellent état, utilisé avec précaution. Livré avec boîte et accessoires d\'origine.',
+        price=1099.0,
+        category='electronique',
+        brand='Apple',
+        condition='excellent',
+        color='Bleu',
+        location='Paris 15e',
+        latitude=48.8566,
+        longitude=2.3522,
+        images='["iphone1.jpg", "iphone2.jpg", "iphone3.jpg"]',
+        status='active',
+        views=234,
+        favorites_count=12,
+        seller_id=user1.id
+    )
+
+    product2 = Product(
+        title='Nike Air Max 270 Blanc',
+        description='Baskets Nike Air Max 270 en très bon état, portées quelques fois seulement. Taille 42.',
+        price=89.0,
+        category='mode',
+        brand='Nike',
+        condition='good',
+        size='42',
+        color='Blanc',
+        location='Lyon 3e',
+        latitude=45.7640,
+        longitude=4.8357,
+        images='["nike1.jpg", "nike2.jpg"]',
+        status='sold',
+        views=156,
+        favorites_count=8,
+        seller_id=user1.id
+    )
+
+    product3 = Product(
+        title='MacBook Air M2 13" 256GB',
+        description='MacBook Air M2 neuf, encore sous garantie. Parfait pour le travail et les études.',
+        price=999.0,
+        category='electronique',
+        brand='Apple',
+        condition='new',
+        color='Gris sidéral',
+        location='Marseille 1er',
+        latitude=43.2965,
+        longitude=5.3698,
+        images='["macbook1.jpg", "macbook2.jpg", "macbook3.jpg"]',
+        status='active',
+        views=89,
+        favorites_count=15,
+        seller_id=user3.id
+    )
+
+    db.session.add_all([product1, product2, product3])
+    db.session.commit()
+
+    # Create sample messages
+    message1 = Message(
+        content='Bonjour ! Je suis intéressée par votre iPhone 13 Pro Max. Est-il toujours disponible ?',
+        sender_id=user2.id,
+        receiver_id=user1.id,
+        product_id=product1.id
+    )
+
+    message2 = Message(
+        content='Bonjour Marie ! Oui, il est toujours disponible 😊',
+        sender_id=user1.id,
+        receiver_id=user2.id,
+        product_id=product1.id
+    )
+
+    message3 = Message(
+        content='Parfait ! Pouvez-vous me dire dans quel état il est exactement ?',
+        sender_id=user2.id,
+        receiver_id=user1.id,
+        product_id=product1.id
+    )
+
+    db.session.add_all([message1, message2, message3])
+    db.session.commit()
+    
+    return True
+
+def register_cli(app):
+    """Register the database maintenance commands on the app"""
+
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create the database schema."""
+        init_db()
+        click.echo('Schéma de la base de données créé')
+
+    @app.cli.command('seed-db')
+    def seed_db_command():
+        """Create the schema and load the sample data into an empty database."""
+        init_db()
+        if seed_sample_data():
+            click.echo('Données d\'exemple créées')
+        else:
+            click.echo('La base contient déjà des utilisateurs, rien à faire')
+
+    @app.cli.command('import-data')
+    @click.argument('entity', type=click.Choice(sorted(ENTITIES)))
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), help='Default: from the file extension')
+    @click.option('--chunk-size', default=DEFAULT_CHUNK_SIZE, show_default=True)
+    @click.option('--defer-indexes/--keep-indexes', default=False, show_default=True,
+                  help='Drop secondary indexes during the load and rebuild them after (empty tables only)')
+    def import_data_command(entity, path, fmt, chunk_size, defer_indexes):
+        """Bulk-load users, products or messages from a CSV or NDJSON file."""
+        init_db()
+        try:
+            report = import_file(entity, path, fmt, chunk_size=chunk_size, defer_indexes=defer_indexes)
+        except BulkImportError as e:
+            raise click.ClickException(str(e))
+        click.echo(f"{report['inserted']} lignes importées, {report['rejected']} rejetées "
+                   f"en {report['seconds']}s ({report['rows_per_second']} lignes/s)")
+        for error in report['errors'][:20]:
+            click.echo(f"  ligne {error['line']}: {error['error']}", err=True)
+
+    @app.cli.command('compact-price-history')
+    def compact_price_history_command():
+        """Downsample old price points and refresh today's category medians."""
+        categories = refresh_category_medians(force=True)
+        points, days = compact_price_history()
+        click.echo(f'{points} points et {days} agrégats journaliers compactés, '
+                   f'médiane de {categories} catégories mise à jour')
+
+    @app.cli.command('roll-up-events')
+    def roll_up_events_command():
+        """Fold pending activity events into the hourly/daily rollups."""
+        flush_events()
+        folded = roll_up_events()
+        events, hours = prune_events()
+        click.echo(f'{folded} événements agrégés, {events} événements et {hours} lignes horaires purgés')
+
+    @app.cli.command('reconcile-counters')
+    def reconcile_counters_command():
+        """Recount the per-user counters and fix the rows that drifted."""
+        users, drifted = reconcile_counters()
+        click.echo(f'{users} utilisateurs vérifiés, {drifted} compteurs corrigés')
+
+    @app.cli.command('archive-cold-data')
+    @click.option('--batch-size', type=int, help='Rows per transaction (default: ARCHIVE_BATCH_SIZE)')
+    @click.option('--max-batches', type=int, help='Batches per table (default: ARCHIVE_MAX_BATCHES)')
+    @click.option('--pause', type=float, help='Seconds between batches (default: ARCHIVE_BATCH_PAUSE)')
+    def archive_cold_data_command(batch_size, max_batches, pause):
+        """Move sold listings, old read messages and stale carts to the archive tables."""
+        options = {'batch_size': batch_size, 'max_batches': max_batches}
+        if pause is not None:
+            options['pause'] = pause
+        moved = run_archival(**options)
+        click.echo(f"{moved['products']} produits, {moved['messages']} messages et "
+                   f"{moved['carts']} paniers archivés")
@@ -1,8 +1,9 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+from src.services.hashing import hash_password, verify_password
+from src.services.replicas import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -24,6 +25,12 @@ class User(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_login = db.Column(db.DateTime)
     
+    # Directory filters, keyset-paginated on id
+    __table_args__ = (
+        db.Index('ix_user_type', 'user_type'),
+        db.Index('ix_user_created_at', 'created_at'),
+    )
+    
     # Relations
     products = db.relationship('Product', backref='seller', lazy=True, foreign_keys='Product.seller_id')
     sent_messages = db.relationship('Message', backref='sender', lazy=True, foreign_keys='Message.sender_id')
@@ -34,10 +41,10 @@ class User(db.Model):
     reviews_received = db.relationship('Review', backref='reviewed_user', lazy=True, foreign_keys='Review.reviewed_user_id')
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
 
     def __repr__(self):
         return f'<User {self.username}>'
@@ -57,8 +64,8 @@ class User(db.Model):
             'total_reviews': self.total_reviews,
             'is_verified': self.is_verified,
             'is_active': self.is_active,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'last_login': self.last_login.isoformat() if self.last_login else None
+            'created_at': self.created_at,
+            'last_login': self.last_login
         }
 
 class Product(db.Model):
@@ -75,7 +82,7 @@ class Product(db.Model):
     latitude = db.Column(db.Float)
     longitude = db.Column(db.Float)
     images = db.Column(db.Text)  # JSON string of image URLs
-    status = db.Column(db.String(20), default='active')  # active, sold, draft, suspended
+    status = db.Column(db.String(20), default='active')  # active, reserved, sold, draft, suspended
     views = db.Column(db.Integer, default=0)
     favorites_count = db.Column(db.Integer, default=0)
     seller_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -107,8 +114,8 @@ class Product(db.Model):
             'favorites_count': self.favorites_count,
             'seller_id': self.seller_id,
             'seller': self.seller.to_dict() if self.seller else None,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+            'created_at': self.created_at,
+            'updated_at': self.updated_at
         }
 
 class Message(db.Model):
@@ -120,6 +127,11 @@ class Message(db.Model):
     is_read = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # Latest messages of an inbox (dashboard summary) without a sort
+    __table_args__ = (
+        db.Index('ix_message_receiver_created', 'receiver_id', 'created_at'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -128,7 +140,7 @@ class Message(db.Model):
             'receiver_id': self.receiver_id,
             'product_id': self.product_id,
             'is_read': self.is_read,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'created_at': self.created_at,
             'sender': self.sender.to_dict() if self.sender else None,
             'receiver': self.receiver.to_dict() if self.receiver else None,
             'product': self.product.to_dict() if self.product else None
@@ -143,12 +155,18 @@ class Order(db.Model):
     total_price = db.Column(db.Float, nullable=False)
     shipping_address = db.Column(db.Text)
     payment_method = db.Column(db.String(50))  # mtn_mobile_money, card, cash
-    payment_status = db.Column(db.String(20), default='pending')  # pending, paid, failed, refunded
+    payment_status = db.Column(db.String(20), default='pending')  # pending, paid, failed, refund_pending, refunded
     order_status = db.Column(db.String(20), default='pending')  # pending, confirmed, shipped, delivered, cancelled
     tracking_number = db.Column(db.String(100))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    # Serve the my-orders / my-sales listings and their exports in index order
+    __table_args__ = (
+        db.Index('ix_order_buyer_created', 'buyer_id', 'created_at'),
+        db.Index('ix_order_seller_created', 'seller_id', 'created_at'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -162,8 +180,8 @@ class Order(db.Model):
             'payment_status': self.payment_status,
             'order_status': self.order_status,
             'tracking_number': self.tracking_number,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at,
             'buyer': self.buyer.to_dict() if self.buyer else None,
             'seller': self.seller.to_dict() if self.seller else None,
             'product': self.product.to_dict() if self.product else None
@@ -186,7 +204,7 @@ class Review(db.Model):
             'order_id': self.order_id,
             'rating': self.rating,
             'comment': self.comment,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'created_at': self.created_at,
             'reviewer': self.reviewer.to_dict() if self.reviewer else None,
             'reviewed_user': self.reviewed_user.to_dict() if self.reviewed_user else None
         }
@@ -197,12 +215,17 @@ class Favorite(db.Model):
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # Conflict target of the favorite upsert; also serves per-user lookups
+    __table_args__ = (
+        db.Index('ux_favorite_user_product', 'user_id', 'product_id', unique=True),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
             'user_id': self.user_id,
             'product_id': self.product_id,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'created_at': self.created_at,
             'product': self.product.to_dict() if self.product else None
         }
 
@@ -222,7 +245,286 @@ class Cart(db.Model):
             'user_id': self.user_id,
             'product_id': self.product_id,
             'quantity': self.quantity,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'created_at': self.created_at,
             'product': self.product.to_dict() if self.product else None
         }
 
+
+class ProductReservation(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False, index=True)
+    buyer_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'))
+    status = db.Column(db.String(20), nullable=False, default='held')  # held, completed, released, expired
+    expires_at = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_product_reservation_status_expires', 'status', 'expires_at'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'product_id': self.product_id,
+            'buyer_id': self.buyer_id,
+            'order_id': self.order_id,
+            'status': self.status,
+            'expires_at': self.expires_at,
+            'created_at': self.created_at
+        }
+
+# Last numeric suffix handed out per username base (see services.usernames)
+class UsernameSequence(db.Model):
+    base = db.Column(db.String(80), primary_key=True)
+    last_suffix = db.Column(db.Integer, nullable=False, default=0)
+
+# Denormalized per-user counts for the navbar and dashboard tabs, kept in step
+# by services.counters and reconciled nightly against the source tables
+class UserCounters(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    unread_messages = db.Column(db.Integer, nullable=False, default=0)
+    orders_pending = db.Column(db.Integer, nullable=False, default=0)
+    orders_confirmed = db.Column(db.Integer, nullable=False, default=0)
+    orders_shipped = db.Column(db.Integer, nullable=False, default=0)
+    orders_delivered = db.Column(db.Integer, nullable=False, default=0)
+    orders_cancelled = db.Column(db.Integer, nullable=False, default=0)
+    sales_pending = db.Column(db.Integer, nullable=False, default=0)
+    sales_confirmed = db.Column(db.Integer, nullable=False, default=0)
+    sales_shipped = db.Column(db.Integer, nullable=False, default=0)
+    sales_delivered = db.Column(db.Integer, nullable=False, default=0)
+    sales_cancelled = db.Column(db.Integer, nullable=False, default=0)
+    active_listings = db.Column(db.Integer, nullable=False, default=0)
+    listing_views = db.Column(db.Integer, nullable=False, default=0)
+    listing_favorites = db.Column(db.Integer, nullable=False, default=0)
+    reconciled_at = db.Column(db.DateTime)
+
+# Non-cancelled sales of a seller per calendar month (UTC) of the order date,
+# maintained with the sales counters
+class SellerRevenue(db.Model):
+    seller_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    month = db.Column(db.Date, primary_key=True)  # first day of the month
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = {'sqlite_with_rowid': False}
+
+# One row per paid premium period; the entitlement resolver reads the latest
+# unexpired active row of a user through (user_id, expires_at)
+class Subscription(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    plan = db.Column(db.String(20), nullable=False)  # basic, pro, enterprise
+    status = db.Column(db.String(20), nullable=False, default='active')  # active, cancelled, expired
+    starts_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    amount = db.Column(db.Float)
+    provider = db.Column(db.String(20))
+    transaction_id = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    cancelled_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_subscription_user_expires', 'user_id', 'expires_at'),
+        db.Index('ix_subscription_status_expires', 'status', 'expires_at'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'plan': self.plan,
+            'status': self.status,
+            'starts_at': self.starts_at,
+            'expires_at': self.expires_at,
+            'amount': self.amount,
+            'provider': self.provider,
+            'transaction_id': self.transaction_id,
+            'created_at': self.created_at,
+            'cancelled_at': self.cancelled_at
+        }
+
+# Append-only, one row per price change.  Clustered on (product_id, ts) without
+# a rowid so a product's points sit together; old points are folded into
+# PriceAggregate rows by services.price_history.
+class PriceHistory(db.Model):
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    ts = db.Column(db.DateTime, primary_key=True, default=datetime.utcnow)
+    price = db.Column(db.Float, nullable=False)
+
+    __table_args__ = {'sqlite_with_rowid': False}
+
+class PriceAggregate(db.Model):
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    granularity = db.Column(db.String(5), primary_key=True)  # day, week (OHLC of the period)
+    period_start = db.Column(db.DateTime, primary_key=True)
+    open_price = db.Column(db.Float, nullable=False)
+    close_price = db.Column(db.Float, nullable=False)
+    min_price = db.Column(db.Float, nullable=False)
+    max_price = db.Column(db.Float, nullable=False)
+    avg_price = db.Column(db.Float, nullable=False)
+    samples = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = {'sqlite_with_rowid': False}
+
+# Median asking price of a category's active listings, one row per day
+class CategoryPriceStat(db.Model):
+    category = db.Column(db.String(50), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    median_price = db.Column(db.Float, nullable=False)
+    listings = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = {'sqlite_with_rowid': False}
+
+# Append-only activity log fed by services.events; rolled up by id watermark
+class Event(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # view, favorite, cart_add, message, order
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    seller_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    actor_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    value = db.Column(db.Float, nullable=False, default=0.0)  # order amount
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class ProductActivity(db.Model):
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    granularity = db.Column(db.String(5), primary_key=True)  # hour, day
+    period_start = db.Column(db.DateTime, primary_key=True)
+    views = db.Column(db.Integer, nullable=False, default=0)
+    favorites = db.Column(db.Integer, nullable=False, default=0)
+    cart_adds = db.Column(db.Integer, nullable=False, default=0)
+    messages = db.Column(db.Integer, nullable=False, default=0)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+
+    __table_args__ = {'sqlite_with_rowid': False}
+
+class SellerActivity(db.Model):
+    seller_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    granularity = db.Column(db.String(5), primary_key=True)  # hour, day
+    period_start = db.Column(db.DateTime, primary_key=True)
+    views = db.Column(db.Integer, nullable=False, default=0)
+    favorites = db.Column(db.Integer, nullable=False, default=0)
+    cart_adds = db.Column(db.Integer, nullable=False, default=0)
+    messages = db.Column(db.Integer, nullable=False, default=0)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+
+    __table_args__ = {'sqlite_with_rowid': False}
+
+# Last event id folded into the activity rollups
+class RollupCursor(db.Model):
+    name = db.Column(db.String(50), primary_key=True)
+    last_event_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime)
+
+# Cold copies moved out of product / message / cart by services.archive.  Rows
+# keep their original id so references (orders, favorites...) still resolve.
+class ArchivedProduct(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(200), nullable=False)
+    description = db.Column(db.Text, nullable=False)
+    price = db.Column(db.Float, nullable=False)
+    category = db.Column(db.String(50), nullable=False)
+    brand = db.Column(db.String(100))
+    condition = db.Column(db.String(20), nullable=False)
+    size = db.Column(db.String(20))
+    color = db.Column(db.String(50))
+    location = db.Column(db.String(200))
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    images = db.Column(db.Text)
+    status = db.Column(db.String(20))
+    views = db.Column(db.Integer, default=0)
+    favorites_count = db.Column(db.Integer, default=0)
+    seller_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    seller = db.relationship('User')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'title': self.title,
+            'description': self.description,
+            'price': self.price,
+            'category': self.category,
+            'brand': self.brand,
+            'condition': self.condition,
+            'size': self.size,
+            'color': self.color,
+            'location': self.location,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'images': self.images,
+            'status': self.status,
+            'views': self.views,
+            'favorites_count': self.favorites_count,
+            'seller_id': self.seller_id,
+            'seller': self.seller.to_dict() if self.seller else None,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at,
+            'archived': True
+        }
+
+class ArchivedMessage(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    content = db.Column(db.Text, nullable=False)
+    sender_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    receiver_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    product_id = db.Column(db.Integer)  # live or archived product
+    is_read = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    sender = db.relationship('User', foreign_keys=[sender_id])
+    receiver = db.relationship('User', foreign_keys=[receiver_id])
+
+    # Conversation read-through: both directions of a pair are index ranges
+    __table_args__ = (
+        db.Index('ix_archived_message_pair_created', 'sender_id', 'receiver_id', 'created_at'),
+        db.Index('ix_archived_message_receiver', 'receiver_id'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'content': self.content,
+            'sender_id': self.sender_id,
+            'receiver_id': self.receiver_id,
+            'product_id': self.product_id,
+            'is_read': self.is_read,
+            'created_at': self.created_at,
+            'sender': self.sender.to_dict() if self.sender else None,
+            'receiver': self.receiver.to_dict() if self.receiver else None,
+            'product': None,  # filled in by services.archive
+            'archived': True
+        }
+
+class ArchivedCart(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    product_id = db.Column(db.Integer, nullable=False)
+    quantity = db.Column(db.Integer, default=1)
+    created_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+# Leadership of the job scheduler: the holder runs the deployment-wide jobs
+# until expires_at, renewing well before (see services.scheduler)
+# Values picked once and shared by every worker (the calibrated password hash method)
+class AppSetting(db.Model):
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.String(255), nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class SchedulerLease(db.Model):
+    name = db.Column(db.String(50), primary_key=True)
+    holder = db.Column(db.String(100), nullable=False)
+    acquired_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+class ReplicaHeartbeat(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    beat_at = db.Column(db.DateTime, nullable=False)
@@ -0,0 +1,118 @@
+from flask import Blueprint, request, jsonify, Response
+from src.models.user import db
+from src.services.database import get_database_stats
+from src.services.replicas import get_replica_stats
+from src.services.identity import require_admin
+from src.services.profiling import list_profiles, get_profile, collapsed_stacks
+from src.services.metrics import server_error
+from src.services.admission import get_admission_stats
+from src.services.entitlements import get_entitlement_stats
+from src.services.scheduler import current_scheduler, get_scheduler_stats
+from src.services.archive import get_archive_stats
+from src.services.bulk_import import BulkImportError, detect_format, import_stream
+import io
+
+admin_bp = Blueprint('admin', __name__)
+
+@admin_bp.before_request
+def check_admin():
+    if not require_admin():
+        return jsonify({'error': 'Accès administrateur requis'}), 403
+
+@admin_bp.route('/db-stats', methods=['GET'])
+def get_db_stats():
+    """Get connection pool, lock-wait and archival statistics"""
+    try:
+        return jsonify({
+            'database': get_database_stats(db.engine),
+            'replicas': get_replica_stats(),
+            'archive': get_archive_stats()
+        }), 200
+        
+    except Exception as e:
+        return server_error(e)
+
+@admin_bp.route('/admission', methods=['GET'])
+def get_admission():
+    """Get rate limiting and in-flight cap statistics"""
+    try:
+        return jsonify({'admission': get_admission_stats()}), 200
+        
+    except Exception as e:
+        return server_error(e)
+
+@admin_bp.route('/entitlements', methods=['GET'])
+def get_entitlements():
+    """Get premium entitlement cache and subscription job statistics"""
+    try:
+        return jsonify({'entitlements': get_entitlement_stats()}), 200
+        
+    except Exception as e:
+        return server_error(e)
+
+@admin_bp.route('/jobs', methods=['GET'])
+def get_jobs():
+    """Get this worker's scheduled jobs with their health, timings and the scheduler leadership"""
+    try:
+        return jsonify({'scheduler': get_scheduler_stats()}), 200
+        
+    except Exception as e:
+        return server_error(e)
+
+@admin_bp.route('/jobs/<name>/run', methods=['POST'])
+def run_job(name):
+    """Make a scheduled job due now (leader-only jobs still run on the leader only)"""
+    try:
+        scheduler = current_scheduler()
+        if scheduler is None:
+            return jsonify({'error': 'Planificateur non démarré'}), 409
+        if not scheduler.run_now(name):
+            return jsonify({'error': 'Tâche non trouvée'}), 404
+        
+        return jsonify({'message': 'Tâche planifiée', 'job': name}), 202
+        
+    except Exception as e:
+        return server_error(e)
+
+@admin_bp.route('/profiles', methods=['GET'])
+def get_profiles():
+    """List the captured request profiles, newest first"""
+    return jsonify({'profiles': list_profiles()}), 200
+
+@admin_bp.route('/profiles/<profile_id>', methods=['GET'])
+def get_profile_detail(profile_id):
+    """Get a profile with its collapsed stacks and SQL statements"""
+    profile = get_profile(profile_id)
+    if not profile:
+        return jsonify({'error': 'Profil non trouvé'}), 404
+    return jsonify({'profile': profile}), 200
+
+@admin_bp.route('/profiles/<profile_id>/flamegraph', methods=['GET'])
+def download_flamegraph(profile_id):
+    """Download the collapsed stacks of a profile for flamegraph.pl or speedscope"""
+    profile = get_profile(profile_id)
+    if not profile:
+        return jsonify({'error': 'Profil non trouvé'}), 404
+    return Response(
+        collapsed_stacks(profile),
+        mimetype='text/plain',
+        headers={'Content-Disposition': f'attachment; filename=profile-{profile_id}.folded'}
+    )
+
+@admin_bp.route('/import/<entity>', methods=['POST'])
+def bulk_import(entity):
+    """Bulk-load users, products or messages from a streamed CSV or NDJSON body"""
+    try:
+        fmt = request.args.get('format') or detect_format(content_type=request.content_type)
+        stream = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+        report = import_stream(
+            entity, stream, fmt,
+            chunk_size=request.args.get('chunk_size', 10000, type=int),
+            defer_indexes=request.args.get('defer_indexes') == '1'
+        )
+        return jsonify(report), 200
+
+    except BulkImportError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return server_error(e)
@@ -1,5 +1,10 @@
 from flask import Blueprint, request, jsonify, session
 from src.models.user import db, User
+from src.services.hashing import HashingBusyError, needs_rehash
+from src.services.identity import require_auth, invalidate_user
+from src.services.metrics import server_error
+from src.services.counters import get_counters
+from src.services.sessions import regenerate_session
 from datetime import datetime
 
 auth_bp = Blueprint('auth', __name__)
@@ -20,11 +25,17 @@ def login():
             if not user.is_active:
                 return jsonify({'error': 'Compte désactivé'}), 403
             
+            # Upgrade hashes made with an older cost while we have the password
+            if needs_rehash(user.password_hash):
+                user.set_password(password)
+            
             # Update last login
             user.last_login = datetime.utcnow()
             db.session.commit()
+            invalidate_user(user.id)
             
-            # Store user in session
+            # Store user in session, under a new id
+            regenerate_session(session)
             session['user_id'] = user.id
             session['username'] = user.username
             
@@ -35,8 +46,10 @@ def login():
         else:
             return jsonify({'error': 'Email ou mot de passe incorrect'}), 401
             
+    except HashingBusyError as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @auth_bp.route('/register', methods=['POST'])
 def register():
@@ -72,6 +85,7 @@ def register():
         db.session.commit()
         
         # Auto-login after registration
+        regenerate_session(session)
         session['user_id'] = user.id
         session['username'] = user.username
         
@@ -80,9 +94,12 @@ def register():
             'user': user.to_dict()
         }), 201
         
+    except HashingBusyError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
     except Exception as e:
         db.session.rollback()
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @auth_bp.route('/logout', methods=['POST'])
 def logout():
@@ -91,27 +108,37 @@ def logout():
 
 @auth_bp.route('/me', methods=['GET'])
 def get_current_user():
-    user_id = session.get('user_id')
-    if not user_id:
+    if not session.get('user_id'):
         return jsonify({'error': 'Non authentifié'}), 401
     
-    user = User.query.get(user_id)
+    user = require_auth()
     if not user:
         session.clear()
         return jsonify({'error': 'Utilisateur non trouvé'}), 404
     
     return jsonify({'user': user.to_dict()}), 200
 
+@auth_bp.route('/me/counters', methods=['GET'])
+def get_my_counters():
+    """Unread messages, orders and sales per status and active listings of the current user"""
+    current_user = require_auth()
+    if not current_user:
+        return jsonify({'error': 'Non authentifié'}), 401
+    
+    try:
+        return jsonify({'counters': get_counters(current_user.id)}), 200
+        
+    except Exception as e:
+        return server_error(e)
+
 @auth_bp.route('/check-session', methods=['GET'])
 def check_session():
-    user_id = session.get('user_id')
-    if user_id:
-        user = User.query.get(user_id)
-        if user and user.is_active:
-            return jsonify({
-                'authenticated': True,
-                'user': user.to_dict()
-            }), 200
+    user = require_auth()
+    if user and user.is_active:
+        return jsonify({
+            'authenticated': True,
+            'user': user.to_dict()
+        }), 200
     
     return jsonify({'authenticated': False}), 200
 
@@ -0,0 +1,19 @@
+from flask import Blueprint, request, jsonify
+from src.services.batch import BatchError, parse_batch, run_batch
+from src.services.metrics import server_error
+
+batch_bp = Blueprint('batch', __name__)
+
+@batch_bp.route('', methods=['POST'])
+def batch():
+    """Run several API calls in one round-trip"""
+    try:
+        try:
+            specs = parse_batch(request.get_json(silent=True))
+        except BatchError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        return jsonify({'responses': run_batch(specs)}), 200
+        
+    except Exception as e:
+        return server_error(e)
@@ -0,0 +1,23 @@
+from flask import Blueprint, jsonify
+from src.services.identity import require_auth
+from src.services.metrics import server_error
+from src.services.dashboard import seller_summary, summary_ttl
+
+dashboard_bp = Blueprint('dashboard', __name__)
+
+@dashboard_bp.route('/summary', methods=['GET'])
+def get_summary():
+    """Listings, views, favorites, pending sales, monthly revenue and latest messages of the current user"""
+    current_user = require_auth()
+    if not current_user:
+        return jsonify({'error': 'Non authentifié'}), 401
+    
+    try:
+        response = jsonify({'summary': seller_summary(current_user.id)})
+        # Per user: only the browser may keep it, never a shared cache
+        response.headers['Cache-Control'] = f'private, max-age={summary_ttl()}'
+        response.vary.add('Cookie')
+        return response, 200
+        
+    except Exception as e:
+        return server_error(e)
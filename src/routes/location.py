@@ -1,23 +1,22 @@
 from flask import Blueprint, request, jsonify, session, send_file
 from src.models.user import db, User, Product
-import requests
+from src.services.identity import require_auth
+from src.services.replicas import replica_read
+from src.services.metrics import server_error, outbound_call
+from src.services.admission import rate_limited
 import os
 from io import BytesIO
 import base64
-from PIL import Image, ImageDraw, ImageFont
 import math
 
 location_bp = Blueprint('location', __name__)
 
-def require_auth():
-    """Helper function to check authentication"""
-    user_id = session.get('user_id')
-    if not user_id:
-        return None
-    return User.query.get(user_id)
-
 def generate_static_map(latitude, longitude, zoom=15, width=400, height=300, marker=True):
     """Generate a static map image using OpenStreetMap tiles"""
+    # Imported on first use so they don't weigh on application startup
+    import requests
+    from PIL import Image, ImageDraw, ImageFont
+
     try:
         # Calculate tile coordinates
         def deg2num(lat_deg, lon_deg, zoom):
@@ -61,9 +60,10 @@ def generate_static_map(latitude, longitude, zoom=15, width=400, height=300, mar
                 tile_url = f"https://tile.openstreetmap.org/{zoom}/{tile_x}/{tile_y}.png"
                 
                 try:
-                    response = requests.get(tile_url, timeout=5, headers={
-                        'User-Agent': 'Kitalamarket/1.0'
-                    })
+                    with outbound_call('osm_tiles'):
+                        response = requests.get(tile_url, timeout=5, headers={
+                            'User-Agent': 'Kitalamarket/1.0'
+                        })
                     if response.status_code == 200:
                         tile_image = Image.open(BytesIO(response.content))
                         map_image.paste(tile_image, (i * 256, j * 256))
@@ -109,8 +109,11 @@ def generate_static_map(latitude, longitude, zoom=15, width=400, height=300, mar
         return placeholder
 
 @location_bp.route('/geocode', methods=['POST'])
+@rate_limited('geocode')
 def geocode_address():
     """Convert address to coordinates using Nominatim API"""
+    import requests
+
     try:
         data = request.get_json()
         address = data.get('address')
@@ -131,7 +134,8 @@ def geocode_address():
             'User-Agent': 'Kitalamarket/1.0 (contact@kitalamarket.com)'
         }
         
-        response = requests.get(url, params=params, headers=headers, timeout=10)
+        with outbound_call('nominatim'):
+            response = requests.get(url, params=params, headers=headers, timeout=10)
         
         if response.status_code == 200:
             results = response.json()
@@ -149,11 +153,14 @@ def geocode_address():
             return jsonify({'error': 'Erreur du service de géocodage'}), 500
             
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @location_bp.route('/reverse-geocode', methods=['POST'])
+@rate_limited('geocode')
 def reverse_geocode():
     """Convert coordinates to address using Nominatim API"""
+    import requests
+
     try:
         data = request.get_json()
         latitude = data.get('latitude')
@@ -176,7 +183,8 @@ def reverse_geocode():
             'User-Agent': 'Kitalamarket/1.0 (contact@kitalamarket.com)'
         }
         
-        response = requests.get(url, params=params, headers=headers, timeout=10)
+        with outbound_call('nominatim'):
+            response = requests.get(url, params=params, headers=headers, timeout=10)
         
         if response.status_code == 200:
             result = response.json()
@@ -190,9 +198,10 @@ def reverse_geocode():
             return jsonify({'error': 'Erreur du service de géocodage inverse'}), 500
             
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @location_bp.route('/static-map', methods=['GET'])
+@rate_limited('maps')
 def get_static_map():
     """Generate and return a static map image"""
     try:
@@ -224,9 +233,10 @@ def get_static_map():
         return send_file(img_io, mimetype='image/png')
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @location_bp.route('/static-map-base64', methods=['GET'])
+@rate_limited('maps')
 def get_static_map_base64():
     """Generate and return a static map image as base64"""
     try:
@@ -266,7 +276,7 @@ def get_static_map_base64():
         }), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @location_bp.route('/product-location/<int:product_id>', methods=['GET'])
 def get_product_location(product_id):
@@ -298,9 +308,10 @@ def get_product_location(product_id):
         }), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @location_bp.route('/nearby-products', methods=['GET'])
+@replica_read
 def get_nearby_products():
     """Get products near a specific location"""
     try:
@@ -348,5 +359,5 @@ def get_nearby_products():
         }), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
@@ -1,17 +1,15 @@
 from flask import Blueprint, request, jsonify, session
-from src.models.user import db, Message, User, Product
+from src.models.user import db, Message, User, Product, ArchivedMessage
+from src.services.identity import require_auth
+from src.services.metrics import server_error
+from src.services.events import record_event
+from src.services.counters import get_counters, record_message_sent, record_messages_read
+from src.services.archive import archived_partners, archived_products, conversation_archive, fill_archived_products
 from datetime import datetime
-from sqlalchemy import or_, and_
+from sqlalchemy import or_, and_, update
 
 messages_bp = Blueprint('messages', __name__)
 
-def require_auth():
-    """Helper function to check authentication"""
-    user_id = session.get('user_id')
-    if not user_id:
-        return None
-    return User.query.get(user_id)
-
 @messages_bp.route('/conversations', methods=['GET'])
 def get_conversations():
     """Get all conversations for the current user"""
@@ -43,11 +41,25 @@ def get_conversations():
             if message.receiver_id == current_user.id and not message.is_read:
                 conversation_dict[partner_id]['unread_count'] += 1
         
+        # Conversations whose messages were all archived
+        for partner_id, last_message in archived_partners(current_user.id, exclude=conversation_dict).items():
+            partner = User.query.get(partner_id)
+            if partner:
+                conversation_dict[partner_id] = {
+                    'partner': partner.to_dict(),
+                    'last_message': last_message,
+                    'unread_count': 0,
+                    'product': last_message['product']
+                }
+        
         conversations_list = list(conversation_dict.values())
+        fill_archived_products([conversation['last_message'] for conversation in conversations_list])
+        for conversation in conversations_list:
+            conversation['product'] = conversation['product'] or conversation['last_message']['product']
         return jsonify({'conversations': conversations_list}), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @messages_bp.route('/conversation/<int:partner_id>', methods=['GET'])
 def get_conversation_messages(partner_id):
@@ -65,15 +77,16 @@ def get_conversation_messages(partner_id):
             )
         ).order_by(Message.created_at.asc()).all()
         
-        # Mark messages as read
-        unread_messages = Message.query.filter(
-            Message.sender_id == partner_id,
-            Message.receiver_id == current_user.id,
-            Message.is_read == False
-        ).all()
-        
-        for message in unread_messages:
-            message.is_read = True
+        # Mark messages as read; only the rows this UPDATE flips count, so
+        # concurrent opens of the conversation never decrement twice
+        marked = db.session.execute(
+            update(Message)
+            .where(Message.sender_id == partner_id,
+                   Message.receiver_id == current_user.id,
+                   Message.is_read == False)
+            .values(is_read=True)
+        ).rowcount
+        record_messages_read(current_user.id, marked)
         
         db.session.commit()
         
@@ -82,7 +95,9 @@ def get_conversation_messages(partner_id):
         if not partner:
             return jsonify({'error': 'Utilisateur non trouvé'}), 404
         
-        messages_data = [message.to_dict() for message in messages]
+        # Older messages may have been archived
+        messages_data = conversation_archive(current_user.id, partner_id) + \
+            fill_archived_products([message.to_dict() for message in messages])
         
         return jsonify({
             'messages': messages_data,
@@ -90,7 +105,7 @@ def get_conversation_messages(partner_id):
         }), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @messages_bp.route('/send', methods=['POST'])
 def send_message():
@@ -129,7 +144,11 @@ def send_message():
         )
         
         db.session.add(message)
+        if receiver.id != current_user.id:
+            record_message_sent(receiver.id)
         db.session.commit()
+        if product:
+            record_event('message', product.id, product.seller_id, current_user.id)
         
         return jsonify({
             'message': 'Message envoyé avec succès',
@@ -138,7 +157,7 @@ def send_message():
         
     except Exception as e:
         db.session.rollback()
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @messages_bp.route('/unread-count', methods=['GET'])
 def get_unread_count():
@@ -148,15 +167,12 @@ def get_unread_count():
         return jsonify({'error': 'Non authentifié'}), 401
     
     try:
-        unread_count = Message.query.filter(
-            Message.receiver_id == current_user.id,
-            Message.is_read == False
-        ).count()
+        unread_count = get_counters(current_user.id)['unread_messages']
         
         return jsonify({'unread_count': unread_count}), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @messages_bp.route('/mark-read/<int:message_id>', methods=['POST'])
 def mark_message_read(message_id):
@@ -168,19 +184,30 @@ def mark_message_read(message_id):
     try:
         message = Message.query.get(message_id)
         if not message:
-            return jsonify({'error': 'Message non trouvé'}), 404
+            # Only read messages are archived
+            archived = db.session.get(ArchivedMessage, message_id)
+            if not archived:
+                return jsonify({'error': 'Message non trouvé'}), 404
+            if archived.receiver_id != current_user.id:
+                return jsonify({'error': 'Non autorisé'}), 403
+            return jsonify({'message': 'Message marqué comme lu'}), 200
         
         if message.receiver_id != current_user.id:
             return jsonify({'error': 'Non autorisé'}), 403
         
-        message.is_read = True
+        marked = db.session.execute(
+            update(Message)
+            .where(Message.id == message.id, Message.is_read == False)
+            .values(is_read=True)
+        ).rowcount
+        record_messages_read(current_user.id, marked)
         db.session.commit()
         
         return jsonify({'message': 'Message marqué comme lu'}), 200
         
     except Exception as e:
         db.session.rollback()
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @messages_bp.route('/conversation/<int:partner_id>/product/<int:product_id>', methods=['GET'])
 def get_product_conversation(partner_id, product_id):
@@ -199,36 +226,38 @@ def get_product_conversation(partner_id, product_id):
             Message.product_id == product_id
         ).order_by(Message.created_at.asc()).all()
         
-        # Mark messages as read
-        unread_messages = Message.query.filter(
-            Message.sender_id == partner_id,
-            Message.receiver_id == current_user.id,
-            Message.product_id == product_id,
-            Message.is_read == False
-        ).all()
-        
-        for message in unread_messages:
-            message.is_read = True
+        # Mark messages as read (see get_conversation_messages)
+        marked = db.session.execute(
+            update(Message)
+            .where(Message.sender_id == partner_id,
+                   Message.receiver_id == current_user.id,
+                   Message.product_id == product_id,
+                   Message.is_read == False)
+            .values(is_read=True)
+        ).rowcount
+        record_messages_read(current_user.id, marked)
         
         db.session.commit()
         
         # Get partner and product info
         partner = User.query.get(partner_id)
         product = Product.query.get(product_id)
+        product_data = product.to_dict() if product else archived_products([product_id]).get(product_id)
         
-        if not partner or not product:
+        if not partner or not product_data:
             return jsonify({'error': 'Utilisateur ou produit non trouvé'}), 404
         
-        messages_data = [message.to_dict() for message in messages]
+        messages_data = conversation_archive(current_user.id, partner_id, product_id) + \
+            fill_archived_products([message.to_dict() for message in messages])
         
         return jsonify({
             'messages': messages_data,
             'partner': partner.to_dict(),
-            'product': product.to_dict()
+            'product': product_data
         }), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @messages_bp.route('/new-messages', methods=['GET'])
 def check_new_messages():
@@ -262,5 +291,5 @@ def check_new_messages():
         }), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
@@ -1,7 +1,10 @@
 from flask import Blueprint, request, jsonify, session, redirect, url_for
-from authlib.integrations.flask_client import OAuth
 from src.models.user import db, User
-import requests
+from src.services.identity import get_current_user, invalidate_user
+from src.services.metrics import server_error
+from src.services.usernames import allocate_username, username_base
+from src.services.sessions import regenerate_session
+from sqlalchemy.exc import IntegrityError
 import secrets
 import hashlib
 from datetime import datetime
@@ -14,11 +17,18 @@ GOOGLE_CLIENT_SECRET = "your_google_client_secret"
 FACEBOOK_CLIENT_ID = "your_facebook_app_id"
 FACEBOOK_CLIENT_SECRET = "your_facebook_app_secret"
 
-# Initialize OAuth
-oauth = OAuth()
+# OAuth client registry, created by init_oauth() (authlib is slow to import)
+oauth = None
+
+# Signup retries after losing a username/email race
+SIGNUP_ATTEMPTS = 5
 
 def init_oauth(app):
     """Initialize OAuth with Flask app"""
+    global oauth
+    from authlib.integrations.flask_client import OAuth
+
+    oauth = OAuth()
     oauth.init_app(app)
     
     # Google OAuth
@@ -43,6 +53,52 @@ def init_oauth(app):
         client_kwargs={'scope': 'email public_profile'},
     )
 
+def _create_or_get_oauth_user(provider, user_info, email):
+    # Check if user already exists
+    user = User.query.filter_by(email=email).first()
+    
+    if user:
+        # Update OAuth info if user exists
+        if provider == 'google':
+            user.google_id = user_info.get('sub') or user_info.get('id')
+        elif provider == 'facebook':
+            user.facebook_id = user_info.get('id')
+        
+        user.last_login = datetime.utcnow()
+        db.session.commit()
+        invalidate_user(user.id)
+        return user
+    
+    # Create new user
+    first_name = user_info.get('given_name') or user_info.get('first_name', '')
+    last_name = user_info.get('family_name') or user_info.get('last_name', '')
+    
+    # Username from the email, next free suffix from the allocator
+    username = allocate_username(username_base(email))
+    
+    # Create user
+    user = User(
+        username=username,
+        email=email,
+        first_name=first_name,
+        last_name=last_name,
+        password_hash=hashlib.sha256(secrets.token_hex(16).encode()).hexdigest(),  # Random password
+        is_verified=True,  # OAuth users are pre-verified
+        profile_image=user_info.get('picture'),
+        user_type='buyer'  # Default type
+    )
+    
+    # Set OAuth IDs
+    if provider == 'google':
+        user.google_id = user_info.get('sub') or user_info.get('id')
+    elif provider == 'facebook':
+        user.facebook_id = user_info.get('id')
+    
+    db.session.add(user)
+    db.session.commit()
+    
+    return user
+
 def create_or_get_oauth_user(provider, user_info):
     """Create or get user from OAuth provider info"""
     try:
@@ -50,55 +106,15 @@ def create_or_get_oauth_user(provider, user_info):
         if not email:
             return None, "Email non fourni par le fournisseur"
         
-        # Check if user already exists
-        user = User.query.filter_by(email=email).first()
-        
-        if user:
-            # Update OAuth info if user exists
-            if provider == 'google':
-                user.google_id = user_info.get('sub') or user_info.get('id')
-            elif provider == 'facebook':
-                user.facebook_id = user_info.get('id')
-            
-            user.last_login = datetime.utcnow()
-            db.session.commit()
-            return user, None
-        
-        # Create new user
-        first_name = user_info.get('given_name') or user_info.get('first_name', '')
-        last_name = user_info.get('family_name') or user_info.get('last_name', '')
-        name = user_info.get('name', f"{first_name} {last_name}").strip()
-        
-        # Generate username from email
-        username = email.split('@')[0]
-        counter = 1
-        original_username = username
-        while User.query.filter_by(username=username).first():
-            username = f"{original_username}{counter}"
-            counter += 1
-        
-        # Create user
-        user = User(
-            username=username,
-            email=email,
-            first_name=first_name,
-            last_name=last_name,
-            password_hash=hashlib.sha256(secrets.token_hex(16).encode()).hexdigest(),  # Random password
-            is_verified=True,  # OAuth users are pre-verified
-            profile_image=user_info.get('picture'),
-            user_type='buyer'  # Default type
-        )
-        
-        # Set OAuth IDs
-        if provider == 'google':
-            user.google_id = user_info.get('sub') or user_info.get('id')
-        elif provider == 'facebook':
-            user.facebook_id = user_info.get('id')
-        
-        db.session.add(user)
-        db.session.commit()
+        for _ in range(SIGNUP_ATTEMPTS):
+            try:
+                return _create_or_get_oauth_user(provider, user_info, email), None
+            except IntegrityError:
+                # Lost a race on the username or the email: the next attempt
+                # allocates another username or finds the user created meanwhile
+                db.session.rollback()
         
-        return user, None
+        return None, "Impossible d'attribuer un nom d'utilisateur"
         
     except Exception as e:
         db.session.rollback()
@@ -121,7 +137,7 @@ def google_login():
         }), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @oauth_bp.route('/google/callback', methods=['GET', 'POST'])
 def google_callback():
@@ -146,6 +162,7 @@ def google_callback():
             return jsonify({'error': error}), 400
         
         # Set session
+        regenerate_session(session)
         session['user_id'] = user.id
         session['username'] = user.username
         
@@ -156,7 +173,7 @@ def google_callback():
         }), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @oauth_bp.route('/facebook/login', methods=['GET'])
 def facebook_login():
@@ -174,7 +191,7 @@ def facebook_login():
         }), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @oauth_bp.route('/facebook/callback', methods=['GET', 'POST'])
 def facebook_callback():
@@ -207,6 +224,7 @@ def facebook_callback():
             return jsonify({'error': error}), 400
         
         # Set session
+        regenerate_session(session)
         session['user_id'] = user.id
         session['username'] = user.username
         
@@ -217,7 +235,7 @@ def facebook_callback():
         }), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @oauth_bp.route('/google/simulate', methods=['POST'])
 def simulate_google_login():
@@ -242,6 +260,7 @@ def simulate_google_login():
             return jsonify({'error': error}), 400
         
         # Set session
+        regenerate_session(session)
         session['user_id'] = user.id
         session['username'] = user.username
         
@@ -251,7 +270,7 @@ def simulate_google_login():
         }), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @oauth_bp.route('/facebook/simulate', methods=['POST'])
 def simulate_facebook_login():
@@ -276,6 +295,7 @@ def simulate_facebook_login():
             return jsonify({'error': error}), 400
         
         # Set session
+        regenerate_session(session)
         session['user_id'] = user.id
         session['username'] = user.username
         
@@ -285,18 +305,17 @@ def simulate_facebook_login():
         }), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @oauth_bp.route('/link-account', methods=['POST'])
 def link_oauth_account():
     """Link OAuth account to existing user"""
     try:
         # Check if user is logged in
-        user_id = session.get('user_id')
-        if not user_id:
+        if not session.get('user_id'):
             return jsonify({'error': 'Non authentifié'}), 401
         
-        user = User.query.get(user_id)
+        user = get_current_user()
         if not user:
             return jsonify({'error': 'Utilisateur non trouvé'}), 404
         
@@ -316,6 +335,7 @@ def link_oauth_account():
             return jsonify({'error': 'Fournisseur non supporté'}), 400
         
         db.session.commit()
+        invalidate_user(user.id)
         
         return jsonify({
             'message': f'Compte {provider} lié avec succès',
@@ -324,18 +344,17 @@ def link_oauth_account():
         
     except Exception as e:
         db.session.rollback()
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @oauth_bp.route('/unlink-account', methods=['POST'])
 def unlink_oauth_account():
     """Unlink OAuth account from user"""
     try:
         # Check if user is logged in
-        user_id = session.get('user_id')
-        if not user_id:
+        if not session.get('user_id'):
             return jsonify({'error': 'Non authentifié'}), 401
         
-        user = User.query.get(user_id)
+        user = get_current_user()
         if not user:
             return jsonify({'error': 'Utilisateur non trouvé'}), 404
         
@@ -354,6 +373,7 @@ def unlink_oauth_account():
             return jsonify({'error': 'Fournisseur non supporté'}), 400
         
         db.session.commit()
+        invalidate_user(user.id)
         
         return jsonify({
             'message': f'Compte {provider} délié avec succès',
@@ -362,18 +382,17 @@ def unlink_oauth_account():
         
     except Exception as e:
         db.session.rollback()
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @oauth_bp.route('/linked-accounts', methods=['GET'])
 def get_linked_accounts():
     """Get user's linked OAuth accounts"""
     try:
         # Check if user is logged in
-        user_id = session.get('user_id')
-        if not user_id:
+        if not session.get('user_id'):
             return jsonify({'error': 'Non authentifié'}), 401
         
-        user = User.query.get(user_id)
+        user = get_current_user()
         if not user:
             return jsonify({'error': 'Utilisateur non trouvé'}), 404
         
@@ -391,5 +410,5 @@ def get_linked_accounts():
         return jsonify({'linked_accounts': linked_accounts}), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
@@ -1,17 +1,18 @@
 from flask import Blueprint, request, jsonify, session
 from src.models.user import db, Order, Product, User, Cart
+from src.services.identity import require_auth
+from src.services.reservations import reserve_product, secure_sale, release_reservation, get_reservation_stats
+from src.services.metrics import server_error
+from src.services.replicas import replica_read
+from src.services.exports import ExportError, export_response, orders_query, sales_query
+from src.services.events import record_event
+from src.services.counters import record_orders_created, record_order_status
+from src.services.archive import fill_archived_products
 from datetime import datetime
 import uuid
 
 orders_bp = Blueprint('orders', __name__)
 
-def require_auth():
-    """Helper function to check authentication"""
-    user_id = session.get('user_id')
-    if not user_id:
-        return None
-    return User.query.get(user_id)
-
 def get_cart_session_key():
     """Get or create cart session key"""
     if 'cart_session_id' not in session:
@@ -66,7 +67,7 @@ def get_cart():
         }), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @orders_bp.route('/cart/add', methods=['POST'])
 def add_to_cart():
@@ -125,6 +126,8 @@ def add_to_cart():
             session['cart'] = cart
             session.modified = True
         
+        record_event('cart_add', product.id, product.seller_id, current_user.id if current_user else None)
+        
         return jsonify({
             'message': 'Produit ajouté au panier',
             'product_id': product_id,
@@ -134,7 +137,7 @@ def add_to_cart():
     except Exception as e:
         if current_user:
             db.session.rollback()
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @orders_bp.route('/cart/update', methods=['PUT'])
 def update_cart_item():
@@ -193,7 +196,7 @@ def update_cart_item():
     except Exception as e:
         if current_user:
             db.session.rollback()
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @orders_bp.route('/cart/remove', methods=['DELETE'])
 def remove_from_cart():
@@ -235,7 +238,7 @@ def remove_from_cart():
     except Exception as e:
         if current_user:
             db.session.rollback()
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @orders_bp.route('/cart/clear', methods=['DELETE'])
 def clear_cart():
@@ -257,7 +260,7 @@ def clear_cart():
     except Exception as e:
         if current_user:
             db.session.rollback()
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @orders_bp.route('/create', methods=['POST'])
 def create_order():
@@ -276,16 +279,24 @@ def create_order():
             return jsonify({'error': 'Adresse de livraison requise'}), 400
         
         orders_created = []
+        reservations = []
+        unavailable = []
         
         if product_id:
             # Single product order
             product = Product.query.get(product_id)
-            if not product or product.status != 'active':
+            if not product or product.status not in ('active', 'reserved'):
                 return jsonify({'error': 'Produit non disponible'}), 400
             
             if product.seller_id == current_user.id:
                 return jsonify({'error': 'Vous ne pouvez pas acheter votre propre produit'}), 400
             
+            # Hold the listing for this buyer; fails if someone else got there first
+            reservation = reserve_product(product.id, current_user.id)
+            if not reservation:
+                db.session.rollback()
+                return jsonify({'error': 'Produit déjà réservé par un autre acheteur'}), 409
+            
             order = Order(
                 buyer_id=current_user.id,
                 seller_id=product.seller_id,
@@ -298,6 +309,7 @@ def create_order():
             
             db.session.add(order)
             orders_created.append(order)
+            reservations.append((reservation, order))
         else:
             # Cart order
             cart_items = Cart.query.filter_by(user_id=current_user.id).all()
@@ -309,6 +321,7 @@ def create_order():
             seller_groups = {}
             for item in cart_items:
                 if item.product.status != 'active':
+                    unavailable.append(item.product)
                     continue
                 
                 if item.product.seller_id == current_user.id:
@@ -320,8 +333,14 @@ def create_order():
                 seller_groups[seller_id].append(item)
             
             # Create separate orders for each seller
+            ordered_items = []
             for seller_id, items in seller_groups.items():
                 for item in items:
+                    reservation = reserve_product(item.product_id, current_user.id)
+                    if not reservation:
+                        unavailable.append(item.product)  # Reserved or sold in the meantime
+                        continue
+                    
                     order = Order(
                         buyer_id=current_user.id,
                         seller_id=seller_id,
@@ -334,27 +353,46 @@ def create_order():
                     
                     db.session.add(order)
                     orders_created.append(order)
+                    reservations.append((reservation, order))
+                    ordered_items.append(item.id)
             
-            # Clear cart after order creation
-            Cart.query.filter_by(user_id=current_user.id).delete()
+            if not orders_created:
+                unavailable = [{'id': product.id, 'title': product.title} for product in unavailable]
+                db.session.rollback()
+                return jsonify({
+                    'error': 'Aucun produit du panier n\'est disponible',
+                    'unavailable_products': unavailable
+                }), 409
+            
+            # Only the items that became orders leave the cart
+            Cart.query.filter(Cart.id.in_(ordered_items)).delete(synchronize_session=False)
         
+        record_orders_created(orders_created)
         db.session.commit()
         
-        # Generate tracking numbers
+        # Generate tracking numbers and attach holds to their orders
         for order in orders_created:
             order.tracking_number = f"KM{order.id:08d}"
         
+        for reservation, order in reservations:
+            reservation.order_id = order.id
+        
         db.session.commit()
         
+        for order in orders_created:
+            record_event('order', order.product_id, order.seller_id, current_user.id, order.total_price)
+        
         return jsonify({
-            'message': 'Commande créée avec succès',
+            'message': ('Commande créée, certains produits ne sont plus disponibles' if unavailable
+                        else 'Commande créée avec succès'),
             'orders': [order.to_dict() for order in orders_created],
-            'total_orders': len(orders_created)
+            'total_orders': len(orders_created),
+            'unavailable_products': [{'id': product.id, 'title': product.title} for product in unavailable]
         }), 201
         
     except Exception as e:
         db.session.rollback()
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @orders_bp.route('/my-orders', methods=['GET'])
 def get_my_orders():
@@ -377,7 +415,7 @@ def get_my_orders():
             page=page, per_page=per_page, error_out=False
         )
         
-        orders = [order.to_dict() for order in pagination.items]
+        orders = fill_archived_products([order.to_dict() for order in pagination.items])
         
         return jsonify({
             'orders': orders,
@@ -392,7 +430,7 @@ def get_my_orders():
         }), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @orders_bp.route('/my-sales', methods=['GET'])
 def get_my_sales():
@@ -415,7 +453,7 @@ def get_my_sales():
             page=page, per_page=per_page, error_out=False
         )
         
-        orders = [order.to_dict() for order in pagination.items]
+        orders = fill_archived_products([order.to_dict() for order in pagination.items])
         
         return jsonify({
             'sales': orders,
@@ -430,7 +468,41 @@ def get_my_sales():
         }), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
+
+@orders_bp.route('/my-orders/export', methods=['GET'])
+@replica_read
+def export_my_orders():
+    """Stream all of the current user's orders (as buyer) as NDJSON or CSV"""
+    current_user = require_auth()
+    if not current_user:
+        return jsonify({'error': 'Non authentifié'}), 401
+    
+    try:
+        query = orders_query(current_user.id, status=request.args.get('status'))
+        return export_response(query, 'commandes')
+        
+    except ExportError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return server_error(e)
+
+@orders_bp.route('/my-sales/export', methods=['GET'])
+@replica_read
+def export_my_sales():
+    """Stream all of the current user's sales (as seller) as NDJSON or CSV"""
+    current_user = require_auth()
+    if not current_user:
+        return jsonify({'error': 'Non authentifié'}), 401
+    
+    try:
+        query = sales_query(current_user.id, status=request.args.get('status'))
+        return export_response(query, 'ventes')
+        
+    except ExportError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return server_error(e)
 
 @orders_bp.route('/<int:order_id>', methods=['GET'])
 def get_order(order_id):
@@ -448,13 +520,15 @@ def get_order(order_id):
         if order.buyer_id != current_user.id and order.seller_id != current_user.id:
             return jsonify({'error': 'Non autorisé'}), 403
         
-        return jsonify({'order': order.to_dict()}), 200
+        # The product may have been archived since the sale
+        order_data = fill_archived_products([order.to_dict()])[0]
+        return jsonify({'order': order_data}), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @orders_bp.route('/<int:order_id>/status', methods=['PUT'])
-def update_order_status():
+def update_order_status(order_id):
     """Update order status (seller only)"""
     current_user = require_auth()
     if not current_user:
@@ -462,11 +536,10 @@ def update_order_status():
     
     try:
         data = request.get_json()
-        order_id = data.get('order_id')
         new_status = data.get('status')
         
-        if not order_id or not new_status:
-            return jsonify({'error': 'ID de commande et statut requis'}), 400
+        if not new_status:
+            return jsonify({'error': 'Statut requis'}), 400
         
         valid_statuses = ['pending', 'confirmed', 'shipped', 'delivered', 'cancelled']
         if new_status not in valid_statuses:
@@ -479,14 +552,22 @@ def update_order_status():
         if order.seller_id != current_user.id:
             return jsonify({'error': 'Seul le vendeur peut modifier le statut'}), 403
         
+        old_status = order.order_status
+        
+        # Confirming turns the buyer's hold into a sale, cancelling frees the listing
+        if old_status == 'pending' and new_status in ('confirmed', 'shipped', 'delivered'):
+            if not secure_sale(order):
+                db.session.rollback()
+                return jsonify({'error': 'La réservation a expiré et le produit a été pris par un autre acheteur'}), 409
+        elif new_status == 'cancelled':
+            release_reservation(order.id)
+        
         order.order_status = new_status
         order.updated_at = datetime.utcnow()
-        
-        # If order is confirmed and product is still active, mark as sold
-        if new_status == 'confirmed' and order.product.status == 'active':
-            order.product.status = 'sold'
+        record_order_status(order, old_status)
         
         db.session.commit()
+        db.session.refresh(order.product)
         
         return jsonify({
             'message': 'Statut de commande mis à jour',
@@ -495,7 +576,7 @@ def update_order_status():
         
     except Exception as e:
         db.session.rollback()
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @orders_bp.route('/cart/migrate', methods=['POST'])
 def migrate_cart():
@@ -549,5 +630,13 @@ def migrate_cart():
         
     except Exception as e:
         db.session.rollback()
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
+@orders_bp.route('/reservations/stats', methods=['GET'])
+def get_reservations_stats():
+    """Get reservation contention metrics"""
+    try:
+        return jsonify({'reservations': get_reservation_stats()}), 200
+        
+    except Exception as e:
+        return server_error(e)
@@ -1,6 +1,12 @@
 from flask import Blueprint, request, jsonify, session
 from src.models.user import db, Order, User
-import requests
+from src.services.identity import require_auth
+from src.services.reservations import hold_for_order, secure_sale, release_reservation
+from src.services.metrics import server_error, outbound_call
+from src.services.replicas import replica_read
+from src.services.exports import ExportError, export_response, payments_query
+from src.services.counters import record_order_status
+from src.services.sessions import rewrite_sessions
 import uuid
 import time
 from datetime import datetime, timedelta
@@ -11,13 +17,6 @@ import json
 
 payment_bp = Blueprint('payment', __name__)
 
-def require_auth():
-    """Helper function to check authentication"""
-    user_id = session.get('user_id')
-    if not user_id:
-        return None
-    return User.query.get(user_id)
-
 # MTN Mobile Money API Configuration (simulation)
 MTN_API_CONFIG = {
     'base_url': 'https://sandbox.momodeveloper.mtn.com',
@@ -39,6 +38,32 @@ AIRTEL_API_CONFIG = {
     'x_currency': 'XAF'  # Central African Franc
 }
 
+# Pending payments are kept in the session for an hour
+PENDING_PAYMENT_TTL = timedelta(hours=1)
+DEFAULT_PENDING_PRUNE_INTERVAL = 600  # seconds
+
+def prune_stale_payments(data, now=None):
+    """Drop expired pending payments from session data, returns whether any were"""
+    now = now or datetime.utcnow()
+    pending_payments = data.get('pending_payments')
+    if not pending_payments:
+        return False
+    fresh = {transaction_id: payment_data for transaction_id, payment_data in pending_payments.items()
+             if now - datetime.fromisoformat(payment_data['created_at']) <= PENDING_PAYMENT_TTL}
+    if len(fresh) == len(pending_payments):
+        return False
+    data['pending_payments'] = fresh
+    return True
+
+def schedule_pending_payment_pruning(scheduler, app):
+    """Prune expired pending payments from every stored session on the scheduler leader"""
+    interval = app.config.get('PENDING_PAYMENT_PRUNE_INTERVAL', DEFAULT_PENDING_PRUNE_INTERVAL)
+    return scheduler.add_job(
+        'pending-payment-pruning',
+        lambda: rewrite_sessions(app.session_interface, prune_stale_payments, marker='pending_payments'),
+        interval=interval, jitter=30
+    )
+
 def detect_mobile_provider(phone_number):
     """Detect mobile provider based on phone number prefix"""
     # Remove country code and spaces
@@ -74,6 +99,7 @@ def detect_mobile_provider(phone_number):
     # Default to MTN if unknown
     return 'mtn'
 
+@outbound_call('mtn')
 def generate_mtn_token(user_id, api_secret):
     """Generate MTN API token (simulation)"""
     try:
@@ -91,6 +117,7 @@ def generate_mtn_token(user_id, api_secret):
     except Exception as e:
         return None
 
+@outbound_call('mtn')
 def simulate_mtn_request_to_pay(amount, phone_number, external_id, payer_message="Payment for Kitalamarket order"):
     """Simulate MTN Mobile Money request to pay"""
     try:
@@ -129,6 +156,7 @@ def simulate_mtn_request_to_pay(amount, phone_number, external_id, payer_message
             'message': str(e)
         }
 
+@outbound_call('mtn')
 def simulate_mtn_transaction_status(transaction_id):
     """Simulate checking MTN transaction status"""
     try:
@@ -166,6 +194,7 @@ def simulate_mtn_transaction_status(transaction_id):
             'message': str(e)
         }
 
+@outbound_call('airtel')
 def generate_airtel_token():
     """Generate Airtel Money API token (simulation)"""
     try:
@@ -183,6 +212,7 @@ def generate_airtel_token():
     except Exception as e:
         return None
 
+@outbound_call('airtel')
 def simulate_airtel_request_to_pay(amount, phone_number, external_id, reference="Payment for Kitalamarket order"):
     """Simulate Airtel Money request to pay"""
     try:
@@ -221,6 +251,7 @@ def simulate_airtel_request_to_pay(amount, phone_number, external_id, reference=
             'message': str(e)
         }
 
+@outbound_call('airtel')
 def simulate_airtel_transaction_status(transaction_id):
     """Simulate checking Airtel transaction status"""
     try:
@@ -292,7 +323,7 @@ def get_payment_methods():
         return jsonify({'payment_methods': methods}), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @payment_bp.route('/mobile-money/request-to-pay', methods=['POST'])
 def mobile_money_request_to_pay():
@@ -327,6 +358,12 @@ def mobile_money_request_to_pay():
         if order.payment_status != 'pending':
             return jsonify({'error': 'Cette commande a déjà été payée ou annulée'}), 400
         
+        # Keep the listing held for the buyer while the payment is in progress
+        if not hold_for_order(order):
+            db.session.rollback()
+            return jsonify({'error': 'La réservation a expiré et le produit a été pris par un autre acheteur'}), 409
+        db.session.commit()
+        
         # Generate external ID for tracking
         external_id = f"KM_{order_id}_{int(time.time())}"
         
@@ -382,7 +419,7 @@ def mobile_money_request_to_pay():
         }), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @payment_bp.route('/mobile-money/status/<transaction_id>', methods=['GET'])
 def check_mobile_money_payment_status(transaction_id):
@@ -414,8 +451,16 @@ def check_mobile_money_payment_status(transaction_id):
             # Update order payment status
             order = Order.query.get(payment_data['order_id'])
             if order:
-                order.payment_status = 'paid'
-                order.order_status = 'confirmed'
+                old_status = order.order_status
+                if old_status != 'pending' or secure_sale(order):
+                    order.payment_status = 'paid'
+                    order.order_status = 'confirmed'
+                else:
+                    # The hold lapsed and another buyer got the listing: the money goes back
+                    order.payment_status = 'refund_pending'
+                    order.order_status = 'cancelled'
+                    payment_data['failure_reason'] = 'Produit plus disponible, remboursement en cours'
+                record_order_status(order, old_status)
                 order.payment_method = f'{provider}_mobile_money'
                 order.updated_at = datetime.utcnow()
                 db.session.commit()
@@ -435,6 +480,7 @@ def check_mobile_money_payment_status(transaction_id):
             order = Order.query.get(payment_data['order_id'])
             if order:
                 order.payment_status = 'failed'
+                release_reservation(order.id)
                 db.session.commit()
             
             payment_data['failure_reason'] = status_response.get('reason')
@@ -455,11 +501,12 @@ def check_mobile_money_payment_status(transaction_id):
             'amount': payment_data['amount'],
             'provider': provider.upper(),
             'order_id': payment_data['order_id'],
+            'failure_reason': payment_data.get('failure_reason'),
             'updated_at': payment_data['updated_at']
         }), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @payment_bp.route('/pending-payments', methods=['GET'])
 def get_pending_payments():
@@ -476,9 +523,9 @@ def get_pending_payments():
         current_time = datetime.utcnow()
         
         for transaction_id, payment_data in pending_payments.items():
-            # Check if payment is older than 1 hour
+            # Check if payment has expired
             created_at = datetime.fromisoformat(payment_data['created_at'])
-            if current_time - created_at > timedelta(hours=1):
+            if current_time - created_at > PENDING_PAYMENT_TTL:
                 continue  # Skip old payments
             
             # Check if order belongs to current user
@@ -493,7 +540,7 @@ def get_pending_payments():
         return jsonify({'pending_payments': user_payments}), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @payment_bp.route('/cancel-payment', methods=['POST'])
 def cancel_payment():
@@ -528,7 +575,7 @@ def cancel_payment():
         return jsonify({'message': 'Paiement annulé'}), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @payment_bp.route('/webhook/mtn', methods=['POST'])
 def mtn_webhook():
@@ -551,7 +598,7 @@ def mtn_webhook():
         return jsonify({'message': 'Webhook processed'}), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @payment_bp.route('/simulate-callback', methods=['POST'])
 def simulate_payment_callback():
@@ -574,7 +621,7 @@ def simulate_payment_callback():
         }), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @payment_bp.route('/payment-history', methods=['GET'])
 def get_payment_history():
@@ -621,5 +668,21 @@ def get_payment_history():
         }), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
+@payment_bp.route('/payment-history/export', methods=['GET'])
+@replica_read
+def export_payment_history():
+    """Stream the user's whole payment history as NDJSON or CSV"""
+    current_user = require_auth()
+    if not current_user:
+        return jsonify({'error': 'Non authentifié'}), 401
+    
+    try:
+        query = payments_query(current_user.id, status=request.args.get('status'))
+        return export_response(query, 'paiements')
+        
+    except ExportError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return server_error(e)
@@ -1,19 +1,16 @@
 from flask import Blueprint, request, jsonify, session
-from src.models.user import db, User, Order
+from src.models.user import db, User, Order, Product, ProductActivity, SellerActivity
+from src.services.identity import require_auth
 from src.routes.payment import detect_mobile_provider, simulate_mtn_request_to_pay, simulate_airtel_request_to_pay, simulate_mtn_transaction_status, simulate_airtel_transaction_status
+from src.services.metrics import server_error
+from src.services.entitlements import premium_plan, resolve_entitlement, activate_subscription, cancel_subscription
+from src.services.events import COUNTERS, activity_series, last_rollup_at, sum_series, top_products
 import uuid
 import time
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 premium_bp = Blueprint('premium', __name__)
 
-def require_auth():
-    """Helper function to check authentication"""
-    user_id = session.get('user_id')
-    if not user_id:
-        return None
-    return User.query.get(user_id)
-
 # Premium plans configuration
 PREMIUM_PLANS = {
     'basic': {
@@ -53,6 +50,39 @@ PREMIUM_PLANS = {
     }
 }
 
+MAX_ANALYTICS_DAYS = 366
+
+def _naive_utc(value):
+    """Parse an ISO date or datetime; one with an offset is converted to naive UTC like the stored times"""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def _analytics_range():
+    """since, until and granularity from ?days or ?since/?until (ISO dates) and ?granularity"""
+    now = datetime.utcnow()
+    until = _naive_utc(request.args['until']) if request.args.get('until') else now
+    if request.args.get('since'):
+        since = _naive_utc(request.args['since'])
+    else:
+        since = until - timedelta(days=int(request.args.get('days', 30)))
+    if since > until or until - since > timedelta(days=MAX_ANALYTICS_DAYS):
+        raise ValueError('période invalide')
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in ('hour', 'day'):
+        raise ValueError('granularité invalide')
+    return since, until, granularity
+
+def _range_info(since, until, granularity):
+    last_rollup = last_rollup_at()
+    return {
+        'since': since.isoformat(),
+        'until': until.isoformat(),
+        'granularity': granularity,
+        'updated_at': last_rollup.isoformat() if last_rollup else None
+    }
+
 @premium_bp.route('/plans', methods=['GET'])
 def get_premium_plans():
     """Get available premium plans"""
@@ -63,7 +93,7 @@ def get_premium_plans():
         }), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @premium_bp.route('/current-plan', methods=['GET'])
 def get_current_plan():
@@ -81,23 +111,19 @@ def get_current_plan():
             'days_remaining': 0
         }
         
-        # In a real app, this would come from a premium_subscriptions table
-        # For simulation, we'll use user attributes
-        if hasattr(current_user, 'premium_plan') and current_user.premium_plan:
-            premium_expires = getattr(current_user, 'premium_expires', None)
-            if premium_expires and premium_expires > datetime.utcnow():
-                days_remaining = (premium_expires - datetime.utcnow()).days
-                premium_info = {
-                    'has_premium': True,
-                    'plan': current_user.premium_plan,
-                    'expires_at': premium_expires.isoformat(),
-                    'days_remaining': days_remaining
-                }
+        entitlement = resolve_entitlement(current_user.id)
+        if entitlement:
+            premium_info = {
+                'has_premium': True,
+                'plan': entitlement.plan,
+                'expires_at': entitlement.expires_at.isoformat(),
+                'days_remaining': (entitlement.expires_at - datetime.utcnow()).days
+            }
         
         return jsonify(premium_info), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @premium_bp.route('/subscribe', methods=['POST'])
 def subscribe_to_premium():
@@ -184,7 +210,7 @@ def subscribe_to_premium():
         }), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @premium_bp.route('/payment-status/<transaction_id>', methods=['GET'])
 def check_premium_payment_status(transaction_id):
@@ -217,18 +243,20 @@ def check_premium_payment_status(transaction_id):
             plan_id = payment_data['plan_id']
             plan = PREMIUM_PLANS[plan_id]
             
-            # Update user premium status (in real app, this would be in a separate table)
-            current_user.premium_plan = plan_id
-            current_user.premium_expires = datetime.utcnow() + timedelta(days=plan['duration_days'])
-            current_user.is_premium = True
-            
             # Store transaction reference
             if provider == 'mtn':
                 payment_data['financial_transaction_id'] = status_response.get('financial_transaction_id')
             else:
                 payment_data['airtel_transaction_id'] = status_response.get('airtel_transaction_id')
             
-            db.session.commit()
+            subscription = activate_subscription(
+                current_user.id,
+                plan_id,
+                plan['duration_days'],
+                amount=payment_data['amount'],
+                provider=provider,
+                transaction_id=transaction_id
+            )
             
             # Remove from pending payments
             del session['pending_premium_payments'][transaction_id]
@@ -239,7 +267,7 @@ def check_premium_payment_status(transaction_id):
                 'status': 'SUCCESS',
                 'message': f'Abonnement {plan["name"]} activé avec succès !',
                 'plan': plan,
-                'expires_at': current_user.premium_expires.isoformat(),
+                'expires_at': subscription.expires_at.isoformat(),
                 'provider': provider.upper()
             }), 200
             
@@ -272,7 +300,7 @@ def check_premium_payment_status(transaction_id):
         }), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @premium_bp.route('/cancel-subscription', methods=['POST'])
 def cancel_premium_subscription():
@@ -282,24 +310,16 @@ def cancel_premium_subscription():
         return jsonify({'error': 'Non authentifié'}), 401
     
     try:
-        # Check if user has premium
-        if not hasattr(current_user, 'premium_plan') or not current_user.premium_plan:
+        if not cancel_subscription(current_user.id):
             return jsonify({'error': 'Aucun abonnement premium actif'}), 400
         
-        # Cancel subscription (in real app, this would update subscription status)
-        current_user.premium_plan = None
-        current_user.premium_expires = None
-        current_user.is_premium = False
-        
-        db.session.commit()
-        
         return jsonify({
             'message': 'Abonnement premium annulé avec succès'
         }), 200
         
     except Exception as e:
         db.session.rollback()
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @premium_bp.route('/features', methods=['GET'])
 def get_premium_features():
@@ -316,48 +336,132 @@ def get_premium_features():
         }
         
         # Check if user has active premium
-        if hasattr(current_user, 'premium_plan') and current_user.premium_plan:
-            premium_expires = getattr(current_user, 'premium_expires', None)
-            if premium_expires and premium_expires > datetime.utcnow():
-                plan = PREMIUM_PLANS.get(current_user.premium_plan)
-                if plan:
-                    features = {
-                        'has_premium': True,
-                        'available_features': plan['features'],
-                        'plan_name': plan['name'],
-                        'expires_at': premium_expires.isoformat()
-                    }
+        entitlement = resolve_entitlement(current_user.id)
+        plan = PREMIUM_PLANS.get(entitlement.plan) if entitlement else None
+        if plan:
+            features = {
+                'has_premium': True,
+                'available_features': plan['features'],
+                'plan_name': plan['name'],
+                'expires_at': entitlement.expires_at.isoformat()
+            }
         
         return jsonify(features), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @premium_bp.route('/usage-stats', methods=['GET'])
 def get_premium_usage_stats():
-    """Get premium usage statistics"""
+    """Get premium usage statistics for the current month"""
     current_user = require_auth()
     if not current_user:
         return jsonify({'error': 'Non authentifié'}), 401
     
     try:
-        # Check if user has premium
-        if not hasattr(current_user, 'premium_plan') or not current_user.premium_plan:
+        if not premium_plan(current_user.id):
             return jsonify({'error': 'Abonnement premium requis'}), 403
         
-        # Simulate usage stats
-        stats = {
-            'featured_listings': 5,
-            'priority_support_tickets': 2,
-            'analytics_views': 1250,
-            'api_calls': 150,
-            'current_month': datetime.utcnow().strftime('%B %Y')
-        }
+        now = datetime.utcnow()
+        month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        totals = sum_series(activity_series(SellerActivity, current_user.id, month_start, now))
+        active_listings = Product.query.filter_by(seller_id=current_user.id, status='active').count()
+        
+        stats = dict(totals,
+                     active_listings=active_listings,
+                     current_month=now.strftime('%B %Y'),
+                     updated_at=_range_info(month_start, now, 'day')['updated_at'])
         
         return jsonify(stats), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
+
+@premium_bp.route('/analytics', methods=['GET'])
+def get_seller_analytics():
+    """Views, favorites, cart adds, messages, orders and revenue of the seller over time"""
+    current_user = require_auth()
+    if not current_user:
+        return jsonify({'error': 'Non authentifié'}), 401
+    
+    try:
+        if not premium_plan(current_user.id):
+            return jsonify({'error': 'Abonnement premium requis'}), 403
+        
+        try:
+            since, until, granularity = _analytics_range()
+        except ValueError:
+            return jsonify({'error': 'Paramètres de période invalides'}), 400
+        
+        series = activity_series(SellerActivity, current_user.id, since, until, granularity)
+        
+        return jsonify(dict(_range_info(since, until, granularity),
+                            series=series,
+                            totals=sum_series(series))), 200
+        
+    except Exception as e:
+        return server_error(e)
+
+@premium_bp.route('/analytics/products', methods=['GET'])
+def get_products_analytics():
+    """The seller's products ranked by activity over a period"""
+    current_user = require_auth()
+    if not current_user:
+        return jsonify({'error': 'Non authentifié'}), 401
+    
+    try:
+        if not premium_plan(current_user.id):
+            return jsonify({'error': 'Abonnement premium requis'}), 403
+        
+        try:
+            since, until, _ = _analytics_range()
+        except ValueError:
+            return jsonify({'error': 'Paramètres de période invalides'}), 400
+        
+        order_by = request.args.get('sort', 'views')
+        if order_by not in COUNTERS:
+            return jsonify({'error': 'Critère de tri invalide'}), 400
+        try:
+            limit = min(max(int(request.args.get('limit', 10)), 1), 100)
+        except ValueError:
+            return jsonify({'error': 'Limite invalide'}), 400
+        
+        return jsonify(dict(_range_info(since, until, 'day'),
+                            sort=order_by,
+                            products=top_products(current_user.id, since, until, limit, order_by))), 200
+        
+    except Exception as e:
+        return server_error(e)
+
+@premium_bp.route('/analytics/products/<int:product_id>', methods=['GET'])
+def get_product_analytics(product_id):
+    """Activity of one of the seller's products over time"""
+    current_user = require_auth()
+    if not current_user:
+        return jsonify({'error': 'Non authentifié'}), 401
+    
+    try:
+        if not premium_plan(current_user.id):
+            return jsonify({'error': 'Abonnement premium requis'}), 403
+        
+        product = Product.query.get(product_id)
+        if not product or product.seller_id != current_user.id:
+            return jsonify({'error': 'Produit non trouvé'}), 404
+        
+        try:
+            since, until, granularity = _analytics_range()
+        except ValueError:
+            return jsonify({'error': 'Paramètres de période invalides'}), 400
+        
+        series = activity_series(ProductActivity, product_id, since, until, granularity)
+        
+        return jsonify(dict(_range_info(since, until, granularity),
+                            product_id=product_id,
+                            series=series,
+                            totals=sum_series(series))), 200
+        
+    except Exception as e:
+        return server_error(e)
 
 @premium_bp.route('/pending-payments', methods=['GET'])
 def get_pending_premium_payments():
@@ -390,5 +494,5 @@ def get_pending_premium_payments():
         return jsonify({'pending_premium_payments': user_payments}), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
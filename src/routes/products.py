@@ -1,19 +1,23 @@
 from flask import Blueprint, request, jsonify, session
 from src.models.user import db, Product, User, Favorite, Cart
-from sqlalchemy import or_, and_, func, desc, asc
+from src.services.identity import require_auth
+from src.services.replicas import replica_read
+from src.services.metrics import server_error
+from src.services.admission import rate_limited
+from src.services.price_history import GRANULARITIES, price_series, category_trend
+from src.services.exports import ExportError, export_response, favorites_query
+from src.services.events import record_event
+from src.services.counters import record_product_viewed, record_favorites_change
+from src.services.favorites import (MAX_STATE_IDS, add_favorite, remove_favorite, toggle_favorite_state,
+                                    favorite_states, favorite_products)
+from sqlalchemy import or_, and_, func, desc, asc, select
 import json
 from datetime import datetime, timedelta
 
 products_bp = Blueprint('products', __name__)
 
-def require_auth():
-    """Helper function to check authentication"""
-    user_id = session.get('user_id')
-    if not user_id:
-        return None
-    return User.query.get(user_id)
-
 @products_bp.route('/', methods=['GET'])
+@replica_read
 def get_products():
     """Get products with filtering, sorting and pagination"""
     try:
@@ -98,7 +102,7 @@ def get_products():
         }), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @products_bp.route('/<int:product_id>', methods=['GET'])
 def get_product(product_id):
@@ -110,7 +114,9 @@ def get_product(product_id):
         
         # Increment view count
         product.views += 1
+        record_product_viewed(product.seller_id)
         db.session.commit()
+        record_event('view', product.id, product.seller_id, session.get('user_id'))
         
         # Get similar products (same category, different seller)
         similar_products = Product.query.filter(
@@ -126,9 +132,10 @@ def get_product(product_id):
         }), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @products_bp.route('/compare', methods=['POST'])
+@rate_limited('analytics')
 def compare_products():
     """Compare multiple products"""
     try:
@@ -183,50 +190,43 @@ def compare_products():
         return jsonify(comparison_data), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @products_bp.route('/price-history/<int:product_id>', methods=['GET'])
 def get_price_history(product_id):
-    """Get price history for a product (simulated data)"""
+    """Get price history for a product"""
     try:
         product = Product.query.get(product_id)
         if not product:
             return jsonify({'error': 'Produit non trouvé'}), 404
         
-        # Simulate price history (in real app, this would come from a price_history table)
-        current_price = product.price
-        history = []
-        
-        # Generate 30 days of simulated price history
-        for i in range(30, 0, -1):
-            date = datetime.utcnow() - timedelta(days=i)
-            # Simulate price variations (±10% of current price)
-            import random
-            variation = random.uniform(-0.1, 0.1)
-            historical_price = current_price * (1 + variation)
-            
-            history.append({
-                'date': date.isoformat(),
-                'price': round(historical_price, 2)
-            })
+        try:
+            days = min(max(int(request.args.get('days', 30)), 1), 3650)
+        except ValueError:
+            return jsonify({'error': 'Nombre de jours invalide'}), 400
+        granularity = request.args.get('granularity', 'auto')
+        if granularity != 'auto' and granularity not in GRANULARITIES:
+            return jsonify({'error': 'Granularité invalide'}), 400
         
-        # Add current price
-        history.append({
-            'date': datetime.utcnow().isoformat(),
-            'price': current_price
-        })
+        now = datetime.utcnow()
+        granularity, history = price_series(product_id, now - timedelta(days=days), now, granularity)
+        market = category_trend(product.category)
         
         return jsonify({
             'product_id': product_id,
-            'current_price': current_price,
+            'current_price': product.price,
+            'granularity': granularity,
             'price_history': history,
-            'price_trend': 'stable'  # Could be 'increasing', 'decreasing', 'stable'
+            'category_median_price': market['median_price'],
+            'price_trend': market['trend']
         }), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @products_bp.route('/market-analysis', methods=['GET'])
+@rate_limited('analytics')
+@replica_read
 def get_market_analysis():
     """Get market analysis for products"""
     try:
@@ -291,9 +291,10 @@ def get_market_analysis():
         return jsonify(analysis), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @products_bp.route('/categories', methods=['GET'])
+@replica_read
 def get_categories():
     """Get all available categories with product counts"""
     try:
@@ -310,9 +311,10 @@ def get_categories():
         return jsonify({'categories': category_list}), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @products_bp.route('/brands', methods=['GET'])
+@replica_read
 def get_brands():
     """Get all available brands with product counts"""
     try:
@@ -340,9 +342,10 @@ def get_brands():
         return jsonify({'brands': brand_list}), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @products_bp.route('/trending', methods=['GET'])
+@replica_read
 def get_trending_products():
     """Get trending products based on views and favorites"""
     try:
@@ -363,7 +366,7 @@ def get_trending_products():
         }), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
 @products_bp.route('/favorites', methods=['POST'])
 def toggle_favorite():
@@ -375,45 +378,80 @@ def toggle_favorite():
     try:
         data = request.get_json()
         product_id = data.get('product_id')
+        # Optional explicit 'add' / 'remove' makes retries idempotent
+        requested = data.get('action')
         
         if not product_id:
             return jsonify({'error': 'ID du produit requis'}), 400
         
-        product = Product.query.get(product_id)
-        if not product:
-            return jsonify({'error': 'Produit non trouvé'}), 404
+        if requested not in (None, 'add', 'remove'):
+            return jsonify({'error': 'Action invalide'}), 400
         
-        # Check if already in favorites
-        existing_favorite = Favorite.query.filter_by(
-            user_id=current_user.id,
-            product_id=product_id
+        product = db.session.execute(
+            select(Product.id, Product.seller_id).where(Product.id == product_id)
         ).first()
+        if not product:
+            return jsonify({'error': 'Produit non trouvé'}), 404
         
-        if existing_favorite:
-            # Remove from favorites
-            db.session.delete(existing_favorite)
-            product.favorites_count = max(0, product.favorites_count - 1)
+        if requested == 'add':
+            changed, favorites_count = add_favorite(current_user.id, product.id)
+            action = 'added'
+        elif requested == 'remove':
+            changed, favorites_count = remove_favorite(current_user.id, product.id)
             action = 'removed'
         else:
-            # Add to favorites
-            favorite = Favorite(user_id=current_user.id, product_id=product_id)
-            db.session.add(favorite)
-            product.favorites_count += 1
-            action = 'added'
+            action, favorites_count = toggle_favorite_state(current_user.id, product.id)
+            changed = True
         
+        if changed:
+            record_favorites_change(product.seller_id, 1 if action == 'added' else -1)
         db.session.commit()
+        if action == 'added' and changed:
+            record_event('favorite', product.id, product.seller_id, current_user.id)
         
         return jsonify({
             'message': f'Produit {action} des favoris',
             'action': action,
-            'favorites_count': product.favorites_count
+            'favorites_count': favorites_count
         }), 200
         
     except Exception as e:
         db.session.rollback()
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
+
+@products_bp.route('/favorites/state', methods=['GET', 'POST'])
+@replica_read
+def get_favorite_state():
+    """Which of the given products the current user has favorited"""
+    current_user = require_auth()
+    if not current_user:
+        return jsonify({'error': 'Non authentifié'}), 401
+    
+    try:
+        if request.method == 'POST':
+            product_ids = (request.get_json() or {}).get('product_ids', [])
+        else:
+            product_ids = [part for part in request.args.get('ids', '').split(',') if part]
+        
+        try:
+            product_ids = list(dict.fromkeys(int(product_id) for product_id in product_ids))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Identifiants de produits invalides'}), 400
+        
+        if len(product_ids) > MAX_STATE_IDS:
+            return jsonify({'error': f'Maximum {MAX_STATE_IDS} produits par requête'}), 400
+        
+        favorited = favorite_states(current_user.id, product_ids)
+        
+        return jsonify({
+            'favorites': {str(product_id): product_id in favorited for product_id in product_ids}
+        }), 200
+        
+    except Exception as e:
+        return server_error(e)
 
 @products_bp.route('/user-favorites', methods=['GET'])
+@replica_read
 def get_user_favorites():
     """Get current user's favorite products"""
     current_user = require_auth()
@@ -421,11 +459,26 @@ def get_user_favorites():
         return jsonify({'error': 'Non authentifié'}), 401
     
     try:
-        favorites = Favorite.query.filter_by(user_id=current_user.id).all()
-        favorite_products = [fav.product.to_dict() for fav in favorites if fav.product.status == 'active']
+        products = favorite_products(current_user.id)
         
-        return jsonify({'favorites': favorite_products}), 200
+        return jsonify({'favorites': [product.to_dict() for product in products]}), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return server_error(e)
 
+@products_bp.route('/user-favorites/export', methods=['GET'])
+@replica_read
+def export_user_favorites():
+    """Stream all of the current user's favorites as NDJSON or CSV"""
+    current_user = require_auth()
+    if not current_user:
+        return jsonify({'error': 'Non authentifié'}), 401
+    
+    try:
+        query = favorites_query(current_user.id, status=request.args.get('status'))
+        return export_response(query, 'favoris')
+        
+    except ExportError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return server_error(e)
@@ -1,12 +1,25 @@
 from flask import Blueprint, jsonify, request
 from src.models.user import User, db
+from src.services.identity import invalidate_user
+from src.services.metrics import server_error
+from src.services.replicas import replica_read
+from src.services.directory import DirectoryError, users_page, stream_users
 
 user_bp = Blueprint('user', __name__)
 
 @user_bp.route('/users', methods=['GET'])
+@replica_read
 def get_users():
-    users = User.query.all()
-    return jsonify([user.to_dict() for user in users])
+    """List users by keyset page, or stream them all with ?stream=1"""
+    try:
+        if request.args.get('stream'):
+            return stream_users(request.args)
+        return jsonify(users_page(request.args))
+        
+    except DirectoryError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return server_error(e)
 
 @user_bp.route('/users', methods=['POST'])
 def create_user():
@@ -29,6 +42,7 @@ def update_user(user_id):
     user.username = data.get('username', user.username)
     user.email = data.get('email', user.email)
     db.session.commit()
+    invalidate_user(user.id)
     return jsonify(user.to_dict())
 
 @user_bp.route('/users/<int:user_id>', methods=['DELETE'])
@@ -36,4 +50,5 @@ def delete_user(user_id):
     user = User.query.get_or_404(user_id)
     db.session.delete(user)
     db.session.commit()
+    invalidate_user(user_id)
     return '', 204
@@ -0,0 +1,254 @@
+"""Admission control for expensive endpoints.
+
+Views opt in with ``@rate_limited('<class>')``.  Every endpoint class has:
+
+- a token bucket per client (the signed-in user id, else the remote IP):
+  ``rate`` tokens per second up to ``burst``; an empty bucket answers 429
+- a cap on requests of the class in flight in this process; a full class
+  answers 503 straight away instead of queueing behind slow work
+
+Both rejections carry ``Retry-After``.  Buckets live in process memory by
+default; ``RATE_LIMIT_BACKEND = 'sqlite'`` keeps them in a SQLite file
+(``RATE_LIMIT_SQLITE_PATH``) shared by every worker on the host, updated with
+one conditional UPSERT per request.  ``RATE_LIMITS`` overrides the classes
+below, ``RATE_LIMIT_ENABLED = False`` turns the whole layer off.
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, jsonify, request, session
+
+from src.services.metrics import inc
+
+# class -> bucket rate (tokens/s), burst size, in-flight requests per process
+DEFAULT_LIMITS = {
+    # static-map: up to 12 tile fetches plus PNG encoding per request
+    'maps': {'rate': 2.0, 'burst': 20, 'concurrency': 4},
+    # Nominatim usage policy is one request per second
+    'geocode': {'rate': 1.0, 'burst': 10, 'concurrency': 4},
+    # market-analysis and compare: aggregate queries over the catalog
+    'analytics': {'rate': 5.0, 'burst': 30, 'concurrency': 8}
+}
+DEFAULT_MAX_BUCKETS = 100000
+DEFAULT_PRUNE_INTERVAL = 60  # seconds
+
+_stats_lock = threading.Lock()
+_stats = {'rate_limited': 0, 'overloaded': 0}
+
+def _bump(key):
+    with _stats_lock:
+        _stats[key] += 1
+
+class MemoryBucketBackend:
+    """Buckets of this process only"""
+
+    def __init__(self, max_buckets=DEFAULT_MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self._buckets = {}  # key -> [tokens, updated_at, full_at]
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        """Take a token; returns 0 when admitted, else seconds until one is available"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_buckets:
+                    self._prune(now)
+                self._buckets[key] = [burst - 1, now, now + 1 / rate]
+                return 0
+            tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                bucket[2] = now + (burst - bucket[0]) / rate
+                return 0
+            bucket[0] = tokens
+            return (1 - tokens) / rate
+
+    def _prune(self, now):
+        # A refilled bucket is the same as no bucket
+        for key in [key for key, bucket in self._buckets.items() if bucket[2] <= now]:
+            del self._buckets[key]
+        if len(self._buckets) >= self.max_buckets:
+            self._buckets.clear()
+
+    def size(self):
+        return len(self._buckets)
+
+class SQLiteBucketBackend:
+    """Buckets in a SQLite file shared by the workers of a host, one connection per (process, thread)
+
+    Nothing is opened until the first request, so building the app has no
+    side effect and preforked workers never share the parent's handle.
+    """
+
+    TAKE = (
+        'INSERT INTO rate_buckets (key, tokens, updated_at, full_at) '
+        'VALUES (:key, :burst - 1, :now, :now + 1.0 / :rate) '
+        'ON CONFLICT(key) DO UPDATE SET '
+        'tokens = MIN(:burst, tokens + (:now - updated_at) * :rate) - 1, '
+        'updated_at = :now, '
+        'full_at = :now + (:burst - MIN(:burst, tokens + (:now - updated_at) * :rate) + 1) / :rate '
+        'WHERE MIN(:burst, tokens + (:now - updated_at) * :rate) >= 1 '
+        'RETURNING tokens'
+    )
+    PEEK = 'SELECT MIN(:burst, tokens + (:now - updated_at) * :rate) FROM rate_buckets WHERE key = :key'
+
+    def __init__(self, path, prune_interval=DEFAULT_PRUNE_INTERVAL):
+        self.path = path
+        self.prune_interval = prune_interval
+        self._local = threading.local()
+        self._last_prune = time.time()
+        self._ready_pid = None
+        self._ready_lock = threading.Lock()
+
+    def _connection(self):
+        pid = os.getpid()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != pid:
+            # A connection inherited through fork() belongs to the parent
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = pid
+            self._create_table(conn, pid)
+        return conn
+
+    def _create_table(self, conn, pid):
+        with self._ready_lock:
+            if self._ready_pid == pid:
+                return
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS rate_buckets ('
+                'key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL, full_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_rate_buckets_full_at ON rate_buckets (full_at)')
+            self._ready_pid = pid
+
+    def take(self, key, rate, burst):
+        now = time.time()
+        params = {'key': key, 'rate': rate, 'burst': burst, 'now': now}
+        conn = self._connection()
+        if now - self._last_prune > self.prune_interval:
+            self._last_prune = now
+            conn.execute('DELETE FROM rate_buckets WHERE full_at < ?', (now,))
+        for _ in range(2):
+            if conn.execute(self.TAKE, params).fetchone() is not None:
+                return 0
+            row = conn.execute(self.PEEK, params).fetchone()
+            tokens = row[0] if row else 0
+            if tokens < 1:
+                return (1 - tokens) / rate
+            # Refilled between the two statements, try again
+            params['now'] = time.time()
+        return 1 / rate
+
+    def size(self):
+        return self._connection().execute('SELECT COUNT(*) FROM rate_buckets').fetchone()[0]
+
+class AdmissionController:
+    """Token buckets and in-flight caps per endpoint class"""
+
+    def __init__(self, backend, limits):
+        self.backend = backend
+        self.limits = limits
+        self._in_flight = {name: 0 for name in limits}
+        self._lock = threading.Lock()
+
+    def client_key(self, endpoint_class):
+        user_id = session.get('user_id')
+        client = f'u{user_id}' if user_id else f'ip{request.remote_addr}'
+        return f'{endpoint_class}:{client}'
+
+    def take(self, endpoint_class):
+        """Seconds to wait before retrying, 0 when the request may go ahead"""
+        limit = self.limits[endpoint_class]
+        if not limit.get('rate'):
+            return 0
+        return self.backend.take(self.client_key(endpoint_class), limit['rate'], limit['burst'])
+
+    def enter(self, endpoint_class):
+        """Claim an in-flight slot, False when the class is at its cap"""
+        cap = self.limits[endpoint_class].get('concurrency')
+        with self._lock:
+            if cap and self._in_flight[endpoint_class] >= cap:
+                return False
+            self._in_flight[endpoint_class] += 1
+        return True
+
+    def leave(self, endpoint_class):
+        with self._lock:
+            self._in_flight[endpoint_class] -= 1
+
+    def stats(self):
+        return {
+            'buckets': self.backend.size(),
+            'in_flight': dict(self._in_flight),
+            'limits': self.limits
+        }
+
+def _reject(endpoint_class, reason, retry_after, status, message):
+    _bump(reason)
+    inc('kitala_admission_rejections_total', (endpoint_class, reason))
+    response = jsonify({'error': message, 'retry_after': retry_after})
+    response.status_code = status
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def rate_limited(endpoint_class):
+    """Subject the view to the bucket and in-flight cap of endpoint_class"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            controller = current_app.extensions.get('admission')
+            if controller is None:
+                return view(*args, **kwargs)
+
+            wait = controller.take(endpoint_class)
+            if wait:
+                return _reject(endpoint_class, 'rate_limited', max(1, math.ceil(wait)), 429,
+                               'Trop de requêtes, veuillez réessayer plus tard')
+            if not controller.enter(endpoint_class):
+                return _reject(endpoint_class, 'overloaded', 1, 503,
+                               'Service momentanément surchargé, veuillez réessayer')
+            try:
+                return view(*args, **kwargs)
+            finally:
+                controller.leave(endpoint_class)
+        return wrapper
+    return decorator
+
+def get_admission_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    controller = current_app.extensions.get('admission')
+    if controller is not None:
+        stats.update(controller.stats())
+    return stats
+
+def init_admission(app):
+    """Build the admission controller configured for this app"""
+    if not app.config.get('RATE_LIMIT_ENABLED', True):
+        app.extensions.pop('admission', None)
+        return None
+
+    limits = {name: dict(limit) for name, limit in DEFAULT_LIMITS.items()}
+    for name, overrides in app.config.get('RATE_LIMITS', {}).items():
+        limits.setdefault(name, {}).update(overrides)
+
+    if app.config.get('RATE_LIMIT_BACKEND', 'memory') == 'sqlite':
+        path = app.config.get('RATE_LIMIT_SQLITE_PATH') or os.path.join(
+            os.path.dirname(os.path.dirname(__file__)), 'database', 'ratelimit.db'
+        )
+        backend = SQLiteBucketBackend(path)
+    else:
+        backend = MemoryBucketBackend(app.config.get('RATE_LIMIT_MAX_BUCKETS', DEFAULT_MAX_BUCKETS))
+
+    controller = app.extensions['admission'] = AdmissionController(backend, limits)
+    return controller
@@ -0,0 +1,243 @@
+"""Hot/cold archival of sold listings, old messages and stale carts.
+
+Rows the hot queries no longer need move to same-shaped archive tables in the
+same database, keeping their id:
+
+- products ``sold`` for more than ``ARCHIVE_PRODUCT_DAYS`` -> ``ArchivedProduct``
+  (their cart rows are dropped; the seller's listing view/favorite totals
+  stop counting them)
+- read messages older than ``ARCHIVE_MESSAGE_DAYS`` -> ``ArchivedMessage``
+  (unread ones stay where the unread counters count them)
+- cart rows older than ``ARCHIVE_CART_DAYS`` -> ``ArchivedCart``
+
+Each table is walked in id order, ``ARCHIVE_BATCH_SIZE`` rows per
+transaction: an ``INSERT ... SELECT`` into the archive and a ``DELETE`` with
+the same predicate, so a row that stopped qualifying in between is neither
+copied nor removed.  The newest row of each table is never moved, so SQLite
+never hands an archived id out again.  The job sleeps ``ARCHIVE_BATCH_PAUSE`` seconds between
+batches to leave the write lock to requests and stops after
+``ARCHIVE_MAX_BATCHES`` per table, the next run picks up the rest.  It runs
+nightly on the scheduler leader (``ARCHIVE_CRON``).
+
+Orders, messages and favorites keep pointing at archived product ids, which
+SQLite allows since foreign keys are not enforced; on other databases product
+archival is skipped.  Order and message endpoints read through to the
+archive: fill_archived_products() completes serialized rows whose product
+moved, conversation_archive() returns the archived part of a conversation.
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app, has_app_context
+from sqlalchemy import and_, case, delete, func, insert, literal, or_, select
+
+from src.models.user import db, Product, Message, Cart, ArchivedProduct, ArchivedMessage, ArchivedCart
+from src.services.counters import adjust_counters
+
+DEFAULT_PRODUCT_DAYS = 180
+DEFAULT_MESSAGE_DAYS = 365
+DEFAULT_CART_DAYS = 60
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_BATCH_PAUSE = 0.2  # seconds
+DEFAULT_MAX_BATCHES = 200  # per table and run
+DEFAULT_CRON = '30 4 * * *'  # UTC
+
+def _new_settings(config):
+    return {
+        'product_days': config.get('ARCHIVE_PRODUCT_DAYS', DEFAULT_PRODUCT_DAYS),
+        'message_days': config.get('ARCHIVE_MESSAGE_DAYS', DEFAULT_MESSAGE_DAYS),
+        'cart_days': config.get('ARCHIVE_CART_DAYS', DEFAULT_CART_DAYS),
+        'batch_size': config.get('ARCHIVE_BATCH_SIZE', DEFAULT_BATCH_SIZE),
+        'batch_pause': config.get('ARCHIVE_BATCH_PAUSE', DEFAULT_BATCH_PAUSE),
+        'max_batches': config.get('ARCHIVE_MAX_BATCHES', DEFAULT_MAX_BATCHES)
+    }
+
+_defaults = _new_settings({})
+_stats_lock = threading.Lock()
+_stats = {'products': 0, 'messages': 0, 'carts': 0, 'batches': 0, 'runs': 0,
+          'product_reads': 0, 'message_reads': 0}
+
+def _bump(key, amount=1):
+    with _stats_lock:
+        _stats[key] += amount
+
+def _settings():
+    """The current app's settings (see init_archive), the defaults outside an app"""
+    return current_app.extensions.get('archive', _defaults) if has_app_context() else _defaults
+
+def _move(source, target, predicate, now, batch_size, pause, max_batches, before_delete=None):
+    """Move the source rows matching predicate into target, batch by batch; returns the count"""
+    columns = [column.name for column in source.__table__.columns]
+    # The ids are plain INTEGER PRIMARY KEYs: SQLite hands out max(id) + 1, so
+    # removing the newest row would let the next insert reuse an id that is
+    # already in the archive (and referenced by orders, messages, favorites).
+    # The row holding the max id therefore always stays.
+    top = db.session.execute(select(func.max(source.id))).scalar()
+    if top is None:
+        return 0
+    predicate = and_(predicate, source.id < top)
+    moved = 0
+    last_id = 0
+    for _ in range(max_batches):
+        ids = db.session.execute(
+            select(source.id).where(source.id > last_id, predicate).order_by(source.id).limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            break
+        last_id = ids[-1]
+
+        batch = and_(source.id.in_(ids), predicate)
+        if before_delete is not None:
+            before_delete(batch)
+        db.session.execute(insert(target.__table__).from_select(
+            columns + ['archived_at'],
+            select(*[source.__table__.c[name] for name in columns], literal(now)).where(batch)
+        ))
+        count = db.session.execute(delete(source).where(batch).execution_options(synchronize_session=False)).rowcount
+        db.session.commit()
+        moved += count
+        _bump('batches')
+        if len(ids) < batch_size:
+            break
+        time.sleep(pause)
+    return moved
+
+def _forget_listing_totals(batch):
+    """The seller totals stop counting the views and favorites of archived listings"""
+    changes = []
+    totals = select(Product.seller_id, func.sum(Product.views), func.sum(Product.favorites_count)).where(
+        batch).group_by(Product.seller_id)
+    for seller_id, views, favorites in db.session.execute(totals):
+        changes.append((seller_id, 'listing_views', -(views or 0)))
+        changes.append((seller_id, 'listing_favorites', -(favorites or 0)))
+    adjust_counters(changes)
+    db.session.execute(
+        delete(Cart).where(Cart.product_id.in_(select(Product.id).where(batch)))
+        .execution_options(synchronize_session=False)
+    )
+
+def archive_sold_products(now=None, **options):
+    now = now or datetime.utcnow()
+    if db.engine.dialect.name != 'sqlite':
+        return 0
+    cutoff = now - timedelta(days=_settings()['product_days'])
+    moved = _move(Product, ArchivedProduct, and_(Product.status == 'sold', Product.updated_at < cutoff), now,
+                  before_delete=_forget_listing_totals, **_batching(options))
+    _bump('products', moved)
+    return moved
+
+def archive_messages(now=None, **options):
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(days=_settings()['message_days'])
+    moved = _move(Message, ArchivedMessage, and_(Message.is_read == True, Message.created_at < cutoff), now,
+                  **_batching(options))
+    _bump('messages', moved)
+    return moved
+
+def archive_stale_carts(now=None, **options):
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(days=_settings()['cart_days'])
+    moved = _move(Cart, ArchivedCart, Cart.created_at < cutoff, now, **_batching(options))
+    _bump('carts', moved)
+    return moved
+
+def _batching(options):
+    settings = _settings()
+    return {
+        'batch_size': options.get('batch_size') or settings['batch_size'],
+        'pause': options.get('pause', settings['batch_pause']),
+        'max_batches': options.get('max_batches') or settings['max_batches']
+    }
+
+def run_archival(now=None, **options):
+    """Archive every kind of cold row, returns {kind: rows moved}"""
+    now = now or datetime.utcnow()
+    moved = {
+        'products': archive_sold_products(now, **options),
+        'messages': archive_messages(now, **options),
+        'carts': archive_stale_carts(now, **options)
+    }
+    _bump('runs')
+    return moved
+
+def archived_products(product_ids):
+    """Serialized archived products by id, for ids no longer in the product table"""
+    if not product_ids:
+        return {}
+    _bump('product_reads')
+    products = db.session.execute(
+        select(ArchivedProduct).where(ArchivedProduct.id.in_(set(product_ids)))
+    ).scalars().all()
+    return {product.id: product.to_dict() for product in products}
+
+def fill_archived_products(items):
+    """Complete serialized orders/messages whose product was archived, in one query"""
+    missing = {item['product_id'] for item in items if item.get('product') is None and item.get('product_id')}
+    if not missing:
+        return items
+    found = archived_products(missing)
+    for item in items:
+        if item.get('product') is None and item.get('product_id') in found:
+            item['product'] = found[item['product_id']]
+    return items
+
+def conversation_archive(user_id, partner_id, product_id=None):
+    """Archived messages between two users (about one product), oldest first, serialized"""
+    query = select(ArchivedMessage).where(or_(
+        and_(ArchivedMessage.sender_id == user_id, ArchivedMessage.receiver_id == partner_id),
+        and_(ArchivedMessage.sender_id == partner_id, ArchivedMessage.receiver_id == user_id)
+    ))
+    if product_id is not None:
+        query = query.where(ArchivedMessage.product_id == product_id)
+    messages = db.session.execute(query.order_by(ArchivedMessage.created_at.asc())).scalars().all()
+    if messages:
+        _bump('message_reads')
+    return fill_archived_products(_with_live_products([message.to_dict() for message in messages]))
+
+def archived_partners(user_id, exclude=()):
+    """Last archived message with each partner of user_id not in exclude, serialized"""
+    partner = case((ArchivedMessage.sender_id == user_id, ArchivedMessage.receiver_id),
+                   else_=ArchivedMessage.sender_id)
+    # Ids follow creation order, the highest one is the latest message
+    latest = select(partner.label('partner_id'), func.max(ArchivedMessage.id).label('message_id')).where(
+        or_(ArchivedMessage.sender_id == user_id, ArchivedMessage.receiver_id == user_id)
+    ).group_by(partner).subquery()
+    rows = db.session.execute(
+        select(latest.c.partner_id, ArchivedMessage)
+        .join(ArchivedMessage, ArchivedMessage.id == latest.c.message_id)
+    ).all()
+    messages = {partner_id: message.to_dict() for partner_id, message in rows if partner_id not in exclude}
+    if messages:
+        _bump('message_reads')
+        fill_archived_products(_with_live_products(list(messages.values())))
+    return messages
+
+def _with_live_products(items):
+    ids = {item['product_id'] for item in items if item['product_id']}
+    if ids:
+        products = {product.id: product for product in
+                    db.session.execute(select(Product).where(Product.id.in_(ids))).scalars()}
+        for item in items:
+            if item['product_id'] in products:
+                item['product'] = products[item['product_id']].to_dict()
+    return items
+
+def get_archive_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['settings'] = dict(_settings())
+    return stats
+
+def init_archive(app):
+    """Configure retention and batching from app config"""
+    app.extensions['archive'] = _new_settings(app.config)
+
+def schedule_archival(scheduler, app):
+    """Archive cold rows every night on the scheduler leader"""
+    def archive():
+        moved = run_archival()
+        if any(moved.values()):
+            app.logger.info('Archived %(products)d products, %(messages)d messages, %(carts)d carts', moved)
+
+    return scheduler.add_job('archival', archive, cron=app.config.get('ARCHIVE_CRON', DEFAULT_CRON), jitter=300)
@@ -0,0 +1,176 @@
+"""In-process dispatch of batched API calls (POST /api/batch).
+
+Every sub-request goes through the normal URL map, blueprint
+``before_request`` checks and view decorators (auth, ``@replica_read``,
+``@rate_limited``) inside a request context built from its method, path,
+query string and JSON body.  The outer request is the only one the app-wide
+hooks see, so metrics, profiling and compression happen once per batch.
+
+Sub-requests share the outer session object.  Run in order, they also share
+the outer app context: the user already resolved on ``g`` and one DB
+session.  Runs of consecutive GETs go to a small thread pool instead
+(``BATCH_MAX_WORKERS``), each worker with its own app context and DB session
+and the user from the identity cache; any other call is a barrier that runs
+alone, in order, so a write is visible to every call listed after it.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from flask import current_app, g, request, session
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import RequestRedirect
+from werkzeug.test import EnvironBuilder
+
+DEFAULT_MAX_REQUESTS = 20
+DEFAULT_MAX_WORKERS = 4
+
+# Headers a sub-request inherits from the batch request
+FORWARDED_HEADERS = ('Cookie', 'Authorization', 'X-Admin-Token', 'Accept-Language', 'User-Agent')
+
+_pool = None
+_pool_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {'batches': 0, 'requests': 0, 'concurrent': 0, 'failed': 0}
+
+def _bump(key, amount=1):
+    with _stats_lock:
+        _stats[key] += amount
+
+class BatchError(ValueError):
+    """The batch itself is malformed"""
+
+def parse_batch(payload, max_requests=None):
+    """Validate the batch body, returns the list of sub-request specs"""
+    max_requests = max_requests or current_app.config.get('BATCH_MAX_REQUESTS', DEFAULT_MAX_REQUESTS)
+    calls = payload.get('requests') if isinstance(payload, dict) else None
+    if not isinstance(calls, list) or not calls:
+        raise BatchError('Liste de requêtes requise')
+    if len(calls) > max_requests:
+        raise BatchError(f'Maximum {max_requests} requêtes par lot')
+
+    specs = []
+    for index, call in enumerate(calls):
+        if not isinstance(call, dict) or not isinstance(call.get('path'), str):
+            raise BatchError(f'Requête {index} invalide')
+        path = call['path']
+        method = str(call.get('method', 'GET')).upper()
+        if not path.startswith('/api/') or path.split('?')[0].rstrip('/') == '/api/batch':
+            raise BatchError(f'Chemin non autorisé : {path}')
+        specs.append({'id': call.get('id', index), 'method': method, 'path': path, 'body': call.get('body')})
+    return specs
+
+def _canonical_path(app, path, method):
+    # Follow strict-slash redirects (/api/products -> /api/products/) in place
+    try:
+        app.url_map.bind('localhost').match(path, method)
+    except RequestRedirect as e:
+        return urlsplit(e.new_url).path
+    except HTTPException:
+        pass
+    return path
+
+def _environ(app, spec, headers, remote_addr):
+    path, _, query_string = spec['path'].partition('?')
+    builder = EnvironBuilder(
+        path=_canonical_path(app, path, spec['method']),
+        method=spec['method'],
+        query_string=query_string,
+        headers=headers,
+        json=spec['body'] if spec['body'] is not None and spec['method'] != 'GET' else None,
+        environ_base={'REMOTE_ADDR': remote_addr}
+    )
+    try:
+        return builder.get_environ()
+    finally:
+        builder.close()
+
+def _run_blueprint_hooks(app):
+    # App-wide hooks already ran for the batch request itself
+    for name in reversed(request.blueprints):
+        for func in app.before_request_funcs.get(name, ()):
+            result = app.ensure_sync(func)()
+            if result is not None:
+                return result
+    return None
+
+def _dispatch(app, spec, environ, shared_session):
+    """Run one sub-request in the current app context, returns (status, body)"""
+    ctx = app.request_context(environ)
+    ctx.session = shared_session
+    with ctx:
+        # Replica routing is decided per view
+        g.pop('_db_route', None)
+        g.pop('_db_replica', None)
+        if request.routing_exception is None and request.blueprint is None:
+            # Only API blueprints, not the static catch-all
+            return 404, {'error': 'Route non trouvée'}
+        try:
+            result = _run_blueprint_hooks(app)
+            if result is None:
+                result = app.dispatch_request()
+            response = app.make_response(result)
+        except HTTPException as e:
+            return e.code, {'error': e.description}
+        except Exception:
+            app.logger.exception('Batch sub-request %s %s failed', spec['method'], spec['path'])
+            return 500, {'error': 'Erreur interne du serveur'}
+
+        if response.is_streamed:
+            response.close()
+            return 400, {'error': 'Réponse en flux non disponible dans un lot'}
+        if g.get('_db_wrote') and response.status_code < 400:
+            # Later replica reads of this batch must see the write
+            shared_session['_last_write_at'] = time.time()
+        body = response.get_json(silent=True)
+        if body is None:
+            body = response.get_data(as_text=True)
+        return response.status_code, body
+
+def _dispatch_in_worker(app, spec, environ, shared_session):
+    with app.app_context():
+        return _dispatch(app, spec, environ, shared_session)
+
+def _get_pool(workers):
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='batch')
+    return _pool
+
+def run_batch(specs):
+    """Execute the sub-requests, returns their results in input order"""
+    app = current_app._get_current_object()
+    workers = app.config.get('BATCH_MAX_WORKERS', DEFAULT_MAX_WORKERS)
+    headers = [(name, request.headers[name]) for name in FORWARDED_HEADERS if name in request.headers]
+    environs = [_environ(app, spec, headers, request.remote_addr) for spec in specs]
+    shared_session = session._get_current_object()
+    results = [None] * len(specs)
+
+    index = 0
+    while index < len(specs):
+        end = index + 1
+        while end < len(specs) and specs[end]['method'] == 'GET' and specs[index]['method'] == 'GET':
+            end += 1
+        if workers > 1 and end - index > 1:
+            pool = _get_pool(workers)
+            futures = [(i, pool.submit(_dispatch_in_worker, app, specs[i], environs[i], shared_session))
+                       for i in range(index, end)]
+            for i, future in futures:
+                results[i] = future.result()
+            _bump('concurrent', end - index)
+        else:
+            for i in range(index, end):
+                results[i] = _dispatch(app, specs[i], environs[i], shared_session)
+        index = end
+
+    _bump('batches')
+    _bump('requests', len(specs))
+    _bump('failed', sum(1 for status, _ in results if status >= 500))
+    return [{'id': spec['id'], 'status': status, 'body': body} for spec, (status, body) in zip(specs, results)]
+
+def get_batch_stats():
+    with _stats_lock:
+        return dict(_stats)
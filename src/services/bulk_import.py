@@ -0,0 +1,455 @@
+"""Bulk loading of users, products and messages from CSV or NDJSON.
+
+Input is streamed and handled in chunks of ``chunk_size`` records: each chunk
+is validated (types, required fields, allowed values, referenced ids and, for
+users, unique usernames/emails) with one query per reference, then written
+with a single ``executemany`` of the Core INSERT compiled once for the load.
+Chunks share a transaction until ``transaction_rows`` rows are written.
+
+With ``defer_indexes`` the table's secondary indexes are dropped for the load
+and rebuilt at the end, which is much faster than maintaining them row by row.
+Live tables must keep their indexes, so it is refused unless the target table
+is empty (an initial load or a migration).  Plain ``password``
+values are hashed in parallel through the hashing pool, a ``password_hash``
+column (from a previous platform) is stored as-is.  Imported products get
+their initial price point in the price history.
+
+Invalid records are skipped and reported, they never abort the load.
+"""
+import csv
+import io
+import itertools
+import json
+import time
+from datetime import datetime
+from operator import attrgetter, itemgetter, methodcaller
+
+from sqlalchemy import func, insert, select
+
+from src.models.user import db, User, Product, Message
+from src.services.hashing import hash_passwords
+from src.services.price_history import record_imported_prices
+from src.services.serialization import orjson
+
+DEFAULT_CHUNK_SIZE = 10000
+DEFAULT_TRANSACTION_ROWS = 500000
+MAX_REPORTED_ERRORS = 100
+
+class BulkImportError(Exception):
+    """Raised when the input cannot be imported at all (unknown entity, bad header...)"""
+
+def _text(value):
+    return str(value).strip()
+
+def _float(value):
+    return float(value)
+
+def _int(value):
+    if isinstance(value, float) and not value.is_integer():
+        raise ValueError(f'entier attendu: {value}')
+    return int(value)
+
+def _bool(value):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ('1', 'true', 'yes', 'oui', 'vrai'):
+        return True
+    if text in ('0', 'false', 'no', 'non', 'faux'):
+        return False
+    raise ValueError(f'booléen attendu: {value}')
+
+def _datetime(value):
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(str(value).strip())
+    # Stored naive in UTC like the rest of the models
+    if value.tzinfo is not None:
+        value = (value - value.utcoffset()).replace(tzinfo=None)
+    return value
+
+# Equivalent C converters for CSV input, where every value is a string
+CSV_CONVERTERS = {_text: str.strip, _float: float, _int: int}
+
+# entity -> model, [(field, converter, required)], allowed values, referenced ids,
+# unique fields and fields defaulting to another field's value
+ENTITIES = {
+    'users': {
+        'model': User,
+        'fields': [
+            ('username', _text, True), ('email', _text, True), ('first_name', _text, True),
+            ('last_name', _text, True), ('phone', _text, False), ('address', _text, False),
+            ('user_type', _text, False), ('profile_image', _text, False), ('rating', _float, False),
+            ('total_reviews', _int, False), ('is_verified', _bool, False), ('is_active', _bool, False),
+            ('created_at', _datetime, False), ('password_hash', _text, False)
+        ],
+        'choices': {'user_type': {'buyer', 'seller', 'both'}},
+        'references': {},
+        'unique': ('username', 'email'),
+        'fallbacks': {}
+    },
+    'products': {
+        'model': Product,
+        'fields': [
+            ('title', _text, True), ('description', _text, True), ('price', _float, True),
+            ('category', _text, True), ('brand', _text, False), ('condition', _text, True),
+            ('size', _text, False), ('color', _text, False), ('location', _text, False),
+            ('latitude', _float, False), ('longitude', _float, False), ('images', _text, False),
+            ('status', _text, False), ('views', _int, False), ('favorites_count', _int, False),
+            ('seller_id', _int, True), ('created_at', _datetime, False), ('updated_at', _datetime, False)
+        ],
+        'choices': {
+            'condition': {'new', 'excellent', 'good', 'fair'},
+            'status': {'active', 'reserved', 'sold', 'draft', 'suspended'}
+        },
+        'references': {'seller_id': User},
+        'unique': (),
+        'fallbacks': {'updated_at': 'created_at'}
+    },
+    'messages': {
+        'model': Message,
+        'fields': [
+            ('content', _text, True), ('sender_id', _int, True), ('receiver_id', _int, True),
+            ('product_id', _int, False), ('is_read', _bool, False), ('created_at', _datetime, False)
+        ],
+        'choices': {},
+        'references': {'sender_id': User, 'receiver_id': User, 'product_id': Product},
+        'unique': (),
+        'fallbacks': {}
+    }
+}
+
+def detect_format(filename=None, content_type=None):
+    """'csv' or 'ndjson' from a file name or a Content-Type"""
+    name = (filename or '').lower()
+    content_type = (content_type or '').lower()
+    if name.endswith(('.ndjson', '.jsonl')) or 'ndjson' in content_type or 'jsonl' in content_type:
+        return 'ndjson'
+    if name.endswith('.csv') or 'csv' in content_type:
+        return 'csv'
+    raise BulkImportError('Format non reconnu, utilisez CSV ou NDJSON')
+
+def read_records(stream, fmt):
+    """(field names or None, iterator of (line number, record)) for a text stream
+
+    CSV records are lists matching the header, NDJSON records are dicts (or the
+    decoding error for a malformed line).
+    """
+    if fmt == 'csv':
+        reader = csv.reader(stream)
+        header = next(reader, None)
+        if not header:
+            return [], iter(())
+        return [name.strip() for name in header], enumerate(reader, start=2)
+    if fmt == 'ndjson':
+        return None, _iter_ndjson(stream)
+    raise BulkImportError(f'Format inconnu: {fmt}')
+
+def _iter_ndjson(stream):
+    loads = orjson.loads if orjson is not None else json.loads
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = loads(line)
+        except ValueError as e:
+            record = e
+        yield line_number, record if isinstance(record, (dict, Exception)) else ValueError('objet JSON attendu')
+
+class BulkLoader:
+    """Validates and inserts one entity's records chunk by chunk"""
+
+    def __init__(self, entity, chunk_size=DEFAULT_CHUNK_SIZE, transaction_rows=DEFAULT_TRANSACTION_ROWS,
+                 defer_indexes=False):
+        if entity not in ENTITIES:
+            raise BulkImportError(f'Type de données inconnu: {entity}')
+        self.entity = entity
+        self.spec = ENTITIES[entity]
+        self.table = self.spec['model'].__table__
+        self.chunk_size = chunk_size
+        self.transaction_rows = transaction_rows
+        self.defer_indexes = defer_indexes
+        self.engine = db.engine
+        self.dialect = self.engine.dialect
+        self.report = {'entity': entity, 'inserted': 0, 'rejected': 0, 'errors': [], 'seconds': 0.0}
+        self._seen = {field: set() for field in self.spec['unique']}
+
+    def _prepare(self, header, first):
+        """Compile the INSERT and the per-field conversion plan for this input"""
+        fields = {name: (convert, required) for name, convert, required in self.spec['fields']}
+        has_ids = 'id' in header if header is not None else \
+            isinstance(first, dict) and first.get('id') not in (None, '')
+        if has_ids:
+            fields['id'] = (_int, False)
+        if header is not None:
+            missing = [name for name, (_, required) in fields.items() if required and name not in header]
+            if missing:
+                raise BulkImportError(f'Colonnes requises manquantes: {", ".join(missing)}')
+
+        compiled = insert(self.table).compile(dialect=self.dialect, column_keys=list(fields))
+        self.statement = str(compiled)
+        self.positional = self.dialect.positional
+        self.names = list(compiled.positiontup) if self.positional else list(fields)
+        self.positions = {name: index for index, name in enumerate(self.names)}
+
+        self.plan = []
+        for name in self.names:
+            convert, required = fields[name]
+            column = self.table.c[name]
+            process = column.type.dialect_impl(self.dialect).bind_processor(self.dialect)
+            if process is not None and convert is _datetime:
+                # SQLite stores DateTime as 'YYYY-MM-DD HH:MM:SS.ffffff', which isoformat() writes much faster
+                sample = datetime(2000, 1, 2, 3, 4, 5, 6)
+                if process(sample) == sample.isoformat(' ', 'microseconds'):
+                    process = methodcaller('isoformat', ' ', 'microseconds')
+            key = (header.index(name) if name in header else None) if header is not None else name
+            fallback = self.spec['fallbacks'].get(name)
+            self.plan.append((
+                name, key, convert, required, self.spec['choices'].get(name), process,
+                self.positions[fallback] if fallback in self.positions else None
+            ))
+
+    def _defaults(self):
+        """Column defaults for this chunk, already converted for the driver"""
+        defaults = []
+        for name, _, _, _, _, process, _ in self.plan:
+            default = self.table.c[name].default
+            if default is None or not (default.is_scalar or default.is_callable):
+                value = None
+            else:
+                value = default.arg(None) if default.is_callable else default.arg
+            defaults.append(process(value) if process is not None and value is not None else value)
+        return defaults
+
+    def _error(self, line_number, message):
+        self.report['rejected'] += 1
+        if len(self.report['errors']) < MAX_REPORTED_ERRORS:
+            self.report['errors'].append({'line': line_number, 'error': message})
+
+    def _convert_columns(self, chunk, defaults):
+        """Fast path: convert the chunk column by column with C-level map()/zip()
+
+        Returns None when any record is invalid; the caller then converts the
+        chunk record by record to report each error.
+        """
+        records = [record for _, record in chunk]
+        if self.header is not None:
+            width = len(self.header)
+            if set(map(len, records)) != {width}:
+                return None
+        elif any(isinstance(record, Exception) for record in records):
+            return None
+
+        columns = []
+        try:
+            for (name, key, convert, required, allowed, process, fallback), default in zip(self.plan, defaults):
+                if key is None:
+                    columns.append(columns[fallback] if fallback is not None else [default] * len(records))
+                    continue
+                if isinstance(key, int):
+                    raw = list(map(itemgetter(key), records))
+                    convert = CSV_CONVERTERS.get(convert, convert)
+                else:
+                    raw = [record.get(key) for record in records]
+
+                if '' in raw or None in raw:
+                    if required:
+                        return None
+                    values = [None if value is None or value == '' else convert(value) for value in raw]
+                    if allowed is not None and not set(values) - {None} <= allowed:
+                        return None
+                    if process is not None:
+                        values = [None if value is None else process(value) for value in values]
+                    replacement = columns[fallback] if fallback is not None else None
+                    values = [
+                        value if value is not None else (replacement[index] if replacement else default)
+                        for index, value in enumerate(values)
+                    ]
+                elif convert is _datetime:
+                    values = list(map(datetime.fromisoformat, raw))
+                    if any(map(attrgetter('tzinfo'), values)):
+                        values = list(map(_datetime, values))
+                    if process is not None:
+                        values = list(map(process, values))
+                else:
+                    values = list(map(convert, raw))
+                    if allowed is not None and not set(values) <= allowed:
+                        return None
+                    if process is not None:
+                        values = list(map(process, values))
+                columns.append(values)
+        except (TypeError, ValueError):
+            return None
+        return list(zip([line_number for line_number, _ in chunk], zip(*columns)))
+
+    def _convert(self, chunk):
+        """[(line number, row)] with rows in INSERT parameter order; bad records are reported"""
+        defaults = self._defaults()
+        if self.entity != 'users':
+            valid = self._convert_columns(chunk, defaults)
+            if valid is not None:
+                return valid
+
+        plan = list(zip(self.plan, defaults))
+        is_users = self.entity == 'users'
+        valid = []
+        for line_number, record in chunk:
+            if isinstance(record, Exception):
+                self._error(line_number, f'JSON invalide: {record}')
+                continue
+            row = []
+            try:
+                for (name, key, convert, required, allowed, process, fallback), default in plan:
+                    if key is None:
+                        raw = None
+                    elif isinstance(key, int):
+                        raw = record[key]
+                    else:
+                        raw = record.get(key)
+                    if raw is None or raw == '':
+                        if required:
+                            raise ValueError(f'champ requis manquant: {name}')
+                        row.append(row[fallback] if fallback is not None else default)
+                        continue
+                    value = convert(raw)
+                    if allowed is not None and value not in allowed:
+                        raise ValueError(f'valeur non autorisée pour {name}: {value}')
+                    row.append(process(value) if process is not None else value)
+                if is_users:
+                    password = record.get('password') if isinstance(record, dict) else \
+                        (record[self._password_key] if self._password_key is not None else None)
+                    if not row[self.positions['password_hash']]:
+                        if not password:
+                            raise ValueError('password ou password_hash requis')
+                        row.append(password)  # replaced by its hash before the insert
+            except IndexError:
+                self._error(line_number, 'nombre de colonnes incorrect')
+                continue
+            except (TypeError, ValueError) as e:
+                self._error(line_number, str(e))
+                continue
+            valid.append((line_number, row))
+        return valid
+
+    def _value(self, row, name):
+        return row[self.positions[name]]
+
+    def _check_references(self, connection, valid):
+        for field, model in self.spec['references'].items():
+            if field not in self.positions:
+                continue
+            wanted = list({self._value(row, field) for _, row in valid} - {None})
+            existing = set()
+            for start in range(0, len(wanted), 5000):
+                batch = wanted[start:start + 5000]
+                existing.update(connection.execute(select(model.id).where(model.id.in_(batch))).scalars())
+            if len(existing) < len(wanted):
+                kept = []
+                for line_number, row in valid:
+                    value = self._value(row, field)
+                    if value is not None and value not in existing:
+                        self._error(line_number, f'{field} inconnu: {value}')
+                    else:
+                        kept.append((line_number, row))
+                valid = kept
+        return valid
+
+    def _check_unique(self, connection, valid):
+        for field in self.spec['unique']:
+            column = self.table.c[field]
+            in_chunk = [self._value(row, field) for _, row in valid]
+            taken = set()
+            for start in range(0, len(in_chunk), 5000):
+                batch = in_chunk[start:start + 5000]
+                taken.update(connection.execute(select(column).where(column.in_(batch))).scalars())
+            seen = self._seen[field]
+            kept = []
+            for line_number, row in valid:
+                value = self._value(row, field)
+                if value in taken or value in seen:
+                    self._error(line_number, f'{field} déjà utilisé: {value}')
+                else:
+                    seen.add(value)
+                    kept.append((line_number, row))
+            valid = kept
+        return valid
+
+    def _hash_passwords(self, valid):
+        """Replace plain passwords (appended after the columns) by their hash, in parallel"""
+        index = self.positions['password_hash']
+        pending = [row for _, row in valid if len(row) > len(self.names)]
+        if not pending:
+            return
+        for row, pwhash in zip(pending, hash_passwords([row.pop() for row in pending])):
+            row[index] = pwhash
+
+    def _secondary_indexes(self):
+        return [index for index in self.table.indexes if not index.unique]
+
+    def load(self, header, records):
+        """Import (line number, record) pairs read by read_records(), returns the report"""
+        started = time.perf_counter()
+        records = iter(records)
+        first = list(itertools.islice(records, 1))
+        self.header = header
+        self._prepare(header, first[0][1] if first else None)
+        self._password_key = header.index('password') if header and 'password' in header else None
+        records = itertools.chain(first, records)
+
+        deferred = self._secondary_indexes() if self.defer_indexes else []
+        if deferred:
+            with self.engine.begin() as connection:
+                if connection.execute(select(1).select_from(self.table).limit(1)).first() is not None:
+                    raise BulkImportError('Les index ne peuvent être différés que sur une table vide')
+                for index in deferred:
+                    index.drop(connection, checkfirst=True)
+
+        try:
+            with self.engine.connect() as connection:
+                transaction = connection.begin()
+                if self.entity == 'products':
+                    last_id = connection.execute(select(func.max(Product.id))).scalar() or 0
+                in_transaction = 0
+                while True:
+                    chunk = list(itertools.islice(records, self.chunk_size))
+                    if not chunk:
+                        break
+                    valid = self._convert(chunk)
+                    valid = self._check_references(connection, valid)
+                    valid = self._check_unique(connection, valid)
+                    if self.entity == 'users':
+                        self._hash_passwords(valid)
+                    if valid:
+                        if self.positional:
+                            rows = [tuple(row) for _, row in valid]
+                        else:
+                            rows = [dict(zip(self.names, row)) for _, row in valid]
+                        connection.exec_driver_sql(self.statement, rows)
+                        self.report['inserted'] += len(valid)
+                        in_transaction += len(valid)
+                    if in_transaction >= self.transaction_rows:
+                        transaction.commit()
+                        transaction = connection.begin()
+                        in_transaction = 0
+                if self.entity == 'products':
+                    record_imported_prices(connection, last_id)
+                transaction.commit()
+        finally:
+            if deferred:
+                with self.engine.begin() as connection:
+                    for index in deferred:
+                        index.create(connection, checkfirst=True)
+
+        elapsed = time.perf_counter() - started
+        self.report['seconds'] = round(elapsed, 3)
+        self.report['rows_per_second'] = round(self.report['inserted'] / elapsed) if elapsed else None
+        return self.report
+
+def import_stream(entity, stream, fmt, **options):
+    """Bulk-load a text stream of CSV or NDJSON records into entity's table"""
+    header, records = read_records(stream, fmt)
+    return BulkLoader(entity, **options).load(header, records)
+
+def import_file(entity, path, fmt=None, **options):
+    fmt = fmt or detect_format(filename=path)
+    with io.open(path, encoding='utf-8', newline='') as stream:
+        return import_stream(entity, stream, fmt, **options)
@@ -0,0 +1,336 @@
+"""Per-user counters: unread messages, orders and sales by status, listings.
+
+One ``UserCounters`` row per user answers the navbar badge and the dashboard
+tabs with a primary-key read.  The write paths keep it in step with
+``UPDATE ... SET col = col + delta`` on the request's own session, so a
+counter moves in the same transaction as the message, order or listing it
+counts:
+
+- send_message and the mark-read paths -> ``unread_messages``
+- create_order, update_order_status and payment confirmation ->
+  ``orders_<status>`` of the buyer and ``sales_<status>`` of the seller
+- reservation holds, releases and sales -> ``active_listings`` of the seller
+- product views and favorites -> ``listing_views`` / ``listing_favorites``
+  of the seller
+
+Sales also feed ``SellerRevenue``, one row per seller and month of the order
+date: created orders add their amount, cancelling takes it back out.  Those
+rows are upserted, so they don't wait for the counters row to exist.
+
+A user's row is created on first read from the source tables, deltas for a
+user without a row are skipped since that read will count them anyway; the
+same read seeds the current month's revenue.  reconcile_counters() recounts
+every user (and the current month's revenue) in id windows and rewrites the
+rows that drifted (bulk imports, manual fixes, races around row creation); it
+runs nightly at ``COUNTER_RECONCILE_HOUR`` (UTC) as a scheduler job.
+"""
+import threading
+from collections import defaultdict
+from datetime import date, datetime
+
+from sqlalchemy import and_, func, select, update
+
+from src.models.user import db, User, Message, Order, Product, UserCounters, SellerRevenue
+from src.services.database import dialect_insert
+
+ORDER_STATUSES = ('pending', 'confirmed', 'shipped', 'delivered', 'cancelled')
+COUNTER_COLUMNS = (
+    ('unread_messages',)
+    + tuple(f'orders_{status}' for status in ORDER_STATUSES)
+    + tuple(f'sales_{status}' for status in ORDER_STATUSES)
+    + ('active_listings', 'listing_views', 'listing_favorites')
+)
+REVENUE_TOLERANCE = 0.005  # float drift below a centime is not rewritten
+
+DEFAULT_RECONCILE_HOUR = 3  # UTC
+DEFAULT_RECONCILE_BATCH_SIZE = 500
+
+_stats_lock = threading.Lock()
+_stats = {'adjustments': 0, 'revenue_adjustments': 0, 'created': 0, 'reconciled_users': 0, 'drifted': 0,
+          'reconciliations': 0}
+
+def _bump(key, amount=1):
+    with _stats_lock:
+        _stats[key] += amount
+
+def adjust_counters(changes):
+    """Apply (user_id, column, delta) changes on the current session; the caller commits"""
+    per_user = defaultdict(lambda: defaultdict(int))
+    for user_id, column, delta in changes:
+        if user_id is not None and column in COUNTER_COLUMNS:
+            per_user[user_id][column] += delta
+
+    for user_id, deltas in per_user.items():
+        values = {column: getattr(UserCounters, column) + delta for column, delta in deltas.items() if delta}
+        if values:
+            db.session.execute(
+                update(UserCounters)
+                .where(UserCounters.user_id == user_id)
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            )
+            _bump('adjustments')
+
+def month_start(moment=None):
+    """First day of the (UTC) month of moment, now by default"""
+    moment = moment or datetime.utcnow()
+    return date(moment.year, moment.month, 1)
+
+def adjust_revenue(changes):
+    """Apply (seller_id, order date, amount, orders) changes on the current session; the caller commits"""
+    per_month = defaultdict(lambda: [0.0, 0])
+    for seller_id, ordered_at, amount, orders in changes:
+        if seller_id is not None:
+            entry = per_month[(seller_id, month_start(ordered_at))]
+            entry[0] += amount or 0.0
+            entry[1] += orders
+
+    rows = [{'seller_id': seller_id, 'month': month, 'revenue': revenue, 'orders': orders}
+            for (seller_id, month), (revenue, orders) in per_month.items() if revenue or orders]
+    if rows:
+        table = SellerRevenue.__table__
+        statement = dialect_insert(table, db.engine)
+        statement = statement.on_conflict_do_update(
+            index_elements=['seller_id', 'month'],
+            set_={'revenue': table.c.revenue + statement.excluded.revenue,
+                  'orders': table.c.orders + statement.excluded.orders}
+        )
+        db.session.execute(statement, rows)
+        _bump('revenue_adjustments', len(rows))
+
+def record_message_sent(receiver_id):
+    adjust_counters([(receiver_id, 'unread_messages', 1)])
+
+def record_messages_read(user_id, count):
+    if count:
+        adjust_counters([(user_id, 'unread_messages', -count)])
+
+def record_orders_created(orders):
+    changes = []
+    revenue = []
+    for order in orders:
+        status = order.order_status or 'pending'
+        changes.append((order.buyer_id, f'orders_{status}', 1))
+        changes.append((order.seller_id, f'sales_{status}', 1))
+        if status != 'cancelled':
+            revenue.append((order.seller_id, order.created_at, order.total_price, 1))
+    adjust_counters(changes)
+    adjust_revenue(revenue)
+
+def record_order_status(order, old_status):
+    """Move an order between status tabs after order.order_status changed from old_status"""
+    if old_status == order.order_status:
+        return
+    adjust_counters([
+        (order.buyer_id, f'orders_{old_status}', -1),
+        (order.buyer_id, f'orders_{order.order_status}', 1),
+        (order.seller_id, f'sales_{old_status}', -1),
+        (order.seller_id, f'sales_{order.order_status}', 1)
+    ])
+    if 'cancelled' in (old_status, order.order_status):
+        sign = -1 if order.order_status == 'cancelled' else 1
+        adjust_revenue([(order.seller_id, order.created_at, sign * order.total_price, sign)])
+
+def record_listings_change(seller_ids, delta):
+    """Count listings of seller_ids (one entry per listing) entering or leaving 'active'"""
+    adjust_counters([(seller_id, 'active_listings', delta) for seller_id in seller_ids])
+
+def record_product_viewed(seller_id):
+    adjust_counters([(seller_id, 'listing_views', 1)])
+
+def record_favorites_change(seller_id, delta):
+    """A favorite of one of seller_id's listings was added (1) or removed (-1)"""
+    adjust_counters([(seller_id, 'listing_favorites', delta)])
+
+def _count(user_ids):
+    """Counters of user_ids recomputed from the source tables"""
+    counts = {user_id: dict.fromkeys(COUNTER_COLUMNS, 0) for user_id in user_ids}
+    if not counts:
+        return counts
+
+    unread = select(Message.receiver_id, func.count()).where(
+        Message.receiver_id.in_(user_ids), Message.is_read == False
+    ).group_by(Message.receiver_id)
+    for user_id, count in db.session.execute(unread):
+        counts[user_id]['unread_messages'] = count
+
+    for owner, prefix in ((Order.buyer_id, 'orders'), (Order.seller_id, 'sales')):
+        by_status = select(owner, Order.order_status, func.count()).where(
+            owner.in_(user_ids)
+        ).group_by(owner, Order.order_status)
+        for user_id, status, count in db.session.execute(by_status):
+            if status in ORDER_STATUSES:
+                counts[user_id][f'{prefix}_{status}'] = count
+
+    listings = select(Product.seller_id, func.count()).where(
+        Product.seller_id.in_(user_ids), Product.status == 'active'
+    ).group_by(Product.seller_id)
+    for user_id, count in db.session.execute(listings):
+        counts[user_id]['active_listings'] = count
+
+    totals = select(
+        Product.seller_id,
+        func.coalesce(func.sum(Product.views), 0),
+        func.coalesce(func.sum(Product.favorites_count), 0)
+    ).where(Product.seller_id.in_(user_ids)).group_by(Product.seller_id)
+    for user_id, views, favorites in db.session.execute(totals):
+        counts[user_id]['listing_views'] = views
+        counts[user_id]['listing_favorites'] = favorites
+
+    return counts
+
+def _count_revenue(seller_ids, month):
+    """(revenue, orders) of seller_ids for month, from the orders table"""
+    start = datetime(month.year, month.month, 1)
+    end = datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+    revenue = dict.fromkeys(seller_ids, (0.0, 0))
+    if not seller_ids:
+        return revenue
+
+    # Through ix_order_seller_created
+    by_seller = select(Order.seller_id, func.coalesce(func.sum(Order.total_price), 0.0), func.count()).where(
+        Order.seller_id.in_(seller_ids),
+        Order.created_at >= start, Order.created_at < end,
+        Order.order_status != 'cancelled'
+    ).group_by(Order.seller_id)
+    for seller_id, amount, orders in db.session.execute(by_seller):
+        revenue[seller_id] = (amount, orders)
+    return revenue
+
+def _store_revenue(rows):
+    """Overwrite SellerRevenue rows with recounted values"""
+    if rows:
+        statement = dialect_insert(SellerRevenue.__table__, db.engine)
+        statement = statement.on_conflict_do_update(
+            index_elements=['seller_id', 'month'],
+            set_={'revenue': statement.excluded.revenue, 'orders': statement.excluded.orders}
+        )
+        db.session.execute(statement, rows)
+
+def _as_dict(row):
+    return {
+        'unread_messages': row['unread_messages'],
+        'orders': {status: row[f'orders_{status}'] for status in ORDER_STATUSES},
+        'sales': {status: row[f'sales_{status}'] for status in ORDER_STATUSES},
+        'active_listings': row['active_listings'],
+        'listing_views': row['listing_views'],
+        'listing_favorites': row['listing_favorites'],
+        'reconciled_at': row['reconciled_at']
+    }
+
+def _build_counters(user_id):
+    """Create the user's row from the source tables, seeding this month's revenue"""
+    now = datetime.utcnow()
+    month = month_start(now)
+    values = dict(_count([user_id])[user_id], user_id=user_id, reconciled_at=now)
+    revenue, orders = _count_revenue([user_id], month)[user_id]
+    db.session.execute(
+        dialect_insert(UserCounters.__table__, db.engine)
+        .values(**values)
+        .on_conflict_do_nothing(index_elements=['user_id'])
+    )
+    if orders:
+        _store_revenue([{'seller_id': user_id, 'month': month, 'revenue': revenue, 'orders': orders}])
+    db.session.commit()
+    _bump('created')
+    return values, revenue, orders
+
+def get_counters(user_id):
+    """The user's counters, built from the source tables on first use"""
+    row = db.session.execute(
+        select(UserCounters.__table__).where(UserCounters.user_id == user_id)
+    ).mappings().first()
+    if row is not None:
+        return _as_dict(row)
+    return _as_dict(_build_counters(user_id)[0])
+
+def get_seller_totals(user_id, month=None):
+    """The user's counters plus their revenue for month (this month by default), in one read"""
+    month = month or month_start()
+    row = db.session.execute(
+        select(UserCounters.__table__, SellerRevenue.revenue, SellerRevenue.orders)
+        .outerjoin(SellerRevenue, and_(SellerRevenue.seller_id == UserCounters.user_id,
+                                       SellerRevenue.month == month))
+        .where(UserCounters.user_id == user_id)
+    ).mappings().first()
+    if row is not None:
+        counters, revenue, orders = _as_dict(row), row['revenue'] or 0.0, row['orders'] or 0
+    else:
+        values, revenue, orders = _build_counters(user_id)
+        counters = _as_dict(values)
+        if month != month_start():
+            revenue, orders = _count_revenue([user_id], month)[user_id]
+    return dict(counters, revenue={'month': month, 'amount': revenue, 'orders': orders})
+
+def reconcile_counters(batch_size=DEFAULT_RECONCILE_BATCH_SIZE, now=None):
+    """Recount every user and rewrite drifted rows; returns (users checked, rows rewritten)
+
+    Revenue is recounted for the current month only, past months are final
+    unless an old order gets cancelled, which the write path accounts for.
+    """
+    now = now or datetime.utcnow()
+    month = month_start(now)
+    table = UserCounters.__table__
+    last_id = 0
+    users = drifted = 0
+
+    while True:
+        user_ids = db.session.execute(
+            select(User.id).where(User.id > last_id).order_by(User.id).limit(batch_size)
+        ).scalars().all()
+        if not user_ids:
+            break
+        last_id = user_ids[-1]
+
+        counts = _count(user_ids)
+        stored = {row['user_id']: row for row in db.session.execute(
+            select(table).where(table.c.user_id.in_(user_ids))
+        ).mappings()}
+        rows = [dict(values, user_id=user_id, reconciled_at=now) for user_id, values in counts.items()
+                if user_id not in stored
+                or any(stored[user_id][column] != values[column] for column in COUNTER_COLUMNS)]
+        if rows:
+            statement = dialect_insert(table, db.engine)
+            statement = statement.on_conflict_do_update(
+                index_elements=['user_id'],
+                set_={column: statement.excluded[column] for column in COUNTER_COLUMNS + ('reconciled_at',)}
+            )
+            db.session.execute(statement, rows)
+
+        revenue = _count_revenue(user_ids, month)
+        stored_revenue = {row.seller_id: (row.revenue, row.orders) for row in db.session.execute(
+            select(SellerRevenue.seller_id, SellerRevenue.revenue, SellerRevenue.orders)
+            .where(SellerRevenue.seller_id.in_(user_ids), SellerRevenue.month == month)
+        )}
+        revenue_rows = [{'seller_id': user_id, 'month': month, 'revenue': amount, 'orders': orders}
+                        for user_id, (amount, orders) in revenue.items()
+                        if stored_revenue.get(user_id, (0.0, 0))[1] != orders
+                        or abs(stored_revenue.get(user_id, (0.0, 0))[0] - amount) > REVENUE_TOLERANCE]
+        _store_revenue(revenue_rows)
+        db.session.commit()
+
+        users += len(user_ids)
+        drifted += len(rows) + len(revenue_rows)
+        if len(user_ids) < batch_size:
+            break
+
+    _bump('reconciliations')
+    _bump('reconciled_users', users)
+    _bump('drifted', drifted)
+    return users, drifted
+
+def get_counter_stats():
+    with _stats_lock:
+        return dict(_stats)
+
+def schedule_counter_reconciler(scheduler, app):
+    """Reconcile the counters every night on the scheduler leader"""
+    hour = app.config.get('COUNTER_RECONCILE_HOUR', DEFAULT_RECONCILE_HOUR)
+    batch_size = app.config.get('COUNTER_RECONCILE_BATCH_SIZE', DEFAULT_RECONCILE_BATCH_SIZE)
+
+    def reconcile():
+        users, drifted = reconcile_counters(batch_size=batch_size)
+        if drifted:
+            app.logger.info('Counters reconciled: %d of %d users drifted', drifted, users)
+
+    return scheduler.add_job('counter-reconciliation', reconcile, cron=f'0 {hour} * * *', jitter=300)
@@ -0,0 +1,122 @@
+"""Seller dashboard summary (GET /api/dashboard/summary).
+
+Everything dashboard.html shows at the top comes from state that is kept
+up to date on write (see services.counters):
+
+- active listings, listing views and favorites, sales per status from the
+  user's ``UserCounters`` row, joined with this month's ``SellerRevenue``
+  row, one primary-key read
+- the latest received messages, one range read of
+  ``ix_message_receiver_created``
+
+so the cost doesn't grow with the seller's history.  Summaries are cached
+per user and per process for ``DASHBOARD_CACHE_TTL`` seconds and the
+response is marked ``private`` cacheable by the browser for as long.
+"""
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app, has_app_context
+from sqlalchemy import select
+from sqlalchemy.orm import aliased
+
+from src.models.user import db, User, Message, Product
+from src.services.counters import get_seller_totals
+
+DEFAULT_CACHE_TTL = 15  # seconds
+DEFAULT_CACHE_MAX = 10000
+DEFAULT_RECENT_MESSAGES = 5
+
+def _new_state(config):
+    return {
+        'ttl': config.get('DASHBOARD_CACHE_TTL', DEFAULT_CACHE_TTL),
+        'max_entries': config.get('DASHBOARD_CACHE_MAX', DEFAULT_CACHE_MAX),
+        'recent_messages': config.get('DASHBOARD_RECENT_MESSAGES', DEFAULT_RECENT_MESSAGES),
+        'cache': {}  # user id -> (monotonic deadline, summary)
+    }
+
+_defaults = _new_state({})
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+
+def _bump(key, amount=1):
+    with _stats_lock:
+        _stats[key] += amount
+
+def _state():
+    """The current app's settings and cache (see init_dashboard), the defaults outside an app"""
+    return current_app.extensions.get('dashboard', _defaults) if has_app_context() else _defaults
+
+def recent_messages(user_id, limit):
+    """The user's latest received messages with sender and product names"""
+    sender = aliased(User)
+    rows = db.session.execute(
+        select(Message.id, Message.content, Message.is_read, Message.created_at, Message.product_id,
+               Message.sender_id, sender.username, sender.profile_image, Product.title)
+        .join(sender, sender.id == Message.sender_id)
+        .outerjoin(Product, Product.id == Message.product_id)
+        .where(Message.receiver_id == user_id)
+        .order_by(Message.created_at.desc())
+        .limit(limit)
+    )
+    return [{
+        'id': row.id,
+        'content': row.content,
+        'is_read': row.is_read,
+        'created_at': row.created_at,
+        'sender': {'id': row.sender_id, 'username': row.username, 'profile_image': row.profile_image},
+        'product': {'id': row.product_id, 'title': row.title} if row.product_id else None
+    } for row in rows]
+
+def build_summary(user_id):
+    """Compute the summary from the maintained aggregates, bypassing the cache"""
+    totals = get_seller_totals(user_id)
+    return {
+        'active_listings': totals['active_listings'],
+        'listing_views': totals['listing_views'],
+        'listing_favorites': totals['listing_favorites'],
+        'pending_sales': totals['sales']['pending'],
+        'sales': totals['sales'],
+        'revenue_this_month': totals['revenue'],
+        'unread_messages': totals['unread_messages'],
+        'recent_messages': recent_messages(user_id, _state()['recent_messages']),
+        'generated_at': datetime.utcnow()
+    }
+
+def seller_summary(user_id):
+    """The user's dashboard summary, at most ``ttl`` seconds old"""
+    state = _state()
+    cache = state['cache']
+    entry = cache.get(user_id)
+    if entry is not None and entry[0] > time.monotonic():
+        # Unlocked on purpose: an approximate hit count is fine on this path
+        _stats['hits'] += 1
+        return entry[1]
+
+    _bump('misses')
+    summary = build_summary(user_id)
+    if state['ttl'] > 0:
+        if len(cache) >= state['max_entries']:
+            cache.clear()
+        cache[user_id] = (time.monotonic() + state['ttl'], summary)
+    return summary
+
+def invalidate_summary(user_id=None):
+    """Forget the cached summary of one user, or of everybody"""
+    cache = _state()['cache']
+    if user_id is None:
+        cache.clear()
+    else:
+        cache.pop(user_id, None)
+
+def summary_ttl():
+    return _state()['ttl']
+
+def init_dashboard(app):
+    """Configure the summary cache from app config"""
+    app.extensions['dashboard'] = _new_state(app.config)
+
+def get_dashboard_stats():
+    with _stats_lock:
+        return dict(_stats, cached=len(_state()['cache']))
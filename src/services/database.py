@@ -0,0 +1,154 @@
+"""Database runtime configuration.
+
+configure_database() must run before ``db.init_app``.  It lets ``DATABASE_URL``
+override the configured URL (so a PostgreSQL deployment needs no code change),
+sizes the connection pool and, for SQLite, resolves the app's pragmas (WAL
+journaling and the defaults below) into ``app.extensions['database']``.
+init_database() then applies them on every new connection of the app's
+engines so readers no longer block on writers.
+"""
+import os
+import sqlite3
+import threading
+import time
+from functools import partial
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_OVERFLOW = 20
+DEFAULT_POOL_TIMEOUT = 30  # seconds
+DEFAULT_POOL_RECYCLE = 1800  # seconds
+DEFAULT_BUSY_TIMEOUT = 5000  # milliseconds
+
+# Defaults for each new SQLite connection; an app can override them with SQLITE_PRAGMAS
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': DEFAULT_BUSY_TIMEOUT,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64000,  # in KiB when negative
+    'temp_store': 'MEMORY'
+}
+
+_stats_lock = threading.Lock()
+_stats = {
+    'connections_opened': 0,
+    'checkouts': 0,
+    'checkins': 0,
+    'lock_errors': 0,
+    'write_statements': 0,
+    'write_time_total': 0.0,
+    'write_time_max': 0.0
+}
+
+def _bump(key, amount=1):
+    with _stats_lock:
+        _stats[key] += amount
+
+def is_sqlite_memory(url):
+    return url in ('sqlite://', 'sqlite:///:memory:')
+
+def dialect_insert(table, engine):
+    """INSERT for the engine's dialect, so upserts can use on_conflict_do_*() on SQLite and PostgreSQL"""
+    if engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+def configure_database(app):
+    """Resolve the database URL and engine options from config and environment"""
+    url = os.environ.get('DATABASE_URL') or app.config['SQLALCHEMY_DATABASE_URI']
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+
+    options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+    if not is_sqlite_memory(url):
+        options.setdefault('pool_size', app.config.get('DB_POOL_SIZE', DEFAULT_POOL_SIZE))
+        options.setdefault('max_overflow', app.config.get('DB_MAX_OVERFLOW', DEFAULT_MAX_OVERFLOW))
+        options.setdefault('pool_timeout', app.config.get('DB_POOL_TIMEOUT', DEFAULT_POOL_TIMEOUT))
+        options.setdefault('pool_recycle', app.config.get('DB_POOL_RECYCLE', DEFAULT_POOL_RECYCLE))
+
+    if url.startswith('sqlite'):
+        busy_timeout = app.config.get('DB_BUSY_TIMEOUT', DEFAULT_BUSY_TIMEOUT)
+        pragmas = dict(SQLITE_PRAGMAS, busy_timeout=busy_timeout)
+        pragmas.update(app.config.get('SQLITE_PRAGMAS', {}))
+        app.extensions['database'] = {'sqlite_pragmas': pragmas}
+        connect_args = options.setdefault('connect_args', {})
+        connect_args.setdefault('timeout', busy_timeout / 1000)
+        connect_args.setdefault('check_same_thread', False)
+    else:
+        options.setdefault('pool_pre_ping', True)
+        app.extensions['database'] = {'sqlite_pragmas': {}}
+
+    return url
+
+def init_database(app, engines):
+    """Apply the app's SQLite pragmas to every new connection of its engines (after ``db.init_app``)"""
+    pragmas = app.extensions['database']['sqlite_pragmas']
+    for engine in engines:
+        if engine.dialect.name == 'sqlite':
+            event.listen(engine, 'connect', partial(_apply_pragmas, pragmas))
+
+def _apply_pragmas(pragmas, dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name}={value}')
+    cursor.close()
+
+@event.listens_for(Engine, 'connect')
+def _on_connect(dbapi_connection, connection_record):
+    _bump('connections_opened')
+
+@event.listens_for(Engine, 'checkout')
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    _bump('checkouts')
+
+@event.listens_for(Engine, 'checkin')
+def _on_checkin(dbapi_connection, connection_record):
+    _bump('checkins')
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['query_started_at'] = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    # With SQLite, time spent waiting on the busy handler shows up in writes
+    if statement.lstrip()[:6].upper() in ('INSERT', 'UPDATE', 'DELETE'):
+        elapsed = time.perf_counter() - conn.info.pop('query_started_at', time.perf_counter())
+        with _stats_lock:
+            _stats['write_statements'] += 1
+            _stats['write_time_total'] += elapsed
+            _stats['write_time_max'] = max(_stats['write_time_max'], elapsed)
+
+@event.listens_for(Engine, 'handle_error')
+def _on_error(context):
+    if isinstance(context.original_exception, sqlite3.OperationalError) and \
+            'locked' in str(context.original_exception):
+        _bump('lock_errors')
+
+def get_database_stats(engine):
+    """Pool state and lock-wait counters for this process"""
+    with _stats_lock:
+        stats = dict(_stats)
+
+    pool = engine.pool
+    stats['pool'] = {
+        'class': type(pool).__name__,
+        'status': pool.status()
+    }
+    for attribute in ('size', 'checkedin', 'checkedout', 'overflow'):
+        method = getattr(pool, attribute, None)
+        if method is not None:
+            stats['pool'][attribute] = method()
+
+    stats['write_time_avg'] = stats['write_time_total'] / stats['write_statements'] if stats['write_statements'] else 0.0
+    stats['dialect'] = engine.dialect.name
+    return stats
@@ -0,0 +1,115 @@
+"""User directory listing (GET /api/users/users).
+
+The listing never loads the user table at once.  It is a flat Core SELECT of
+the requested columns in id order, narrowed by filters:
+
+- ``user_type``: buyer, seller or both
+- ``is_verified``: true/false
+- ``created_from`` / ``created_to``: ISO dates or datetimes, inclusive (a bare
+  ``created_to`` date covers the whole day)
+
+``fields`` picks a subset of the public columns (comma separated, ``id`` is
+always included); ``password_hash`` is never selectable.
+
+Pages are keyset-paginated on the id: ``after`` is the last id seen and the
+page carries ``next_cursor`` until the end, so page N costs the same as page
+1.  With ``stream=1`` (a JSON array) or ``stream=ndjson`` every matching row
+from ``after`` on is streamed through the export machinery instead, in
+``EXPORT_BATCH_SIZE`` batches fetched with ``yield_per`` (a server-side cursor
+where the driver has one), so memory stays flat whatever the user count.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from src.models.user import db, User
+from src.services.exports import export_response
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Selectable columns, in response order
+PUBLIC_FIELDS = ('id', 'username', 'email', 'first_name', 'last_name', 'phone', 'address', 'user_type',
+                 'profile_image', 'rating', 'total_reviews', 'is_verified', 'is_active', 'created_at',
+                 'last_login')
+USER_TYPES = ('buyer', 'seller', 'both')
+STREAM_FORMATS = {'1': 'json', 'true': 'json', 'json': 'json', 'ndjson': 'ndjson'}
+
+class DirectoryError(ValueError):
+    """Invalid listing parameters, reported to the client as a 400"""
+
+def _columns(raw):
+    if not raw:
+        return [User.__table__.c[name] for name in PUBLIC_FIELDS]
+    requested = {name.strip() for name in raw.split(',') if name.strip()}
+    unknown = requested.difference(PUBLIC_FIELDS)
+    if unknown:
+        raise DirectoryError(f'Champs inconnus : {", ".join(sorted(unknown))}')
+    requested.add('id')
+    return [User.__table__.c[name] for name in PUBLIC_FIELDS if name in requested]
+
+def _boolean(name, value):
+    if value in ('1', 'true'):
+        return True
+    if value in ('0', 'false'):
+        return False
+    raise DirectoryError(f'Valeur invalide pour {name} : {value}')
+
+def _datetime(name, value):
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise DirectoryError(f'Date invalide pour {name} : {value}')
+
+def _integer(name, value, minimum):
+    try:
+        number = int(value)
+    except ValueError:
+        raise DirectoryError(f'Valeur invalide pour {name} : {value}')
+    if number < minimum:
+        raise DirectoryError(f'{name} doit être supérieur ou égal à {minimum}')
+    return number
+
+def users_query(args):
+    """The filtered, projected directory SELECT for the request arguments, in id order"""
+    query = select(*_columns(args.get('fields')))
+
+    user_type = args.get('user_type')
+    if user_type:
+        if user_type not in USER_TYPES:
+            raise DirectoryError(f'Type d\'utilisateur inconnu : {user_type}')
+        query = query.where(User.user_type == user_type)
+    if args.get('is_verified'):
+        query = query.where(User.is_verified == _boolean('is_verified', args['is_verified']))
+    if args.get('created_from'):
+        query = query.where(User.created_at >= _datetime('created_from', args['created_from']))
+    if args.get('created_to'):
+        created_to = _datetime('created_to', args['created_to'])
+        if len(args['created_to']) == 10:  # bare date: the whole day
+            query = query.where(User.created_at < created_to + timedelta(days=1))
+        else:
+            query = query.where(User.created_at <= created_to)
+    if args.get('after'):
+        query = query.where(User.id > _integer('after', args['after'], 0))
+    return query.order_by(User.id)
+
+def users_page(args):
+    """One keyset page: {'users': [...], 'next_cursor': last id or None, 'limit': n}"""
+    limit = min(_integer('limit', args.get('limit', str(DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    query = users_query(args)
+    names = [column.key for column in query.selected_columns]
+    # One extra row tells whether there is a next page
+    rows = db.session.execute(query.limit(limit + 1)).all()
+    users = [dict(zip(names, row)) for row in rows[:limit]]
+    return {
+        'users': users,
+        'next_cursor': users[-1]['id'] if len(rows) > limit else None,
+        'limit': limit
+    }
+
+def stream_users(args):
+    """Stream every matching user as a JSON array or NDJSON"""
+    fmt = STREAM_FORMATS.get(args.get('stream'))
+    if fmt is None:
+        raise DirectoryError(f'Mode de flux inconnu : {args.get("stream")}')
+    return export_response(users_query(args), 'utilisateurs', fmt=fmt, attachment=False)
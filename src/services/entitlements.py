@@ -0,0 +1,197 @@
+"""Premium subscriptions and the entitlement checks that read them.
+
+A user's entitlement is their ``Subscription`` row with status ``active``
+and the latest future ``expires_at``, found through the (user_id,
+expires_at) index.  premium_plan() answers from a per-process cache keyed by
+user id, so checks on hot paths cost one dict lookup and one comparison.  A
+cached entry is good for ``ENTITLEMENT_CACHE_TTL`` seconds or until the
+subscription expires, whichever comes first; negative answers are cached
+too.  Subscribing or cancelling invalidates the entry of this process, other
+workers pick the change up within the TTL.
+
+expire_subscriptions() flips overdue rows to ``expired`` in batches; it runs
+periodically in a daemon thread so listings and reports only ever see live
+subscriptions as active.
+"""
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from flask import current_app, has_app_context
+from sqlalchemy import select, update
+
+from src.models.user import db, Subscription
+
+DEFAULT_CACHE_TTL = 60  # seconds
+DEFAULT_CACHE_MAX = 100000
+DEFAULT_EXPIRY_INTERVAL = 300  # seconds
+DEFAULT_EXPIRY_BATCH_SIZE = 500
+
+Entitlement = namedtuple('Entitlement', ['plan', 'expires_at', 'subscription_id'])
+
+def _new_state(config):
+    return {
+        'ttl': config.get('ENTITLEMENT_CACHE_TTL', DEFAULT_CACHE_TTL),
+        'max_entries': config.get('ENTITLEMENT_CACHE_MAX', DEFAULT_CACHE_MAX),
+        'cache': {}  # user id -> (monotonic deadline, Entitlement or None)
+    }
+
+_defaults = _new_state({})
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'activated': 0, 'cancelled': 0, 'expired': 0}
+
+def _bump(key, amount=1):
+    with _stats_lock:
+        _stats[key] += amount
+
+def _state():
+    """The current app's settings and cache (see init_entitlements), the defaults outside an app"""
+    return current_app.extensions.get('entitlements', _defaults) if has_app_context() else _defaults
+
+def _load(user_id, now=None):
+    now = now or datetime.utcnow()
+    row = db.session.execute(
+        select(Subscription.plan, Subscription.expires_at, Subscription.id)
+        .where(Subscription.user_id == user_id, Subscription.status == 'active', Subscription.expires_at > now)
+        .order_by(Subscription.expires_at.desc())
+        .limit(1)
+    ).first()
+    return Entitlement(*row) if row else None
+
+def resolve_entitlement(user_id):
+    """The user's current Entitlement, None without an active subscription"""
+    state = _state()
+    cache = state['cache']
+    entry = cache.get(user_id)
+    if entry is not None and entry[0] > time.monotonic():
+        # Unlocked on purpose: an approximate hit count is fine on this path
+        _stats['hits'] += 1
+        return entry[1]
+
+    _bump('misses')
+    now = datetime.utcnow()
+    entitlement = _load(user_id, now)
+    ttl = state['ttl']
+    if entitlement is not None:
+        ttl = min(ttl, (entitlement.expires_at - now).total_seconds())
+    if len(cache) >= state['max_entries']:
+        cache.clear()
+    cache[user_id] = (time.monotonic() + ttl, entitlement)
+    return entitlement
+
+def premium_plan(user_id):
+    """Id of the user's active plan, None without one"""
+    entitlement = resolve_entitlement(user_id)
+    return entitlement.plan if entitlement else None
+
+def invalidate_entitlement(user_id=None):
+    """Forget the cached entitlement of one user, or of everybody"""
+    cache = _state()['cache']
+    if user_id is None:
+        cache.clear()
+    else:
+        cache.pop(user_id, None)
+
+def activate_subscription(user_id, plan, duration_days, amount=None, provider=None, transaction_id=None, now=None):
+    """Start or renew a subscription and commit it.
+
+    Renewing the same plan extends the running period; switching plans starts
+    the new one now.  Either way the previous active row is marked replaced,
+    so a user never has more than one active subscription.
+    """
+    now = now or datetime.utcnow()
+    current = db.session.execute(
+        select(Subscription)
+        .where(Subscription.user_id == user_id, Subscription.status == 'active', Subscription.expires_at > now)
+        .order_by(Subscription.expires_at.desc())
+        .limit(1)
+    ).scalar_one_or_none()
+
+    starts_from = current.expires_at if current is not None and current.plan == plan else now
+    db.session.execute(
+        update(Subscription)
+        .where(Subscription.user_id == user_id, Subscription.status == 'active')
+        .values(status='replaced')
+        .execution_options(synchronize_session=False)
+    )
+    subscription = Subscription(
+        user_id=user_id,
+        plan=plan,
+        status='active',
+        starts_at=now,
+        expires_at=starts_from + timedelta(days=duration_days),
+        amount=amount,
+        provider=provider,
+        transaction_id=transaction_id
+    )
+    db.session.add(subscription)
+    db.session.commit()
+
+    invalidate_entitlement(user_id)
+    _bump('activated')
+    return subscription
+
+def cancel_subscription(user_id, now=None):
+    """End the user's active subscription now; returns False when there was none"""
+    now = now or datetime.utcnow()
+    cancelled = db.session.execute(
+        update(Subscription)
+        .where(Subscription.user_id == user_id, Subscription.status == 'active', Subscription.expires_at > now)
+        .values(status='cancelled', cancelled_at=now)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+
+    invalidate_entitlement(user_id)
+    if cancelled:
+        _bump('cancelled')
+    return bool(cancelled)
+
+def expire_subscriptions(batch_size=DEFAULT_EXPIRY_BATCH_SIZE, now=None):
+    """Mark overdue active subscriptions expired in batches"""
+    now = now or datetime.utcnow()
+    total = 0
+
+    while True:
+        overdue_ids = select(Subscription.id).where(
+            Subscription.status == 'active', Subscription.expires_at <= now
+        ).limit(batch_size).scalar_subquery()
+
+        expired = db.session.execute(
+            update(Subscription)
+            .where(Subscription.id.in_(overdue_ids))
+            .values(status='expired')
+            .returning(Subscription.user_id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+        db.session.commit()
+
+        for user_id in expired:
+            invalidate_entitlement(user_id)
+        total += len(expired)
+        if len(expired) < batch_size:
+            break
+
+    if total:
+        _bump('expired', total)
+    return total
+
+def get_entitlement_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    state = _state()
+    stats['cached_users'] = len(state['cache'])
+    stats['ttl'] = state['ttl']
+    return stats
+
+def init_entitlements(app):
+    """Configure the entitlement cache from app config"""
+    app.extensions['entitlements'] = _new_state(app.config)
+
+def schedule_subscription_expiry(scheduler, app, interval=None):
+    """Run the subscription expiry job periodically on the scheduler leader"""
+    interval = interval or app.config.get('SUBSCRIPTION_EXPIRY_INTERVAL', DEFAULT_EXPIRY_INTERVAL)
+    batch_size = app.config.get('SUBSCRIPTION_EXPIRY_BATCH_SIZE', DEFAULT_EXPIRY_BATCH_SIZE)
+    return scheduler.add_job('subscription-expiry', lambda: expire_subscriptions(batch_size=batch_size),
+                             interval=interval)
@@ -0,0 +1,291 @@
+"""Activity events and their hourly/daily rollups.
+
+Views call record_event() for product views, favorites, cart adds, messages
+and orders.  It only appends a tuple to an in-process buffer (one per app, kept
+in ``app.extensions``); a per-process scheduler job writes the buffer to the
+append-only ``Event`` table with one executemany every
+``EVENT_FLUSH_INTERVAL`` seconds, or sooner once ``EVENT_BATCH_SIZE`` events
+are waiting.  When the database falls behind the buffer is capped at
+``EVENT_BUFFER_MAX`` and the oldest events are dropped (and counted).
+
+roll_up_events() folds the events above the ``RollupCursor`` watermark into
+``ProductActivity`` and ``SellerActivity`` rows per hour and per day with
+additive upserts, then advances the watermark with a compare-and-set so two
+workers never count the same batch; it runs on the scheduler leader.  Event ids
+follow commit order on SQLite, not on databases with concurrent writers, where
+a lower id can commit after a higher one was folded.  The watermark therefore
+only moves over the contiguous run of ids above it: a gap holds it back until
+it has stayed open ``EVENT_ROLLUP_GRACE`` seconds, long enough for any
+in-flight insert to commit, after which it is taken for a rolled-back id.  Old raw events and hourly rows are
+pruned after ``EVENT_RETENTION_DAYS`` / ``EVENT_HOURLY_RETENTION_DAYS``; the
+daily rows are kept.
+"""
+import atexit
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from flask import current_app, has_app_context
+from sqlalchemy import delete, func, insert, select, update
+
+from src.models.user import db, Event, Product, ProductActivity, SellerActivity, RollupCursor
+from src.services.database import dialect_insert
+from src.services.scheduler import run_soon
+
+KINDS = {
+    # event kind -> rollup column it counts into
+    'view': 'views',
+    'favorite': 'favorites',
+    'cart_add': 'cart_adds',
+    'message': 'messages',
+    'order': 'orders'
+}
+COUNTERS = ('views', 'favorites', 'cart_adds', 'messages', 'orders', 'revenue')
+CURSOR_NAME = 'activity'
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_BUFFER_MAX = 50000
+DEFAULT_FLUSH_INTERVAL = 2  # seconds
+DEFAULT_ROLLUP_INTERVAL = 60  # seconds
+DEFAULT_ROLLUP_BATCH_SIZE = 20000
+DEFAULT_ROLLUP_GRACE = 30  # seconds
+DEFAULT_RETENTION_DAYS = 90
+DEFAULT_HOURLY_RETENTION_DAYS = 31
+
+def _new_state(config):
+    return {
+        'batch_size': config.get('EVENT_BATCH_SIZE', DEFAULT_BATCH_SIZE),
+        'buffer_max': config.get('EVENT_BUFFER_MAX', DEFAULT_BUFFER_MAX),
+        'buffer': [],
+        'gaps': {}  # (first missing id, next present id) -> when the rollup first saw it
+    }
+
+_defaults = _new_state({})
+_buffer_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_stats = {'recorded': 0, 'dropped': 0, 'flushed': 0, 'flushes': 0, 'rolled_up': 0, 'rollups': 0}
+
+def _state():
+    """The current app's settings, buffer and gaps (see init_events), the defaults outside an app"""
+    return current_app.extensions.get('events', _defaults) if has_app_context() else _defaults
+
+def record_event(kind, product_id, seller_id, actor_id=None, value=0.0):
+    """Queue an activity event; never touches the database"""
+    state = _state()
+    buffer = state['buffer']
+    with _buffer_lock:
+        buffer.append((kind, product_id, seller_id, actor_id, value, datetime.utcnow()))
+        _stats['recorded'] += 1
+        pending = len(buffer)
+        if pending > state['buffer_max']:
+            overflow = pending - state['buffer_max']
+            del buffer[:overflow]
+            _stats['dropped'] += overflow
+    if pending >= state['batch_size']:
+        run_soon('event-flush')
+
+def flush_events(engine=None):
+    """Write the buffered events, returns how many were written"""
+    buffer = _state()['buffer']
+    with _flush_lock:
+        with _buffer_lock:
+            batch = buffer[:]
+            del buffer[:]
+        if not batch:
+            return 0
+        rows = [{'kind': kind, 'product_id': product_id, 'seller_id': seller_id, 'actor_id': actor_id,
+                 'value': value, 'created_at': created_at}
+                for kind, product_id, seller_id, actor_id, value, created_at in batch]
+        try:
+            with (engine or db.engine).begin() as connection:
+                connection.execute(insert(Event.__table__), rows)
+        except Exception:
+            # Put them back in front of what arrived meanwhile; the cap still applies
+            with _buffer_lock:
+                buffer[:0] = batch
+            raise
+        _stats['flushed'] += len(batch)
+        _stats['flushes'] += 1
+        return len(batch)
+
+def _hour(ts):
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+def _day(ts):
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def _upsert(table, key_columns, rows):
+    """Insert rows, adding the counters to the existing row on key conflict"""
+    statement = dialect_insert(table, db.engine)
+    statement = statement.on_conflict_do_update(
+        index_elements=key_columns,
+        set_={name: table.c[name] + statement.excluded[name] for name in COUNTERS}
+    )
+    db.session.execute(statement, rows)
+
+def _fold(events):
+    products = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    sellers = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    for kind, product_id, seller_id, value, created_at in events:
+        column = KINDS.get(kind)
+        if column is None:
+            continue
+        for granularity, start in (('hour', _hour(created_at)), ('day', _day(created_at))):
+            for totals in (products[(product_id, granularity, start)], sellers[(seller_id, granularity, start)]):
+                totals[column] += 1
+                totals['revenue'] += value
+    return products, sellers
+
+def _rows(totals, owner_column):
+    return [dict(counters, **{owner_column: owner, 'granularity': granularity, 'period_start': start})
+            for (owner, granularity, start), counters in totals.items()]
+
+def _settled(events, last_id, grace, now, gaps):
+    """The leading events up to the first id gap younger than grace"""
+    expected = last_id + 1
+    for index, event in enumerate(events):
+        if event.id != expected:
+            seen = gaps.setdefault((expected, event.id), now)
+            if now - seen < grace:
+                return events[:index]
+        expected = event.id + 1
+    return events
+
+def roll_up_events(batch_size=DEFAULT_ROLLUP_BATCH_SIZE, grace=DEFAULT_ROLLUP_GRACE):
+    """Fold new events into the activity rollups, returns the number of events folded"""
+    gaps = _state()['gaps']
+    total = 0
+    while True:
+        cursor = db.session.get(RollupCursor, CURSOR_NAME)
+        if cursor is None:
+            db.session.add(RollupCursor(name=CURSOR_NAME, last_event_id=0))
+            db.session.commit()
+            continue
+        last_id = cursor.last_event_id
+        events = db.session.execute(
+            select(Event.id, Event.kind, Event.product_id, Event.seller_id, Event.value, Event.created_at)
+            .where(Event.id > last_id)
+            .order_by(Event.id)
+            .limit(batch_size)
+        ).all()
+        fetched = len(events)
+        events = _settled(events, last_id, grace, time.monotonic(), gaps)
+        if not events:
+            db.session.rollback()
+            break
+
+        products, sellers = _fold([event[1:] for event in events])
+        _upsert(ProductActivity.__table__, ['product_id', 'granularity', 'period_start'],
+                _rows(products, 'product_id'))
+        _upsert(SellerActivity.__table__, ['seller_id', 'granularity', 'period_start'],
+                _rows(sellers, 'seller_id'))
+        advanced = db.session.execute(
+            update(RollupCursor)
+            .where(RollupCursor.name == CURSOR_NAME, RollupCursor.last_event_id == last_id)
+            .values(last_event_id=events[-1].id, updated_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if advanced != 1:
+            # Another worker folded this batch first
+            db.session.rollback()
+            break
+        db.session.commit()
+        db.session.expire_all()
+        for gap in [gap for gap in gaps if gap[1] <= events[-1].id]:
+            del gaps[gap]
+        total += len(events)
+        if len(events) < fetched or fetched < batch_size:
+            break
+
+    _stats['rolled_up'] += total
+    _stats['rollups'] += 1
+    return total
+
+def prune_events(now=None, retention_days=DEFAULT_RETENTION_DAYS, hourly_retention_days=DEFAULT_HOURLY_RETENTION_DAYS):
+    """Drop rolled-up events and hourly rows past their retention"""
+    now = now or datetime.utcnow()
+    cursor = db.session.get(RollupCursor, CURSOR_NAME)
+    if cursor is None:
+        return 0, 0
+    events = db.session.execute(delete(Event).where(
+        Event.id <= cursor.last_event_id, Event.created_at < now - timedelta(days=retention_days)
+    ).execution_options(synchronize_session=False)).rowcount
+    hours_cutoff = _day(now - timedelta(days=hourly_retention_days))
+    hours = 0
+    for table in (ProductActivity.__table__, SellerActivity.__table__):
+        hours += db.session.execute(delete(table).where(
+            table.c.granularity == 'hour', table.c.period_start < hours_cutoff)).rowcount
+    db.session.commit()
+    return events, hours
+
+def last_rollup_at():
+    cursor = db.session.get(RollupCursor, CURSOR_NAME)
+    return cursor.updated_at if cursor else None
+
+def activity_series(model, owner_id, since, until, granularity='day'):
+    """Rollup rows of one product (ProductActivity) or seller (SellerActivity) in a time range"""
+    owner = model.product_id if model is ProductActivity else model.seller_id
+    rows = db.session.execute(
+        select(model.period_start, *(getattr(model, name) for name in COUNTERS))
+        .where(owner == owner_id, model.granularity == granularity,
+               model.period_start >= (_hour(since) if granularity == 'hour' else _day(since)),
+               model.period_start <= until)
+        .order_by(model.period_start)
+    ).all()
+    return [dict(zip(('date',) + COUNTERS, row)) for row in rows]
+
+def top_products(seller_id, since, until, limit=10, order_by='views'):
+    """The seller's products with the most activity over the days since..until"""
+    totals = [func.sum(getattr(ProductActivity, name)).label(name) for name in COUNTERS]
+    rank = next(column for column in totals if column.name == order_by)
+    rows = db.session.execute(
+        select(ProductActivity.product_id, Product.title, Product.status, *totals)
+        .join(Product, Product.id == ProductActivity.product_id)
+        .where(Product.seller_id == seller_id, ProductActivity.granularity == 'day',
+               ProductActivity.period_start >= _day(since), ProductActivity.period_start <= until)
+        .group_by(ProductActivity.product_id, Product.title, Product.status)
+        .order_by(rank.desc(), ProductActivity.product_id)
+        .limit(limit)
+    ).all()
+    return [dict(row._mapping, revenue=round(row.revenue, 2)) for row in rows]
+
+def sum_series(series):
+    totals = dict.fromkeys(COUNTERS, 0)
+    for point in series:
+        for name in COUNTERS:
+            totals[name] += point[name]
+    totals['revenue'] = round(totals['revenue'], 2)
+    return totals
+
+def get_event_stats():
+    with _buffer_lock:
+        return dict(_stats, buffered=len(_state()['buffer']))
+
+def init_events(app):
+    """Configure the event buffer from app config"""
+    app.extensions['events'] = _new_state(app.config)
+
+def schedule_event_pipeline(scheduler, app):
+    """Flush this process's buffer periodically, roll events up on the scheduler leader"""
+    flush_interval = app.config.get('EVENT_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL)
+    rollup_interval = app.config.get('EVENT_ROLLUP_INTERVAL', DEFAULT_ROLLUP_INTERVAL)
+    batch_size = app.config.get('EVENT_ROLLUP_BATCH_SIZE', DEFAULT_ROLLUP_BATCH_SIZE)
+    grace = app.config.get('EVENT_ROLLUP_GRACE', DEFAULT_ROLLUP_GRACE)
+    retention_days = app.config.get('EVENT_RETENTION_DAYS', DEFAULT_RETENTION_DAYS)
+    hourly_retention_days = app.config.get('EVENT_HOURLY_RETENTION_DAYS', DEFAULT_HOURLY_RETENTION_DAYS)
+
+    def flush_at_exit():
+        with app.app_context():
+            try:
+                flush_events()
+            except Exception as e:
+                app.logger.warning('Event flush at exit failed: %s', e)
+
+    def roll_up():
+        roll_up_events(batch_size, grace)
+        prune_events(retention_days=retention_days, hourly_retention_days=hourly_retention_days)
+
+    atexit.register(flush_at_exit)
+    scheduler.add_job('event-flush', flush_events, interval=flush_interval, leader_only=False, jitter=0)
+    return scheduler.add_job('event-rollup', roll_up, interval=rollup_interval)
@@ -0,0 +1,208 @@
+"""Streaming exports of orders, sales, favorites and payment history.
+
+Each export is a flat Core SELECT (joined columns instead of nested
+``to_dict()`` payloads) executed with ``yield_per`` so the driver hands rows
+over in batches of ``EXPORT_BATCH_SIZE``.  Every batch is encoded to NDJSON or
+CSV (or into one JSON array) and yielded straight away, optionally through an incremental gzip
+compressor, so memory stays flat however many rows the user has.
+
+The response is streamed, which the compression hook in serialization leaves
+alone; gzip is applied here instead when the client asks for ``?gzip=1`` or
+accepts it and ``EXPORT_GZIP`` is on.
+"""
+import csv
+import io
+import zlib
+from datetime import date
+
+from flask import Response, current_app, request, stream_with_context
+from sqlalchemy import DateTime, select
+from sqlalchemy.orm import aliased
+
+from src.models.user import db, User, Product, Order, Favorite
+from src.services.metrics import record_exception
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_GZIP_LEVEL = 6
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json',
+    'csv': 'text/csv; charset=utf-8'
+}
+
+class ExportError(ValueError):
+    """Invalid export parameters, reported to the client as a 400"""
+
+def _order_columns(counterpart, counterpart_label):
+    return [
+        Order.id.label('order_id'),
+        Order.tracking_number,
+        Order.created_at,
+        Order.updated_at,
+        Order.order_status,
+        Order.payment_status,
+        Order.payment_method,
+        Order.quantity,
+        Order.total_price,
+        Order.shipping_address,
+        Order.product_id,
+        Product.title.label('product_title'),
+        Product.category.label('product_category'),
+        counterpart.id.label(f'{counterpart_label}_id'),
+        counterpart.username.label(f'{counterpart_label}_username')
+    ]
+
+def sales_query(user_id, status=None):
+    """Orders where user_id is the seller, newest first"""
+    buyer = aliased(User)
+    query = (select(*_order_columns(buyer, 'buyer'))
+             .join(Product, Product.id == Order.product_id)
+             .join(buyer, buyer.id == Order.buyer_id)
+             .where(Order.seller_id == user_id))
+    if status:
+        query = query.where(Order.order_status == status)
+    return query.order_by(Order.created_at.desc(), Order.id.desc())
+
+def orders_query(user_id, status=None):
+    """Orders where user_id is the buyer, newest first"""
+    seller = aliased(User)
+    query = (select(*_order_columns(seller, 'seller'))
+             .join(Product, Product.id == Order.product_id)
+             .join(seller, seller.id == Order.seller_id)
+             .where(Order.buyer_id == user_id))
+    if status:
+        query = query.where(Order.order_status == status)
+    return query.order_by(Order.created_at.desc(), Order.id.desc())
+
+def payments_query(user_id, status=None):
+    """Payment side of the user's purchases, newest first"""
+    seller = aliased(User)
+    query = (select(Order.id.label('order_id'), Order.tracking_number,
+                    Order.total_price.label('amount'), Order.payment_method, Order.payment_status,
+                    Order.order_status, Order.created_at, Order.updated_at, Order.product_id,
+                    Product.title.label('product_title'), seller.id.label('seller_id'),
+                    seller.username.label('seller_username'))
+             .join(Product, Product.id == Order.product_id)
+             .join(seller, seller.id == Order.seller_id)
+             .where(Order.buyer_id == user_id))
+    if status:
+        query = query.where(Order.payment_status == status)
+    return query.order_by(Order.created_at.desc(), Order.id.desc())
+
+def favorites_query(user_id, status=None):
+    """Listings the user saved, most recently saved first"""
+    query = (select(Favorite.created_at.label('favorited_at'), Product.id.label('product_id'),
+                    Product.title, Product.price, Product.category, Product.brand, Product.condition,
+                    Product.location, Product.status, Product.seller_id,
+                    User.username.label('seller_username'))
+             .join(Product, Product.id == Favorite.product_id)
+             .join(User, User.id == Product.seller_id)
+             .where(Favorite.user_id == user_id))
+    if status:
+        query = query.where(Product.status == status)
+    return query.order_by(Favorite.created_at.desc(), Favorite.id.desc())
+
+def _iter_batches(query, batch_size):
+    result = db.session.execute(query.execution_options(yield_per=batch_size))
+    try:
+        yield from result.partitions()
+    finally:
+        result.close()
+
+def _ndjson_encoder(names):
+    encode = current_app.json.encode
+
+    def encode_batch(rows):
+        return b''.join([encode(dict(zip(names, row))) + b'\n' for row in rows])
+    return None, encode_batch, None
+
+def _json_encoder(names):
+    encode = current_app.json.encode
+    separator = [b'']
+
+    def encode_batch(rows):
+        data = separator[0] + b','.join([encode(dict(zip(names, row))) for row in rows])
+        separator[0] = b','
+        return data
+    return b'[', encode_batch, b']'
+
+def _csv_encoder(names, datetime_columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def drain():
+        data = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+        return data
+
+    def encode_batch(rows):
+        if datetime_columns:
+            rows = [list(row) for row in rows]
+            for row in rows:
+                for index in datetime_columns:
+                    if row[index] is not None:
+                        row[index] = row[index].isoformat()
+        writer.writerows(rows)
+        return drain()
+
+    writer.writerow(names)
+    return drain(), encode_batch, None
+
+def _gzip(chunks, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def _wants_gzip():
+    requested = request.args.get('gzip')
+    if requested is not None:
+        return requested in ('1', 'true')
+    return current_app.config.get('EXPORT_GZIP', True) and request.accept_encodings.best_match(['gzip']) == 'gzip'
+
+def export_response(query, basename, fmt=None, attachment=True):
+    """Stream the rows of query as NDJSON, CSV or a JSON array, by default as an attachment"""
+    fmt = fmt or request.args.get('format', 'ndjson')
+    if fmt not in FORMATS:
+        raise ExportError(f'Format d\'export inconnu: {fmt}')
+    batch_size = current_app.config.get('EXPORT_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+
+    columns = query.selected_columns
+    names = [column.key for column in columns]
+    if fmt == 'csv':
+        datetime_columns = [index for index, column in enumerate(columns) if isinstance(column.type, DateTime)]
+        header, encode_batch, footer = _csv_encoder(names, datetime_columns)
+    elif fmt == 'json':
+        header, encode_batch, footer = _json_encoder(names)
+    else:
+        header, encode_batch, footer = _ndjson_encoder(names)
+
+    def generate():
+        try:
+            if header:
+                yield header
+            for rows in _iter_batches(query, batch_size):
+                yield encode_batch(rows)
+            if footer:
+                yield footer
+        except Exception as e:
+            # Headers are gone already; count it and cut the stream short
+            record_exception(e)
+            raise
+
+    chunks = generate()
+    compress = _wants_gzip()
+    if compress:
+        chunks = _gzip(chunks, current_app.config.get('EXPORT_GZIP_LEVEL', DEFAULT_GZIP_LEVEL))
+    response = Response(stream_with_context(chunks), content_type=FORMATS[fmt])
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    if attachment:
+        response.headers['Content-Disposition'] = (
+            f'attachment; filename="{basename}-{date.today():%Y%m%d}.{fmt}"')
+    response.headers['Cache-Control'] = 'no-store'
+    return response
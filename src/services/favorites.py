@@ -0,0 +1,79 @@
+"""Favorites with atomic counters.
+
+A favorite is unique per (user_id, product_id).  Adding one is an
+``INSERT ... ON CONFLICT DO NOTHING`` and removing one a plain DELETE; only
+the statement that actually changed a row moves ``Product.favorites_count``,
+with an in-SQL increment, so concurrent toggles can neither duplicate a
+favorite nor lose a count.  The functions run on the current session and
+leave the commit to the caller.
+"""
+from sqlalchemy import case, delete, select, update
+from sqlalchemy.orm import selectinload
+
+from src.models.user import db, Product, Favorite
+from src.services.database import dialect_insert
+
+MAX_STATE_IDS = 200
+
+def _insert_ignore():
+    return dialect_insert(Favorite.__table__, db.engine).on_conflict_do_nothing(
+        index_elements=['user_id', 'product_id'])
+
+def _bump_count(product_id, delta):
+    count = Product.favorites_count
+    new_count = count + 1 if delta > 0 else case((count > 0, count - 1), else_=0)
+    return db.session.execute(
+        update(Product)
+        .where(Product.id == product_id)
+        .values(favorites_count=new_count)
+        .returning(Product.favorites_count)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+
+def _current_count(product_id):
+    return db.session.execute(select(Product.favorites_count).where(Product.id == product_id)).scalar()
+
+def add_favorite(user_id, product_id):
+    """Favorite a product; returns (added, favorites_count), added is False if it already was"""
+    inserted = db.session.execute(_insert_ignore().values(user_id=user_id, product_id=product_id)).rowcount
+    if inserted:
+        return True, _bump_count(product_id, 1)
+    return False, _current_count(product_id)
+
+def remove_favorite(user_id, product_id):
+    """Unfavorite a product; returns (removed, favorites_count)"""
+    deleted = db.session.execute(
+        delete(Favorite)
+        .where(Favorite.user_id == user_id, Favorite.product_id == product_id)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if deleted:
+        return True, _bump_count(product_id, -1)
+    return False, _current_count(product_id)
+
+def toggle_favorite_state(user_id, product_id):
+    """Remove the favorite if present, else add it; returns ('added'|'removed', favorites_count)"""
+    removed, count = remove_favorite(user_id, product_id)
+    if removed:
+        return 'removed', count
+    _, count = add_favorite(user_id, product_id)
+    return 'added', count
+
+def favorite_states(user_id, product_ids):
+    """Which of product_ids the user has favorited, in one query"""
+    if not product_ids:
+        return set()
+    return set(db.session.execute(
+        select(Favorite.product_id).where(Favorite.user_id == user_id, Favorite.product_id.in_(product_ids))
+    ).scalars())
+
+def favorite_products(user_id, status='active'):
+    """The user's favorited products, newest favorite first, sellers loaded in one extra query"""
+    query = (select(Product)
+             .join(Favorite, Favorite.product_id == Product.id)
+             .where(Favorite.user_id == user_id)
+             .options(selectinload(Product.seller))
+             .order_by(Favorite.created_at.desc(), Favorite.id.desc()))
+    if status:
+        query = query.where(Product.status == status)
+    return db.session.execute(query).scalars().all()
@@ -0,0 +1,179 @@
+"""Password hashing service.
+
+scrypt is deliberately expensive, so hashes are computed in a bounded process
+pool instead of the request thread.  When every worker is busy and the backlog
+reaches ``PASSWORD_HASH_MAX_QUEUE`` new calls fail fast with HashingBusyError
+instead of piling up behind a login storm.  The scrypt cost is calibrated to
+``PASSWORD_HASH_TARGET_MS``, never below Werkzeug's default, by the first
+worker that starts serving (schedule_hash_calibration); it stores the method in
+the ``AppSetting`` table and every other worker adopts the stored one, so all
+of them hash alike.  Hashes with a weaker method are upgraded on the next
+successful login (see needs_rehash).
+"""
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from flask import current_app, has_app_context
+from sqlalchemy import select
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from src.services.database import dialect_insert
+
+DEFAULT_HASH_METHOD = 'scrypt:32768:8:1'  # Werkzeug's default
+DEFAULT_TARGET_MS = 100
+DEFAULT_TIMEOUT = 10  # seconds
+# Candidate scrypt work factors, cheapest first; none below Werkzeug's default
+SCRYPT_COST_CANDIDATES = [2 ** 15, 2 ** 16, 2 ** 17]
+METHOD_SETTING = 'password_hash_method'
+
+class HashingBusyError(Exception):
+    """Raised when the hashing backlog is full"""
+
+_defaults = {
+    'method': DEFAULT_HASH_METHOD,
+    'workers': 0,  # 0 = hash inline (outside an app, before init_hashing or when disabled)
+    'max_queue': 0,
+    'timeout': DEFAULT_TIMEOUT,
+    'slots': None,
+    'pool': None
+}
+_pool_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {'rejected': 0}
+
+def _bump(key, amount=1):
+    with _stats_lock:
+        _stats[key] += amount
+
+def _state():
+    """The current app's settings and pool (see init_hashing), the defaults outside an app"""
+    return current_app.extensions.get('hashing', _defaults) if has_app_context() else _defaults
+
+def _generate(password, method):
+    return generate_password_hash(password, method=method)
+
+def _check(pwhash, password):
+    return check_password_hash(pwhash, password)
+
+def _get_pool(state):
+    if state['pool'] is None:
+        with _pool_lock:
+            if state['pool'] is None:
+                state['pool'] = ProcessPoolExecutor(max_workers=state['workers'])
+    return state['pool']
+
+def _run(func, *args):
+    """Run func in the pool, or inline when no pool is configured"""
+    state = _state()
+    if not state['workers']:
+        return func(*args)
+
+    if not state['slots'].acquire(blocking=False):
+        _bump('rejected')
+        raise HashingBusyError('Trop de demandes d\'authentification en cours')
+    try:
+        return _get_pool(state).submit(func, *args).result(timeout=state['timeout'])
+    finally:
+        state['slots'].release()
+
+def hash_password(password):
+    """Hash a password with the current (calibrated) method"""
+    return _run(_generate, password, _state()['method'])
+
+def verify_password(pwhash, password):
+    """Check a password against a stored hash"""
+    return _run(_check, pwhash, password)
+
+def hash_passwords(passwords):
+    """Hash many passwords in parallel (bulk imports, seeding)"""
+    state = _state()
+    method = state['method']
+    if not state['workers']:
+        return [_generate(password, method) for password in passwords]
+    chunksize = max(1, len(passwords) // (state['workers'] * 4))
+    return list(_get_pool(state).map(_generate, passwords, [method] * len(passwords), chunksize=chunksize))
+
+def _scrypt_cost(method):
+    parts = method.split(':')
+    if parts[0] == 'scrypt' and len(parts) > 1 and parts[1].isdigit():
+        return int(parts[1])
+    return None
+
+def needs_rehash(pwhash):
+    """True if the hash was made with a weaker or different kind of method than the current one"""
+    if not pwhash or '$' not in pwhash:
+        return False  # Not a Werkzeug hash (e.g. OAuth placeholder)
+    method, current = pwhash.split('$', 1)[0], _state()['method']
+    if method == current:
+        return False
+    cost, current_cost = _scrypt_cost(method), _scrypt_cost(current)
+    if cost is not None and current_cost is not None:
+        # Only ever upgrade, a hash is never rewritten back and forth
+        return cost < current_cost
+    return True
+
+def current_method():
+    return _state()['method']
+
+def calibrate_hash_method(target_ms=DEFAULT_TARGET_MS):
+    """Pick the most expensive scrypt cost whose hash time stays under target_ms, at least the default"""
+    chosen = 'scrypt:%d:8:1' % SCRYPT_COST_CANDIDATES[0]
+    for n in SCRYPT_COST_CANDIDATES:
+        method = 'scrypt:%d:8:1' % n
+        started = time.perf_counter()
+        generate_password_hash('calibration', method=method)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if elapsed_ms > target_ms:
+            break
+        chosen = method
+    return chosen
+
+def shared_hash_method(target_ms=DEFAULT_TARGET_MS):
+    """The method stored for every worker; calibrates and stores one if there is none yet"""
+    from src.models.user import db, AppSetting
+
+    stored = select(AppSetting.value).where(AppSetting.name == METHOD_SETTING)
+    method = db.session.execute(stored).scalar()
+    if method is None:
+        statement = dialect_insert(AppSetting.__table__, db.engine).values(
+            name=METHOD_SETTING, value=calibrate_hash_method(target_ms), updated_at=datetime.utcnow())
+        # Another worker may have stored its own meanwhile; the first one wins
+        db.session.execute(statement.on_conflict_do_nothing(index_elements=['name']))
+        db.session.commit()
+        method = db.session.execute(stored).scalar()
+    return method
+
+def init_hashing(app):
+    """Configure the pool from app config"""
+    workers = app.config.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1)
+    max_queue = app.config.get('PASSWORD_HASH_MAX_QUEUE', workers * 4)
+    app.extensions['hashing'] = {
+        'method': app.config.get('PASSWORD_HASH_METHOD', DEFAULT_HASH_METHOD),
+        'workers': workers,
+        'max_queue': max_queue,
+        'timeout': app.config.get('PASSWORD_HASH_TIMEOUT', DEFAULT_TIMEOUT),
+        'slots': threading.BoundedSemaphore(max(max_queue, 1)),
+        'pool': None
+    }
+
+def schedule_hash_calibration(scheduler, app):
+    """Adopt the shared scrypt cost at startup, in every process, unless a method is pinned"""
+    if app.config.get('PASSWORD_HASH_METHOD') is not None or not app.config.get('PASSWORD_HASH_CALIBRATE', True):
+        return None
+
+    target_ms = app.config.get('PASSWORD_HASH_TARGET_MS', DEFAULT_TARGET_MS)
+
+    def calibrate():
+        state = app.extensions['hashing']
+        state['method'] = shared_hash_method(target_ms)
+        app.logger.info('Password hash method set to %s', state['method'])
+
+    return scheduler.add_job('hash-calibration', calibrate, once=True, leader_only=False, jitter=0)
+
+def get_hashing_stats():
+    state = _state()
+    with _stats_lock:
+        return dict({key: state[key] for key in ('method', 'workers', 'max_queue', 'timeout')}, **_stats)
@@ -0,0 +1,104 @@
+"""Current-user resolution shared by every blueprint.
+
+The signed-in user is resolved once per request and kept on ``g``.  Across
+requests each process also keeps the user's column values for a few seconds
+(``USER_CACHE_TTL``) and re-attaches them to the session with
+``merge(load=False)``, so authenticated API calls don't start with a SELECT.
+The cache belongs to the app (``app.extensions['identity']``).  Anything that
+changes a user row must call invalidate_user().
+"""
+import hmac
+import threading
+import time
+
+from flask import g, session, request, current_app, has_app_context
+from sqlalchemy.orm import make_transient_to_detached
+
+from src.models.user import db, User
+
+DEFAULT_USER_CACHE_TTL = 30  # seconds
+DEFAULT_USER_CACHE_SIZE = 10000
+
+def _new_state(config):
+    return {
+        'ttl': config.get('USER_CACHE_TTL', DEFAULT_USER_CACHE_TTL),
+        'max_entries': config.get('USER_CACHE_SIZE', DEFAULT_USER_CACHE_SIZE),
+        'cache': {},  # user_id -> (expires_at, column values)
+        'stats': {'hits': 0, 'misses': 0, 'invalidations': 0}
+    }
+
+_defaults = _new_state({})
+_cache_lock = threading.Lock()
+
+def _state():
+    """The current app's cache and stats (see init_identity), the defaults outside an app"""
+    return current_app.extensions.get('identity', _defaults) if has_app_context() else _defaults
+
+def _snapshot(user):
+    return {column.key: getattr(user, column.key) for column in User.__table__.columns}
+
+def _remember(state, user):
+    if state['ttl'] <= 0:
+        return
+
+    cache = state['cache']
+    now = time.monotonic()
+    with _cache_lock:
+        if len(cache) >= state['max_entries']:
+            for user_id in [key for key, (expires_at, _) in cache.items() if expires_at <= now]:
+                del cache[user_id]
+            if len(cache) >= state['max_entries']:
+                cache.clear()
+        cache[user.id] = (now + state['ttl'], _snapshot(user))
+
+def load_user(user_id):
+    """Get a session-bound User, from the identity cache when possible"""
+    state = _state()
+    entry = state['cache'].get(user_id)
+    if entry and entry[0] > time.monotonic():
+        state['stats']['hits'] += 1
+        user = User(**entry[1])
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    state['stats']['misses'] += 1
+    user = db.session.get(User, user_id)
+    if user:
+        _remember(state, user)
+    return user
+
+def get_current_user():
+    """Get the signed-in user for this request, or None"""
+    if '_current_user' not in g:
+        user_id = session.get('user_id')
+        g._current_user = load_user(user_id) if user_id else None
+    return g._current_user
+
+def require_auth():
+    """Helper function to check authentication"""
+    return get_current_user()
+
+def require_admin():
+    """Helper function to check the admin token header"""
+    expected = current_app.config.get('ADMIN_TOKEN')
+    provided = request.headers.get('X-Admin-Token', '')
+    return bool(expected) and hmac.compare_digest(provided, expected)
+
+def invalidate_user(user_id):
+    """Drop cached identity data after the user row changed"""
+    state = _state()
+    with _cache_lock:
+        state['cache'].pop(user_id, None)
+    state['stats']['invalidations'] += 1
+
+    current = g.get('_current_user')
+    if current is not None and current.id == user_id:
+        g.pop('_current_user')
+
+def get_identity_cache_stats():
+    state = _state()
+    return dict(state['stats'], size=len(state['cache']))
+
+def init_identity(app):
+    """Configure the identity cache from app config"""
+    app.extensions['identity'] = _new_state(app.config)
@@ -0,0 +1,219 @@
+"""Request, SQL and outbound-call metrics in the Prometheus text format.
+
+Each thread records into its own shard, so the hot path takes no lock: only
+the owning thread writes a shard and ``/metrics`` merges them when scraped
+(shards of finished threads are folded into a retired shard).  Recorded:
+
+- latency histogram and request count per endpoint, method and status
+- SQL statement count and time per request (SQLAlchemy cursor events)
+- outbound HTTP timings per service (OSM tiles, Nominatim, MTN, Airtel),
+  wrapped with ``outbound_call``
+- errors per endpoint and exception type, from views returning
+  ``server_error(e)`` and from unhandled exceptions
+- run time of the scheduled jobs, per job and outcome
+
+Set ``METRICS_TOKEN`` to require ``Authorization: Bearer <token>`` on scrape.
+"""
+import hmac
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from flask import Response, jsonify, request, has_request_context, got_request_exception
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+JOB_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+
+# name -> (type, help, label names, buckets)
+METRICS = {
+    'kitala_http_request_duration_seconds': (
+        'histogram', 'Request latency by endpoint', ('endpoint', 'method'), LATENCY_BUCKETS),
+    'kitala_http_requests_total': (
+        'counter', 'Requests by endpoint and status', ('endpoint', 'method', 'status'), None),
+    'kitala_db_statements_per_request': (
+        'histogram', 'SQL statements executed per request', ('endpoint',), COUNT_BUCKETS),
+    'kitala_db_time_per_request_seconds': (
+        'histogram', 'Time spent in SQL per request', ('endpoint',), LATENCY_BUCKETS),
+    'kitala_db_statements_total': (
+        'counter', 'SQL statements executed, in and out of requests', (), None),
+    'kitala_db_statement_seconds_total': (
+        'counter', 'Time spent executing SQL statements', (), None),
+    'kitala_outbound_request_duration_seconds': (
+        'histogram', 'Outbound HTTP call latency by service', ('service', 'outcome'), LATENCY_BUCKETS),
+    'kitala_errors_total': (
+        'counter', 'Exceptions by endpoint and type', ('endpoint', 'exception'), None),
+    'kitala_admission_rejections_total': (
+        'counter', 'Requests turned away by admission control', ('endpoint_class', 'reason'), None),
+    'kitala_job_duration_seconds': (
+        'histogram', 'Scheduled job run time by job and outcome', ('job', 'outcome'), JOB_BUCKETS)
+}
+
+class _Shard:
+    """Metric values written by a single thread"""
+
+    def __init__(self, thread=None):
+        self.thread = thread
+        self.values = {}  # (name, label values) -> float, or [bucket counts..., sum, count]
+
+    def merge_into(self, totals):
+        while True:
+            try:
+                items = list(self.values.items())
+                break
+            except RuntimeError:  # the owner added a series while we copied
+                continue
+        for key, value in items:
+            if isinstance(value, list):
+                total = totals.setdefault(key, [0] * len(value))
+                for index, item in enumerate(value):
+                    total[index] += item
+            else:
+                totals[key] = totals.get(key, 0) + value
+
+_local = threading.local()
+_shards = []
+_shards_lock = threading.Lock()
+_retired = _Shard()
+
+def _shard():
+    shard = getattr(_local, 'shard', None)
+    if shard is None:
+        shard = _local.shard = _Shard(threading.current_thread())
+        with _shards_lock:
+            _shards.append(shard)
+    return shard
+
+def inc(name, labels=(), amount=1):
+    values = _shard().values
+    key = (name, labels)
+    values[key] = values.get(key, 0) + amount
+
+def observe(name, labels, value):
+    values = _shard().values
+    key = (name, labels)
+    series = values.get(key)
+    buckets = METRICS[name][3]
+    if series is None:
+        series = values[key] = [0] * (len(buckets) + 3)
+    series[bisect_left(buckets, value)] += 1
+    series[-2] += value
+    series[-1] += 1
+
+def _endpoint():
+    return request.endpoint or 'unmatched'
+
+def record_exception(e):
+    """Count an exception against the current endpoint"""
+    endpoint = _endpoint() if has_request_context() else 'background'
+    inc('kitala_errors_total', (endpoint, type(e).__name__))
+
+def server_error(e):
+    """Record an exception caught by a view and build the usual 500 response"""
+    record_exception(e)
+    return jsonify({'error': str(e)}), 500
+
+@contextmanager
+def outbound_call(service):
+    """Time an outbound HTTP call; usable as a context manager or decorator"""
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        observe('kitala_outbound_request_duration_seconds', (service, outcome), time.perf_counter() - started)
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['metrics_started_at'] = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info.pop('metrics_started_at', time.perf_counter())
+    inc('kitala_db_statements_total')
+    inc('kitala_db_statement_seconds_total', (), elapsed)
+    current = getattr(_local, 'request', None)
+    if current is not None:
+        current[1] += 1
+        current[2] += elapsed
+
+def _start_request():
+    # [started_at, SQL statements, SQL seconds]
+    _local.request = [time.perf_counter(), 0, 0.0]
+
+def _finish_request(response):
+    current = getattr(_local, 'request', None)
+    if current is None:
+        return response
+    _local.request = None
+
+    endpoint = _endpoint()
+    observe('kitala_http_request_duration_seconds', (endpoint, request.method), time.perf_counter() - current[0])
+    inc('kitala_http_requests_total', (endpoint, request.method, str(response.status_code)))
+    observe('kitala_db_statements_per_request', (endpoint,), current[1])
+    observe('kitala_db_time_per_request_seconds', (endpoint,), current[2])
+    return response
+
+def _on_exception(sender, exception, **extra):
+    record_exception(exception)
+
+def collect():
+    """Merge every thread's shard into {(name, labels): value}"""
+    totals = {}
+    with _shards_lock:
+        for shard in [shard for shard in _shards if not shard.thread.is_alive()]:
+            shard.merge_into(_retired.values)
+            _shards.remove(shard)
+        _retired.merge_into(totals)
+        shards = list(_shards)
+    for shard in shards:
+        shard.merge_into(totals)
+    return totals
+
+def _label_text(names, values, extra=''):
+    pairs = [
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def render_prometheus(totals=None):
+    """Prometheus text exposition of the collected metrics"""
+    totals = collect() if totals is None else totals
+    lines = []
+    for name, (kind, help_text, label_names, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for (series_name, labels), value in sorted(totals.items()):
+            if series_name != name:
+                continue
+            if kind == 'counter':
+                lines.append(f'{name}{_label_text(label_names, labels)} {value}')
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + ('+Inf',), value):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f'{name}_bucket{_label_text(label_names, labels, le)} {cumulative}')
+            lines.append(f'{name}_sum{_label_text(label_names, labels)} {value[-2]}')
+            lines.append(f'{name}_count{_label_text(label_names, labels)} {value[-1]}')
+    return '\n'.join(lines) + '\n'
+
+def init_metrics(app):
+    """Time every request and expose /metrics; call first so it wraps the other hooks"""
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    got_request_exception.connect(_on_exception, app)
+
+    @app.route('/metrics')
+    def metrics():
+        token = app.config.get('METRICS_TOKEN')
+        if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return jsonify({'error': 'Accès refusé'}), 403
+        return Response(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,336 @@
+"""Product price history.
+
+Every price a listing takes is appended to ``PriceHistory`` by mapper events
+on Product (creation and updates that change ``price``); bulk imports record
+the initial prices with one INSERT ... SELECT.
+
+compact_price_history() keeps the table small: points older than
+``PRICE_HISTORY_RAW_DAYS`` are folded into daily ``PriceAggregate`` rows
+(open/close/min/max/avg), daily rows older than ``PRICE_HISTORY_DAILY_DAYS``
+into weekly ones.  It works through product id windows so each transaction
+stays short.  refresh_category_medians() stores the median asking price of
+every category once a day, which makes category_trend() two primary-key
+reads.  Both run periodically as a scheduler job.
+"""
+import itertools
+import threading
+from datetime import datetime, timedelta, time as day_start
+
+from flask import current_app, has_app_context
+from sqlalchemy import delete, event, func, insert, inspect, select
+
+from src.models.user import db, Product, PriceHistory, PriceAggregate, CategoryPriceStat
+
+DEFAULT_RAW_DAYS = 30
+DEFAULT_DAILY_DAYS = 365
+DEFAULT_COMPACT_INTERVAL = 3600  # seconds
+DEFAULT_WINDOW_SIZE = 1000  # product ids per compaction transaction
+DEFAULT_TREND_DAYS = 7
+TREND_THRESHOLD = 0.03  # relative median change counted as a trend
+GRANULARITIES = ('raw', 'day', 'week')
+
+def _new_settings(config):
+    return {
+        'raw_days': config.get('PRICE_HISTORY_RAW_DAYS', DEFAULT_RAW_DAYS),
+        'daily_days': config.get('PRICE_HISTORY_DAILY_DAYS', DEFAULT_DAILY_DAYS),
+        'trend_days': config.get('PRICE_TREND_DAYS', DEFAULT_TREND_DAYS)
+    }
+
+_defaults = _new_settings({})
+_stats_lock = threading.Lock()
+_stats = {'recorded': 0, 'compactions': 0, 'points_folded': 0, 'days_folded': 0, 'median_refreshes': 0}
+
+def _bump(key, amount=1):
+    with _stats_lock:
+        _stats[key] += amount
+
+def _settings():
+    """The current app's settings (see init_price_history), the defaults outside an app"""
+    return current_app.extensions.get('price_history', _defaults) if has_app_context() else _defaults
+
+@event.listens_for(Product, 'after_insert')
+def _record_initial_price(mapper, connection, target):
+    connection.execute(insert(PriceHistory.__table__).values(
+        product_id=target.id, price=target.price, ts=target.created_at or datetime.utcnow()))
+    _bump('recorded')
+
+@event.listens_for(Product, 'after_update')
+def _record_price_change(mapper, connection, target):
+    if inspect(target).attrs.price.history.has_changes():
+        connection.execute(insert(PriceHistory.__table__).values(
+            product_id=target.id, price=target.price, ts=datetime.utcnow()))
+        _bump('recorded')
+
+def record_imported_prices(connection, after_id):
+    """Initial price points of the products inserted with ids above after_id"""
+    result = connection.execute(insert(PriceHistory.__table__).from_select(
+        ['product_id', 'price', 'ts'],
+        select(Product.id, Product.price, func.coalesce(Product.created_at, datetime.utcnow()))
+        .where(Product.id > after_id)
+    ))
+    _bump('recorded', max(result.rowcount, 0))
+
+def _day(ts):
+    return datetime.combine(ts.date(), day_start())
+
+def _week(ts):
+    return _day(ts) - timedelta(days=ts.weekday())
+
+PERIODS = {'day': _day, 'week': _week}
+
+def _rollup(points, period):
+    """Fold time-ordered (start, open, close, min, max, sum, samples) tuples per period"""
+    rolled = []
+    for start, group in itertools.groupby(points, key=lambda point: period(point[0])):
+        group = list(group)
+        rolled.append((
+            start,
+            group[0][1],
+            group[-1][2],
+            min(point[3] for point in group),
+            max(point[4] for point in group),
+            sum(point[5] for point in group),
+            sum(point[6] for point in group)
+        ))
+    return rolled
+
+def _raw_points(rows):
+    return [(ts, price, price, price, price, price, 1) for ts, price in rows]
+
+def _aggregate_points(rows):
+    return [(row.period_start, row.open_price, row.close_price, row.min_price, row.max_price,
+             row.avg_price * row.samples, row.samples) for row in rows]
+
+def _aggregate_rows(product_id, granularity, points):
+    return [{
+        'product_id': product_id,
+        'granularity': granularity,
+        'period_start': start,
+        'open_price': open_price,
+        'close_price': close_price,
+        'min_price': min_price,
+        'max_price': max_price,
+        'avg_price': round(total / samples, 2),
+        'samples': samples
+    } for start, open_price, close_price, min_price, max_price, total, samples in points]
+
+def _window_aggregates(low, high, granularity, start, end):
+    query = (select(*PriceAggregate.__table__.columns)
+             .where(PriceAggregate.product_id > low, PriceAggregate.product_id <= high,
+                    PriceAggregate.granularity == granularity, PriceAggregate.period_start < end)
+             .order_by(PriceAggregate.product_id, PriceAggregate.period_start))
+    if start is not None:
+        query = query.where(PriceAggregate.period_start >= start)
+    return db.session.execute(query).all()
+
+def _replace_aggregates(low, high, granularity, start, end, points):
+    """Swap the window's rows of granularity in [start, end) for the rollup of points"""
+    rows = []
+    points.sort(key=lambda point: (point[0], point[1]))
+    for product_id, group in itertools.groupby(points, key=lambda point: point[0]):
+        rolled = _rollup([point[1:] for point in group], PERIODS[granularity])
+        rows.extend(_aggregate_rows(product_id, granularity, rolled))
+    db.session.execute(delete(PriceAggregate.__table__).where(
+        PriceAggregate.product_id > low, PriceAggregate.product_id <= high,
+        PriceAggregate.granularity == granularity,
+        PriceAggregate.period_start >= start, PriceAggregate.period_start < end))
+    if rows:
+        db.session.execute(insert(PriceAggregate.__table__), rows)
+
+def _fold_window(low, high, raw_cutoff, daily_cutoff):
+    """Downsample the old points of products low < id <= high, in one transaction"""
+    raw = db.session.execute(
+        select(PriceHistory.product_id, PriceHistory.ts, PriceHistory.price)
+        .where(PriceHistory.product_id > low, PriceHistory.product_id <= high, PriceHistory.ts < raw_cutoff)
+    ).all()
+    if raw:
+        # Merge with daily rows already covering those days, if any
+        first_day = _day(min(row.ts for row in raw))
+        existing = _window_aggregates(low, high, 'day', first_day, raw_cutoff)
+        points = [(row.product_id,) + point for row in raw for point in _raw_points([(row.ts, row.price)])]
+        points += [(row.product_id,) + point for row in existing for point in _aggregate_points([row])]
+        _replace_aggregates(low, high, 'day', first_day, raw_cutoff, points)
+        db.session.execute(delete(PriceHistory.__table__).where(
+            PriceHistory.product_id > low, PriceHistory.product_id <= high, PriceHistory.ts < raw_cutoff))
+
+    old_days = _window_aggregates(low, high, 'day', None, daily_cutoff)
+    if old_days:
+        first_week = _week(min(row.period_start for row in old_days))
+        existing = _window_aggregates(low, high, 'week', first_week, daily_cutoff)
+        points = [(row.product_id,) + point for row in old_days + existing for point in _aggregate_points([row])]
+        _replace_aggregates(low, high, 'week', first_week, daily_cutoff, points)
+        db.session.execute(delete(PriceAggregate.__table__).where(
+            PriceAggregate.product_id > low, PriceAggregate.product_id <= high,
+            PriceAggregate.granularity == 'day', PriceAggregate.period_start < daily_cutoff))
+
+    db.session.commit()
+    return len(raw), len(old_days)
+
+def compact_price_history(now=None, window_size=DEFAULT_WINDOW_SIZE):
+    """Fold old raw points into daily rows and old daily rows into weekly ones.
+
+    Cutoffs are aligned on day and week boundaries so a period is always
+    folded in one go.  Returns the number of raw points and daily rows folded.
+    """
+    now = now or datetime.utcnow()
+    settings = _settings()
+    raw_cutoff = _day(now - timedelta(days=settings['raw_days']))
+    daily_cutoff = _week(now - timedelta(days=settings['daily_days']))
+    last_id = db.session.execute(select(func.max(Product.id))).scalar() or 0
+
+    folded_points = folded_days = 0
+    for low in range(0, last_id, window_size):
+        points, days = _fold_window(low, low + window_size, raw_cutoff, daily_cutoff)
+        folded_points += points
+        folded_days += days
+
+    _bump('compactions')
+    _bump('points_folded', folded_points)
+    _bump('days_folded', folded_days)
+    return folded_points, folded_days
+
+def _median(category, listings):
+    offset = (listings - 1) // 2
+    prices = db.session.execute(
+        select(Product.price)
+        .where(Product.category == category, Product.status == 'active')
+        .order_by(Product.price)
+        .limit(1 if listings % 2 else 2).offset(offset)
+    ).scalars().all()
+    return sum(prices) / len(prices)
+
+def refresh_category_medians(day=None, force=False):
+    """Store today's median active price per category; skipped when already done"""
+    day = day or datetime.utcnow().date()
+    if not force and db.session.execute(
+            select(CategoryPriceStat.day).where(CategoryPriceStat.day == day).limit(1)).first():
+        return 0
+
+    counts = db.session.execute(
+        select(Product.category, func.count())
+        .where(Product.status == 'active')
+        .group_by(Product.category)
+    ).all()
+    rows = [{'category': category, 'day': day, 'median_price': round(_median(category, listings), 2),
+             'listings': listings} for category, listings in counts]
+
+    db.session.execute(delete(CategoryPriceStat.__table__).where(CategoryPriceStat.day == day))
+    if rows:
+        db.session.execute(insert(CategoryPriceStat.__table__), rows)
+    db.session.commit()
+    _bump('median_refreshes')
+    return len(rows)
+
+def _median_on(category, day):
+    return db.session.execute(
+        select(CategoryPriceStat.median_price)
+        .where(CategoryPriceStat.category == category, CategoryPriceStat.day <= day)
+        .order_by(CategoryPriceStat.day.desc())
+        .limit(1)
+    ).scalar()
+
+def category_trend(category, today=None):
+    """Latest category median and its direction over PRICE_TREND_DAYS"""
+    today = today or datetime.utcnow().date()
+    current = _median_on(category, today)
+    previous = _median_on(category, today - timedelta(days=_settings()['trend_days']))
+    trend = 'stable'
+    if current and previous:
+        change = current / previous - 1
+        if change > TREND_THRESHOLD:
+            trend = 'increasing'
+        elif change < -TREND_THRESHOLD:
+            trend = 'decreasing'
+    return {'median_price': current, 'trend': trend}
+
+def choose_granularity(since, until):
+    span = until - since
+    settings = _settings()
+    if span <= timedelta(days=settings['raw_days'] + 1):
+        return 'raw'
+    if span <= timedelta(days=settings['daily_days']):
+        return 'day'
+    return 'week'
+
+def _price_before(product_id, since):
+    price = db.session.execute(
+        select(PriceHistory.price)
+        .where(PriceHistory.product_id == product_id, PriceHistory.ts < since)
+        .order_by(PriceHistory.ts.desc())
+        .limit(1)
+    ).scalar()
+    if price is None:
+        price = db.session.execute(
+            select(PriceAggregate.close_price)
+            .where(PriceAggregate.product_id == product_id, PriceAggregate.period_start < since)
+            .order_by(PriceAggregate.period_start.desc())
+            .limit(1)
+        ).scalar()
+    return price
+
+def price_series(product_id, since, until=None, granularity='auto'):
+    """Price points of a product between since and until.
+
+    ``raw`` returns the price changes themselves, ``day``/``week`` one OHLC
+    entry per period.  Periods older than the retention of a finer level come
+    at the coarser level they were downsampled to.  The series opens with the
+    price the listing had at ``since``.
+    """
+    until = until or datetime.utcnow()
+    if granularity == 'auto':
+        granularity = choose_granularity(since, until)
+
+    aggregates = db.session.execute(
+        select(*PriceAggregate.__table__.columns)
+        .where(PriceAggregate.product_id == product_id,
+               PriceAggregate.period_start >= since, PriceAggregate.period_start <= until)
+        .order_by(PriceAggregate.period_start)
+    ).all()
+    raw = db.session.execute(
+        select(PriceHistory.ts, PriceHistory.price)
+        .where(PriceHistory.product_id == product_id, PriceHistory.ts >= since, PriceHistory.ts <= until)
+        .order_by(PriceHistory.ts)
+    ).all()
+
+    opening = _price_before(product_id, since)
+    if granularity == 'raw':
+        series = [] if opening is None else [{'date': since, 'price': opening}]
+        for point in _aggregate_points(aggregates):
+            series.append({'date': point[0], 'price': point[2], 'min': point[3], 'max': point[4]})
+        series.extend({'date': ts, 'price': price} for ts, price in raw)
+        return granularity, series
+
+    # The opening price counts as a point at since, so the first period opens with it
+    points = _raw_points([(since, opening)] if opening is not None else [])
+    points += _aggregate_points(aggregates) + _raw_points(raw)
+    points.sort(key=lambda point: point[0])
+    series = []
+    for start, open_price, close_price, min_price, max_price, total, samples in _rollup(points, PERIODS[granularity]):
+        series.append({
+            'date': start,
+            'price': close_price,
+            'open': open_price,
+            'min': min_price,
+            'max': max_price,
+            'avg': round(total / samples, 2)
+        })
+    return granularity, series
+
+def get_price_history_stats():
+    with _stats_lock:
+        return dict(_stats)
+
+def init_price_history(app):
+    """Configure retention and trend settings from app config"""
+    app.extensions['price_history'] = _new_settings(app.config)
+
+def schedule_price_history_compactor(scheduler, app, interval=None):
+    """Downsample price history and refresh category medians on the scheduler leader"""
+    interval = interval or app.config.get('PRICE_HISTORY_COMPACT_INTERVAL', DEFAULT_COMPACT_INTERVAL)
+    window_size = app.config.get('PRICE_HISTORY_WINDOW_SIZE', DEFAULT_WINDOW_SIZE)
+
+    def compact():
+        refresh_category_medians()
+        compact_price_history(window_size=window_size)
+
+    return scheduler.add_job('price-history-compaction', compact, interval=interval, jitter=60, run_at_start=True)
@@ -0,0 +1,236 @@
+"""Sampling profiler for individual requests.
+
+A request is profiled when an admin asks for it (``X-Profile: 1`` with a valid
+``X-Admin-Token``), when it is drawn by ``PROFILE_SAMPLE_RATE``, or when it
+takes longer than ``PROFILE_SLOW_THRESHOLD`` seconds.  Other requests are only
+put on a watch list; one still running after ``PROFILE_SLOW_WATCH_FRACTION``
+of the threshold starts being sampled from then on, and its profile is kept
+if it ends up slow.  Fast requests never reach the sampler.
+
+One background thread walks the stacks of the profiled request threads every
+``PROFILE_SAMPLE_INTERVAL`` seconds with ``sys._current_frames()``; while only
+watched requests are in flight it just checks their age a few times per
+watch period, and it sleeps while no request is in flight.  Kept profiles (collapsed stacks plus the SQL
+statements the request ran) go to the app's ring buffer of
+``PROFILE_BUFFER_SIZE`` entries served by the admin blueprint.  Settings and
+buffer live in ``app.extensions``; each in-flight profile carries its own
+interval and limits since the sampler thread runs outside any app.
+"""
+import functools
+import os
+import random
+import secrets
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+
+from flask import current_app, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from src.services.identity import require_admin
+
+DEFAULT_SAMPLE_INTERVAL = 0.005  # seconds
+DEFAULT_SLOW_THRESHOLD = 1.0  # seconds
+DEFAULT_SLOW_WATCH_FRACTION = 0.5  # of the threshold, before sampling starts
+DEFAULT_BUFFER_SIZE = 50
+DEFAULT_MAX_STATEMENTS = 200
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def _new_state(config):
+    slow_threshold = config.get('PROFILE_SLOW_THRESHOLD', DEFAULT_SLOW_THRESHOLD)
+    fraction = config.get('PROFILE_SLOW_WATCH_FRACTION', DEFAULT_SLOW_WATCH_FRACTION)
+    return {
+        'sample_rate': config.get('PROFILE_SAMPLE_RATE', 0.0),
+        'slow_threshold': slow_threshold,
+        'watch_after': slow_threshold * fraction if slow_threshold is not None else None,
+        'interval': config.get('PROFILE_SAMPLE_INTERVAL', DEFAULT_SAMPLE_INTERVAL),
+        'max_statements': config.get('PROFILE_MAX_STATEMENTS', DEFAULT_MAX_STATEMENTS),
+        'profiles': deque(maxlen=config.get('PROFILE_BUFFER_SIZE', DEFAULT_BUFFER_SIZE))
+    }
+
+_defaults = _new_state({})
+_active = {}  # thread ident -> in-flight profile being sampled
+_watched = {}  # thread ident -> in-flight profile not sampled yet
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_local = threading.local()
+_sampler = {'pid': None}
+
+def _state():
+    """The current app's settings and profiles (see init_profiling), the defaults outside an app"""
+    return current_app.extensions.get('profiling', _defaults) if has_app_context() else _defaults
+
+@functools.lru_cache(maxsize=8192)
+def _frame_label(code):
+    filename = code.co_filename
+    if filename.startswith(_ROOT):
+        filename = os.path.relpath(filename, _ROOT)
+    elif 'site-packages' in filename:
+        filename = filename.split('site-packages' + os.sep, 1)[1]
+    return f'{code.co_name} ({filename}:{code.co_firstlineno})'.replace(';', ':')
+
+def _collapse(frame):
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+def _sample():
+    """Record one stack per sampled request, returns the shortest interval they ask for"""
+    with _lock:
+        if not _active:
+            return DEFAULT_SAMPLE_INTERVAL
+        frames = sys._current_frames()
+        for ident, profile in _active.items():
+            frame = frames.get(ident)
+            if frame is not None:
+                profile['stacks'][_collapse(frame)] += 1
+        return min(profile['interval'] for profile in _active.values())
+
+def _promote(now):
+    """Start sampling the watched requests that have run for their watch_after"""
+    with _lock:
+        for ident, profile in list(_watched.items()):
+            if now - profile['started'] >= profile['watch_after']:
+                del _watched[ident]
+                _active[ident] = profile
+        return min((profile['watch_after'] for profile in list(_watched.values())), default=0)
+
+def _run_sampler(logger):
+    while True:
+        _wakeup.wait()
+        _wakeup.clear()
+        while _active or _watched:
+            try:
+                watch_after = _promote(time.perf_counter()) if _watched else 0
+                if _active:
+                    time.sleep(_sample())
+                else:
+                    time.sleep(watch_after / 4)
+            except Exception as e:
+                # Keep sampling: a dead sampler would silently stop slow-request capture
+                logger.warning('Profiler sampling failed: %s', e)
+                time.sleep(DEFAULT_SAMPLE_INTERVAL)
+
+def _ensure_sampler():
+    if _sampler['pid'] != os.getpid():
+        with _lock:
+            if _sampler['pid'] != os.getpid():
+                _sampler['pid'] = os.getpid()
+                threading.Thread(target=_run_sampler, args=(current_app.logger,), name='request-profiler',
+                                 daemon=True).start()
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_local, 'profile', None) is not None:
+        conn.info['profile_started_at'] = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = getattr(_local, 'profile', None)
+    if profile is None:
+        return
+    elapsed = time.perf_counter() - conn.info.pop('profile_started_at', time.perf_counter())
+    if len(profile['sql']) < profile['max_statements']:
+        profile['sql'].append({'statement': statement, 'duration_ms': round(elapsed * 1000, 3)})
+    else:
+        profile['sql_truncated'] += 1
+
+def _start_request():
+    state = current_app.extensions['profiling']
+    reason = None
+    if request.headers.get('X-Profile') == '1' and require_admin():
+        reason = 'requested'
+    elif state['sample_rate'] and random.random() < state['sample_rate']:
+        reason = 'sampled'
+    elif state['slow_threshold'] is None:
+        return
+
+    profile = {
+        'reason': reason,
+        'started': time.perf_counter(),
+        'slow_threshold': state['slow_threshold'],
+        'watch_after': state['watch_after'],
+        'interval': state['interval'],
+        'max_statements': state['max_statements'],
+        'stacks': Counter(),
+        'sql': [],
+        'sql_truncated': 0
+    }
+    _local.profile = profile
+    _ensure_sampler()
+    if reason is None:
+        # Slow-request capture: no sampling unless it lasts
+        with _lock:
+            _watched[threading.get_ident()] = profile
+        if not _wakeup.is_set():
+            _wakeup.set()
+        return
+    with _lock:
+        _active[threading.get_ident()] = profile
+    _wakeup.set()
+
+def _finish_request(response):
+    profile = getattr(_local, 'profile', None)
+    if profile is None:
+        return response
+    _local.profile = None
+    with _lock:
+        _watched.pop(threading.get_ident(), None)
+        _active.pop(threading.get_ident(), None)
+
+    duration = time.perf_counter() - profile['started']
+    reason = profile['reason']
+    if reason is None:
+        if duration < profile['slow_threshold']:
+            return response
+        reason = 'slow'
+
+    profile_id = secrets.token_hex(8)
+    current_app.extensions['profiling']['profiles'].append({
+        'id': profile_id,
+        'reason': reason,
+        'endpoint': request.endpoint,
+        'method': request.method,
+        'path': request.full_path.rstrip('?'),
+        'status': response.status_code,
+        'created_at': datetime.utcnow(),
+        'duration_ms': round(duration * 1000, 3),
+        'samples': sum(profile['stacks'].values()),
+        'stacks': dict(profile['stacks']),
+        'sql': profile['sql'],
+        'sql_truncated': profile['sql_truncated']
+    })
+    if reason == 'requested':
+        response.headers['X-Profile-Id'] = profile_id
+    return response
+
+def list_profiles():
+    """Summaries of the stored profiles, newest first"""
+    return [
+        {key: value for key, value in profile.items() if key not in ('stacks', 'sql')}
+        | {'sql_statements': len(profile['sql'])}
+        for profile in reversed(_state()['profiles'])
+    ]
+
+def get_profile(profile_id):
+    for profile in _state()['profiles']:
+        if profile['id'] == profile_id:
+            return profile
+    return None
+
+def collapsed_stacks(profile):
+    """Flamegraph input (flamegraph.pl, speedscope): one 'stack count' line per stack"""
+    return ''.join(f'{stack} {count}\n' for stack, count in sorted(profile['stacks'].items()))
+
+def init_profiling(app):
+    """Configure profiling from app config and hook it around every request"""
+    app.extensions['profiling'] = _new_state(app.config)
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
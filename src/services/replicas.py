@@ -0,0 +1,212 @@
+"""Read/write routing between the primary database and read replicas.
+
+Endpoints opt in with ``@replica_read``; their SELECTs then go to a replica
+engine while everything else (and any flush) stays on the primary.  Replicas
+come from ``SQLALCHEMY_REPLICA_URIS`` and/or, for SQLite, a snapshot copy of
+the primary file refreshed every ``REPLICA_REFRESH_INTERVAL`` seconds
+(``REPLICA_SNAPSHOT = True``), which is the local stand-in used in development.
+
+Lag is measured with a heartbeat row written on the primary and read back from
+each replica; replicas lagging more than ``REPLICA_MAX_LAG`` are skipped.  A
+client that just wrote only reads from replicas whose heartbeat is newer than
+its last write, so it always sees its own changes (read-your-writes).  Each
+app keeps its replicas in ``app.extensions['replicas']``.
+"""
+import glob
+import itertools
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import current_app, g, session, has_app_context, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event, text
+
+DEFAULT_REFRESH_INTERVAL = 5  # seconds
+DEFAULT_MAX_LAG = 30  # seconds
+
+class Replica:
+    """A read-only engine plus its last measured lag"""
+
+    def __init__(self, name, engine):
+        self.name = name
+        self.engine = engine
+        self.synced_at = None  # primary heartbeat visible on the replica (epoch)
+        self.reads = 0
+
+    @property
+    def lag(self):
+        return time.time() - self.synced_at if self.synced_at is not None else None
+
+    def refresh(self):
+        pass
+
+    def dispose(self):
+        self.engine.dispose()
+
+class SQLiteSnapshotReplica(Replica):
+    """Periodic copy of a SQLite primary, written to a fresh file each time"""
+
+    def __init__(self, name, primary_path):
+        self.primary_path = primary_path
+        self.prefix = primary_path + '.replica'
+        self.path = None
+        self._lock = threading.Lock()
+        Replica.__init__(self, name, None)
+
+    def refresh(self):
+        with self._lock:
+            path = f'{self.prefix}.{time.time_ns()}'
+            source = sqlite3.connect(self.primary_path, timeout=10)
+            target = sqlite3.connect(path)
+            try:
+                source.backup(target)
+                target.execute('PRAGMA journal_mode=DELETE')
+            finally:
+                source.close()
+                target.close()
+
+            old_engine, old_path = self.engine, self.path
+            self.engine = create_engine(f'sqlite:///{path}', connect_args={'check_same_thread': False})
+            self.path = path
+
+        if old_engine is not None:
+            old_engine.dispose()
+            for leftover in glob.glob(old_path + '*'):
+                os.remove(leftover)
+
+    def dispose(self):
+        if self.engine is not None:
+            Replica.dispose(self)
+        for leftover in glob.glob(self.prefix + '.*'):
+            os.remove(leftover)
+
+_defaults = {'max_lag': DEFAULT_MAX_LAG, 'replicas': []}
+_round_robin = itertools.count()
+_stats = {'replica_reads': 0, 'primary_reads': 0, 'ryw_fallbacks': 0, 'lag_fallbacks': 0}
+
+def _state():
+    """The current app's replicas and max lag (see init_replicas), none outside an app"""
+    return current_app.extensions.get('replicas', _defaults) if has_app_context() else _defaults
+
+def choose_replica(min_synced_at=None):
+    """Pick a healthy replica round-robin, or None to stay on the primary
+
+    min_synced_at excludes replicas that have not replayed the primary up to
+    that point in time (the client's last write).
+    """
+    state = _state()
+    healthy = [replica for replica in state['replicas']
+               if replica.lag is not None and replica.lag <= state['max_lag']]
+    if not healthy:
+        _stats['lag_fallbacks'] += 1
+        return None
+    if min_synced_at is not None:
+        healthy = [replica for replica in healthy if replica.synced_at >= min_synced_at]
+        if not healthy:
+            _stats['ryw_fallbacks'] += 1
+            return None
+    replica = healthy[next(_round_robin) % len(healthy)]
+    replica.reads += 1
+    return replica
+
+class RoutingSession(Session):
+    """Session that sends SELECTs of replica-routed requests to a replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and getattr(clause, 'is_select', False) \
+                and has_request_context() and g.get('_db_route') == 'replica':
+            if '_db_replica' not in g:
+                g._db_replica = choose_replica(g.get('_db_min_synced_at'))
+            replica = g._db_replica
+            if replica is not None:
+                _stats['replica_reads'] += 1
+                return replica.engine
+        _stats['primary_reads'] += 1
+        return Session.get_bind(self, mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _after_flush(db_session, flush_context):
+    if has_request_context() and (db_session.new or db_session.dirty or db_session.deleted):
+        g._db_wrote = True
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _on_execute(orm_execute_state):
+    if has_request_context() and not orm_execute_state.is_select:
+        g._db_wrote = True
+
+def replica_read(view):
+    """Route the view's queries to a read replica when one is healthy"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if _state()['replicas']:
+            g._db_route = 'replica'
+            g._db_min_synced_at = session.get('_last_write_at')
+        return view(*args, **kwargs)
+    return wrapper
+
+def _remember_write(response):
+    if g.get('_db_wrote') and response.status_code < 400:
+        session['_last_write_at'] = time.time()
+    return response
+
+def refresh_replicas(app):
+    """Beat the primary heartbeat, refresh snapshots and measure replica lag"""
+    from src.models.user import db, ReplicaHeartbeat
+
+    with app.app_context():
+        now = datetime.utcnow()
+        heartbeat = db.session.get(ReplicaHeartbeat, 1)
+        if heartbeat is None:
+            db.session.add(ReplicaHeartbeat(id=1, beat_at=now))
+        else:
+            heartbeat.beat_at = now
+        db.session.commit()
+
+    for replica in app.extensions['replicas']['replicas']:
+        try:
+            replica.refresh()
+            with replica.engine.connect() as connection:
+                beat_at = connection.execute(text('SELECT beat_at FROM replica_heartbeat WHERE id = 1')).scalar()
+            if isinstance(beat_at, str):
+                beat_at = datetime.fromisoformat(beat_at)
+            replica.synced_at = beat_at.replace(tzinfo=timezone.utc).timestamp() if beat_at else None
+        except Exception as e:
+            replica.synced_at = None
+            app.logger.warning('Replica %s unavailable: %s', replica.name, e)
+
+def get_replica_stats():
+    return dict(
+        _stats,
+        replicas=[{'name': replica.name, 'lag': replica.lag, 'reads': replica.reads}
+                  for replica in _state()['replicas']]
+    )
+
+def init_replicas(app):
+    """Create the configured replica engines (they are used once refreshed)"""
+    replicas = []
+    urls = app.config.get('SQLALCHEMY_REPLICA_URIS') or [
+        url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()
+    ]
+    for index, url in enumerate(urls):
+        replicas.append(Replica(f'replica-{index}', create_engine(url, pool_pre_ping=True)))
+
+    primary_url = app.config['SQLALCHEMY_DATABASE_URI']
+    if app.config.get('REPLICA_SNAPSHOT') and primary_url.startswith('sqlite:///'):
+        replicas.append(SQLiteSnapshotReplica('snapshot', primary_url[len('sqlite:///'):]))
+
+    app.extensions['replicas'] = {'max_lag': app.config.get('REPLICA_MAX_LAG', DEFAULT_MAX_LAG), 'replicas': replicas}
+    if replicas:
+        app.after_request(_remember_write)
+
+def schedule_replica_refresher(scheduler, app):
+    """Refresh this process's replicas now and then every REPLICA_REFRESH_INTERVAL seconds"""
+    if not app.extensions['replicas']['replicas']:
+        return None
+
+    interval = app.config.get('REPLICA_REFRESH_INTERVAL', DEFAULT_REFRESH_INTERVAL)
+    return scheduler.add_job('replica-refresh', lambda: refresh_replicas(app), interval=interval,
+                             leader_only=False, jitter=0, run_at_start=True)
@@ -0,0 +1,249 @@
+"""Product reservations for checkout.
+
+A single-unit listing is held for a buyer with one conditional UPDATE
+(``status = 'active'`` -> ``'reserved'``), so concurrent checkouts never need a
+lock: the database lets exactly one of them match the row.  Holds carry a TTL
+and flow back to ``active`` when payment does not complete in time.
+"""
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import update, select, exists, and_
+
+from src.models.user import db, Product, ProductReservation
+from src.services.counters import record_listings_change
+
+DEFAULT_RESERVATION_TTL = 15 * 60  # seconds
+DEFAULT_SWEEP_INTERVAL = 60  # seconds
+DEFAULT_SWEEP_BATCH_SIZE = 500
+
+_stats_lock = threading.Lock()
+_stats = {
+    'attempts': 0,
+    'acquired': 0,
+    'conflicts': 0,
+    'reclaimed': 0,
+    'completed': 0,
+    'released': 0,
+    'expired': 0,
+    'sweeps': 0
+}
+
+def _bump(key, amount=1):
+    with _stats_lock:
+        _stats[key] += amount
+
+def _reservation_ttl():
+    from flask import current_app
+    return current_app.config.get('RESERVATION_TTL_SECONDS', DEFAULT_RESERVATION_TTL)
+
+def _no_active_hold():
+    """SQL predicate: the product has no reservation still being held"""
+    return ~exists().where(
+        ProductReservation.product_id == Product.id,
+        ProductReservation.status == 'held'
+    )
+
+def reserve_product(product_id, buyer_id, ttl=None):
+    """Atomically hold a product for a buyer.
+
+    Returns the pending ProductReservation (added to the current session, the
+    caller commits) or None when another buyer already holds or bought it.
+    """
+    _bump('attempts')
+    now = datetime.utcnow()
+    ttl = ttl if ttl is not None else _reservation_ttl()
+
+    seller_id = db.session.execute(
+        update(Product)
+        .where(Product.id == product_id, Product.status == 'active')
+        .values(status='reserved', updated_at=now)
+        .returning(Product.seller_id)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+
+    if seller_id is not None:
+        record_listings_change([seller_id], -1)
+    else:
+        # The product may still be flagged as reserved by a hold that expired
+        # before the sweeper got to it: take over that hold instead of failing.
+        reclaimed = db.session.execute(
+            update(ProductReservation)
+            .where(
+                ProductReservation.product_id == product_id,
+                ProductReservation.status == 'held',
+                ProductReservation.expires_at < now
+            )
+            .values(status='expired')
+            .execution_options(synchronize_session=False)
+        )
+        still_held = db.session.execute(
+            select(ProductReservation.id).where(
+                ProductReservation.product_id == product_id,
+                ProductReservation.status == 'held'
+            ).limit(1)
+        ).first()
+        if reclaimed.rowcount == 0 or still_held is not None:
+            _bump('conflicts')
+            return None
+
+        product_status = db.session.execute(
+            select(Product.status).where(Product.id == product_id)
+        ).scalar()
+        if product_status != 'reserved':
+            _bump('conflicts')
+            return None
+
+        _bump('expired', reclaimed.rowcount)
+        _bump('reclaimed')
+
+    reservation = ProductReservation(
+        product_id=product_id,
+        buyer_id=buyer_id,
+        status='held',
+        expires_at=now + timedelta(seconds=ttl)
+    )
+    db.session.add(reservation)
+    _bump('acquired')
+    return reservation
+
+def hold_for_order(order, ttl=None):
+    """Make sure the order's listing is held for its buyer, restarting the TTL.
+
+    Renews the hold attached to the order, or takes a new one when it lapsed
+    and nobody else picked the listing up.  Returns False when another buyer
+    holds or bought it.
+    """
+    ttl = ttl if ttl is not None else _reservation_ttl()
+    renewed = db.session.execute(
+        update(ProductReservation)
+        .where(ProductReservation.order_id == order.id, ProductReservation.status == 'held')
+        .values(expires_at=datetime.utcnow() + timedelta(seconds=ttl))
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if renewed:
+        return True
+    reservation = reserve_product(order.product_id, order.buyer_id, ttl)
+    if reservation is None:
+        return False
+    reservation.order_id = order.id
+    return True
+
+def secure_sale(order):
+    """Sell the order's listing to its buyer; False when the hold lapsed and another buyer has it"""
+    return complete_reservation(order.id) or mark_product_sold(order.product_id)
+
+def complete_reservation(order_id):
+    """Turn the hold attached to an order into a sale. Returns True on success."""
+    held = db.session.execute(
+        update(ProductReservation)
+        .where(ProductReservation.order_id == order_id, ProductReservation.status == 'held')
+        .values(status='completed')
+        .returning(ProductReservation.product_id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+
+    if not held:
+        return False
+
+    db.session.execute(
+        update(Product)
+        .where(Product.id.in_(held), Product.status == 'reserved')
+        .values(status='sold', updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    _bump('completed', len(held))
+    return True
+
+def release_reservation(order_id, status='released'):
+    """Give the product held for an order back to the catalog"""
+    released = db.session.execute(
+        update(ProductReservation)
+        .where(ProductReservation.order_id == order_id, ProductReservation.status == 'held')
+        .values(status=status)
+        .returning(ProductReservation.product_id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+
+    if not released:
+        return False
+
+    relisted = db.session.execute(
+        update(Product)
+        .where(Product.id.in_(released), Product.status == 'reserved', _no_active_hold())
+        .values(status='active', updated_at=datetime.utcnow())
+        .returning(Product.seller_id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    record_listings_change(relisted, 1)
+    _bump('released', len(released))
+    return True
+
+def mark_product_sold(product_id):
+    """Mark a listing sold when no reservation exists (orders placed before holds)"""
+    seller_id = db.session.execute(
+        update(Product)
+        .where(Product.id == product_id, Product.status == 'active')
+        .values(status='sold', updated_at=datetime.utcnow())
+        .returning(Product.seller_id)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+    if seller_id is None:
+        return False
+    record_listings_change([seller_id], -1)
+    return True
+
+def sweep_expired_reservations(batch_size=DEFAULT_SWEEP_BATCH_SIZE, now=None):
+    """Expire overdue holds in batches and reactivate their products"""
+    now = now or datetime.utcnow()
+    total = 0
+
+    while True:
+        overdue_ids = select(ProductReservation.id).where(
+            and_(ProductReservation.status == 'held', ProductReservation.expires_at < now)
+        ).limit(batch_size).scalar_subquery()
+
+        expired = db.session.execute(
+            update(ProductReservation)
+            .where(ProductReservation.id.in_(overdue_ids))
+            .values(status='expired')
+            .returning(ProductReservation.product_id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+
+        if expired:
+            relisted = db.session.execute(
+                update(Product)
+                .where(Product.id.in_(set(expired)), Product.status == 'reserved', _no_active_hold())
+                .values(status='active', updated_at=now)
+                .returning(Product.seller_id)
+                .execution_options(synchronize_session=False)
+            ).scalars().all()
+            record_listings_change(relisted, 1)
+        db.session.commit()
+
+        total += len(expired)
+        if len(expired) < batch_size:
+            break
+
+    _bump('sweeps')
+    _bump('expired', total)
+    return total
+
+def get_reservation_stats():
+    """Contention counters for this process plus the current number of holds"""
+    with _stats_lock:
+        stats = dict(_stats)
+
+    stats['conflict_rate'] = round(stats['conflicts'] / stats['attempts'], 4) if stats['attempts'] else 0.0
+    stats['active_holds'] = db.session.execute(
+        select(db.func.count(ProductReservation.id)).where(ProductReservation.status == 'held')
+    ).scalar()
+    return stats
+
+def schedule_reservation_sweeper(scheduler, app, interval=None):
+    """Run the expiry sweep periodically on the scheduler leader"""
+    interval = interval or app.config.get('RESERVATION_SWEEP_INTERVAL', DEFAULT_SWEEP_INTERVAL)
+    batch_size = app.config.get('RESERVATION_SWEEP_BATCH_SIZE', DEFAULT_SWEEP_BATCH_SIZE)
+    return scheduler.add_job('reservation-sweep', lambda: sweep_expired_reservations(batch_size=batch_size),
+                             interval=interval)
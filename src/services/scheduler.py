@@ -0,0 +1,438 @@
+"""In-process job scheduler for the periodic maintenance work.
+
+Services register their jobs with ``schedule_*(scheduler, app)`` functions
+and start_background_services() starts the scheduler once per process.  A
+job runs on a timer:
+
+- ``interval=<seconds>``, every N seconds
+- ``cron='<min> <hour> <day> <month> <weekday>'``, UTC, the usual five fields
+  with ``*``, ``*/n``, ``a-b``, ``a-b/n`` and lists
+- ``once=True``, a single run at startup
+
+One dispatcher thread hands due jobs to a small pool
+(``SCHEDULER_WORKERS``); a job never overlaps itself, a run that comes due
+while the previous one is still going is skipped.  Every run time gets up to
+``jitter`` seconds of random delay so workers that started together don't
+hit the database in step.
+
+Jobs default to ``leader_only``: of all the processes of a deployment only
+the holder of the scheduler lease runs them.  ``SCHEDULER_LEADER`` selects the
+lease: ``database`` (default) is a ``SchedulerLease`` row taken and renewed
+with a conditional UPDATE, good for ``SCHEDULER_LEASE_TTL`` seconds; ``file``
+is an exclusive ``flock`` on ``SCHEDULER_LOCK_PATH``, held until the process
+exits (single host only); ``always`` makes every process a leader
+(development).  Per-process work such as flushing an in-memory buffer
+registers with ``leader_only=False``.
+
+Per-job counts and timings are kept for the admin job-health endpoint and
+exported as ``kitala_job_duration_seconds``.
+"""
+import atexit
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, or_, update
+
+from src.models.user import db, SchedulerLease
+from src.services.database import dialect_insert
+from src.services.metrics import observe
+
+DEFAULT_WORKERS = 4
+DEFAULT_JITTER = 5  # seconds
+DEFAULT_LEASE_TTL = 30  # seconds
+DEFAULT_LEADER_BACKEND = 'database'
+LEASE_NAME = 'scheduler'
+
+_current = None  # the scheduler started in this process
+
+class CronTrigger:
+    """Next run times of a five-field cron expression, in UTC"""
+
+    FIELDS = (('minute', 0, 59), ('hour', 0, 23), ('day', 1, 31), ('month', 1, 12), ('weekday', 0, 7))
+
+    def __init__(self, expression):
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ValueError(f'cron expression needs 5 fields: {expression!r}')
+        self.expression = expression
+        values = {}
+        for text, (name, low, high) in zip(parts, self.FIELDS):
+            values[name] = self._parse(text, low, high)
+        self.minutes = values['minute']
+        self.hours = values['hour']
+        self.days = values['day']
+        self.months = values['month']
+        # 0 and 7 are both Sunday
+        self.weekdays = {day % 7 for day in values['weekday']}
+        # Standard cron: when both are restricted, either day field may match
+        self.any_day = parts[2] == '*'
+        self.any_weekday = parts[4] == '*'
+
+    @staticmethod
+    def _parse(text, low, high):
+        values = set()
+        for item in text.split(','):
+            span, _, step = item.partition('/')
+            if span == '*':
+                start, end = low, high
+            elif '-' in span:
+                start, end = (int(bound) for bound in span.split('-', 1))
+            else:
+                start = end = int(span)
+                if step:
+                    end = high
+            if not low <= start <= end <= high:
+                raise ValueError(f'cron field out of range: {item!r}')
+            values.update(range(start, end + 1, int(step) if step else 1))
+        return values
+
+    def _day_matches(self, moment):
+        in_days = moment.day in self.days
+        in_weekdays = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.any_day:
+            return in_weekdays
+        if self.any_weekday:
+            return in_days
+        return in_days or in_weekdays
+
+    def next_after(self, moment):
+        """First matching minute strictly after moment (a naive UTC datetime)"""
+        moment = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=366 * 5)
+        while moment < limit:
+            if moment.month not in self.months:
+                year, month = moment.year + moment.month // 12, moment.month % 12 + 1
+                moment = moment.replace(year=year, month=month, day=1, hour=0, minute=0)
+            elif not self._day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment
+        raise ValueError(f'cron expression never matches: {self.expression!r}')
+
+    def __str__(self):
+        return f'cron {self.expression}'
+
+class Job:
+    """A registered job with its timer and its run statistics"""
+
+    def __init__(self, name, func, interval=None, cron=None, once=False, leader_only=True,
+                 jitter=DEFAULT_JITTER, run_at_start=False):
+        if sum((interval is not None, cron is not None, once)) != 1:
+            raise ValueError(f'job {name}: exactly one of interval, cron or once is required')
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.cron = CronTrigger(cron) if cron else None
+        self.once = once
+        self.leader_only = leader_only
+        self.jitter = jitter
+        self.run_at_start = run_at_start or once
+        self.next_run = None  # epoch seconds
+        self.running = False
+        self.stats = {
+            'runs': 0, 'failures': 0, 'skipped': 0,
+            'last_started_at': None, 'last_finished_at': None, 'last_success_at': None,
+            'last_duration_ms': None, 'max_duration_ms': 0.0, 'total_duration_ms': 0.0,
+            'last_error': None
+        }
+
+    def schedule_next(self, now, first=False):
+        if first and self.run_at_start:
+            self.next_run = now + random.uniform(0, self.jitter)
+        elif self.once:
+            self.next_run = None
+        elif self.cron:
+            after = datetime.utcfromtimestamp(now)
+            delay = (self.cron.next_after(after) - after).total_seconds()
+            self.next_run = now + delay + random.uniform(0, self.jitter)
+        else:
+            self.next_run = now + self.interval + random.uniform(0, self.jitter)
+
+    def trigger(self):
+        if self.cron:
+            return str(self.cron)
+        return 'once' if self.once else f'every {self.interval}s'
+
+    def health(self, is_leader):
+        if self.leader_only and not is_leader:
+            return 'standby'
+        if self.running:
+            return 'running'
+        if not self.stats['runs']:
+            return 'pending'
+        if self.stats['last_error'] is not None:
+            return 'failing'
+        return 'ok'
+
+class DatabaseLease:
+    """Leadership as a row of SchedulerLease, renewed before it expires"""
+
+    def __init__(self, app, ttl, name=LEASE_NAME):
+        self.app = app
+        self.ttl = ttl
+        self.name = name
+        self.holder = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+    def acquire(self):
+        """Take or renew the lease, returns whether this process holds it"""
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=self.ttl)
+        with self.app.app_context(), db.engine.begin() as connection:
+            renewed = connection.execute(
+                update(SchedulerLease.__table__)
+                .where(SchedulerLease.name == self.name,
+                       or_(SchedulerLease.holder == self.holder, SchedulerLease.expires_at < now))
+                .values(holder=self.holder, expires_at=expires_at,
+                        acquired_at=case((SchedulerLease.holder == self.holder, SchedulerLease.acquired_at),
+                                         else_=now))
+            ).rowcount
+            if renewed:
+                return True
+            return bool(connection.execute(
+                dialect_insert(SchedulerLease.__table__, db.engine)
+                .values(name=self.name, holder=self.holder, acquired_at=now, expires_at=expires_at)
+                .on_conflict_do_nothing(index_elements=['name'])
+            ).rowcount)
+
+    def release(self):
+        with self.app.app_context(), db.engine.begin() as connection:
+            connection.execute(
+                update(SchedulerLease.__table__)
+                .where(SchedulerLease.name == self.name, SchedulerLease.holder == self.holder)
+                .values(expires_at=datetime.utcnow())
+            )
+
+class FileLease:
+    """Leadership as an exclusive flock, kept until the process exits"""
+
+    def __init__(self, path):
+        self.path = path
+        self.holder = f'{socket.gethostname()}:{os.getpid()}'
+        self.ttl = DEFAULT_LEASE_TTL
+        self._file = None
+
+    def acquire(self):
+        import fcntl  # POSIX only, imported when this backend is chosen
+
+        if self._file is not None:
+            return True
+        handle = open(self.path, 'a')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        self._file = handle
+        return True
+
+    def release(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+class AlwaysLeader:
+    holder = 'local'
+    ttl = DEFAULT_LEASE_TTL
+
+    def acquire(self):
+        return True
+
+    def release(self):
+        pass
+
+def make_lease(app):
+    backend = app.config.get('SCHEDULER_LEADER', DEFAULT_LEADER_BACKEND)
+    if backend == 'always':
+        return AlwaysLeader()
+    if backend == 'file':
+        path = app.config.get('SCHEDULER_LOCK_PATH') or os.path.join(
+            os.path.dirname(os.path.dirname(__file__)), 'database', 'scheduler.lock'
+        )
+        return FileLease(path)
+    return DatabaseLease(app, app.config.get('SCHEDULER_LEASE_TTL', DEFAULT_LEASE_TTL))
+
+class Scheduler:
+    def __init__(self, app, lease, workers=DEFAULT_WORKERS):
+        self.app = app
+        self.lease = lease
+        self.workers = workers
+        self.jobs = {}
+        self.is_leader = False
+        self.leader_since = None
+        self._condition = threading.Condition()
+        self._pool = None
+        self._thread = None
+        self._stopping = False
+        self._next_lease_check = 0
+
+    def add_job(self, name, func, **options):
+        """Register func (called without arguments, in an app context) under name"""
+        if name in self.jobs:
+            raise ValueError(f'job {name} is already registered')
+        job = Job(name, func, **options)
+        with self._condition:
+            self.jobs[name] = job
+            if self._thread is not None:
+                job.schedule_next(time.time(), first=True)
+                self._condition.notify()
+        return job
+
+    def run_now(self, name):
+        """Make a job due immediately; returns False for an unknown job"""
+        job = self.jobs.get(name)
+        if job is None:
+            return False
+        with self._condition:
+            job.next_run = time.time()
+            self._condition.notify()
+        return True
+
+    def start(self):
+        now = time.time()
+        for job in self.jobs.values():
+            job.schedule_next(now, first=True)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='scheduler')
+        self._thread = threading.Thread(target=self._dispatch, name='scheduler', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        """Stop dispatching and hand the lease over; running jobs are not waited for"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+        if self.is_leader:
+            try:
+                self.lease.release()
+            except Exception as e:
+                self.app.logger.warning('Scheduler lease release failed: %s', e)
+            self.is_leader = False
+
+    def _check_lease(self, now):
+        try:
+            leader = self.lease.acquire()
+        except Exception as e:
+            self.app.logger.warning('Scheduler lease check failed: %s', e)
+            leader = False
+        if leader != self.is_leader:
+            self.app.logger.info('Scheduler %s leadership (%s)', 'took' if leader else 'lost', self.lease.holder)
+            self.leader_since = datetime.utcnow() if leader else None
+        self.is_leader = leader
+        # Renew at a third of the TTL, jittered so followers don't retry in step
+        self._next_lease_check = now + self.lease.ttl / 3 * random.uniform(0.8, 1.0)
+
+    def _dispatch(self):
+        while True:
+            with self._condition:
+                if self._stopping:
+                    return
+                now = time.time()
+                if now >= self._next_lease_check:
+                    self._check_lease(now)
+                due = [job for job in self.jobs.values() if job.next_run is not None and job.next_run <= now]
+                for job in due:
+                    job.schedule_next(now)
+                    if job.leader_only and not self.is_leader:
+                        continue
+                    if job.running:
+                        job.stats['skipped'] += 1
+                        continue
+                    job.running = True
+                    try:
+                        self._pool.submit(self._run, job)
+                    except RuntimeError:
+                        # The pool is shut down at interpreter exit
+                        job.running = False
+                        self._stopping = True
+                        return
+                upcoming = [job.next_run for job in self.jobs.values() if job.next_run is not None]
+                wake_at = min(upcoming + [self._next_lease_check])
+                self._condition.wait(max(wake_at - time.time(), 0))
+
+    def _run(self, job):
+        stats = job.stats
+        stats['last_started_at'] = datetime.utcnow()
+        started = time.perf_counter()
+        error = None
+        with self.app.app_context():
+            try:
+                job.func()
+            except Exception as e:
+                error = f'{type(e).__name__}: {e}'
+                db.session.rollback()
+                self.app.logger.warning('Job %s failed: %s', job.name, e)
+        duration = time.perf_counter() - started
+        observe('kitala_job_duration_seconds', (job.name, 'error' if error else 'ok'), duration)
+
+        with self._condition:
+            duration_ms = round(duration * 1000, 2)
+            stats['runs'] += 1
+            stats['last_finished_at'] = datetime.utcnow()
+            stats['last_duration_ms'] = duration_ms
+            stats['max_duration_ms'] = max(stats['max_duration_ms'], duration_ms)
+            stats['total_duration_ms'] += duration_ms
+            stats['last_error'] = error
+            if error:
+                stats['failures'] += 1
+            else:
+                stats['last_success_at'] = stats['last_finished_at']
+            job.running = False
+
+    def job_health(self):
+        with self._condition:
+            jobs = []
+            for job in sorted(self.jobs.values(), key=lambda job: job.name):
+                stats = dict(job.stats)
+                total = stats.pop('total_duration_ms')
+                stats['avg_duration_ms'] = round(total / stats['runs'], 2) if stats['runs'] else None
+                jobs.append(dict(
+                    stats,
+                    name=job.name,
+                    trigger=job.trigger(),
+                    leader_only=job.leader_only,
+                    status=job.health(self.is_leader),
+                    next_run_at=datetime.utcfromtimestamp(job.next_run) if job.next_run else None
+                ))
+            return {
+                'leader': self.is_leader,
+                'holder': self.lease.holder,
+                'leader_since': self.leader_since,
+                'jobs': jobs
+            }
+
+def create_scheduler(app):
+    """A scheduler configured from app config, not started yet"""
+    return Scheduler(app, make_lease(app), workers=app.config.get('SCHEDULER_WORKERS', DEFAULT_WORKERS))
+
+def start_scheduler(scheduler):
+    """Start scheduler as this process's scheduler; it stops at exit"""
+    global _current
+    _current = scheduler
+    atexit.register(scheduler.stop)
+    return scheduler.start()
+
+def current_scheduler():
+    """The scheduler running in this process, None before startup"""
+    return _current
+
+def run_soon(name):
+    """Ask the running scheduler for an early run of a job, a no-op without one"""
+    if _current is not None:
+        _current.run_now(name)
+
+def get_scheduler_stats():
+    if _current is None:
+        return {'running': False, 'leader': False, 'jobs': []}
+    return dict(_current.job_health(), running=True)
@@ -0,0 +1,128 @@
+"""JSON encoding and response compression.
+
+FastJSONProvider replaces Flask's stdlib provider.  It encodes with orjson when
+it is installed (stdlib ``json`` otherwise) and writes datetimes as ISO 8601
+itself, so models hand them over as-is instead of calling isoformat().  With
+``JSON_COMPACT_KEYS`` enabled, clients sending ``X-Compact-Keys: 1`` get
+payloads without the keys whose value is null.
+
+init_serialization() also compresses responses larger than
+``COMPRESS_MIN_SIZE`` bytes with brotli (when the module is installed) or gzip,
+whichever the client prefers in ``Accept-Encoding``.  Streamed and file
+responses are left alone.
+"""
+import dataclasses
+import decimal
+import gzip
+import json
+import uuid
+from datetime import date, datetime
+
+from flask import request, has_request_context
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional codec
+    brotli = None
+
+DEFAULT_COMPRESS_MIN_SIZE = 1024  # bytes
+DEFAULT_COMPRESS_LEVEL = 6
+DEFAULT_BROTLI_QUALITY = 4
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/html', 'text/css', 'text/plain', 'text/csv',
+                          'application/javascript', 'application/x-ndjson'}
+
+def _default(o):
+    if isinstance(o, (datetime, date)):
+        return o.isoformat()
+    if isinstance(o, (decimal.Decimal, uuid.UUID)):
+        return str(o)
+    if dataclasses.is_dataclass(o) and not isinstance(o, type):
+        return dataclasses.asdict(o)
+    if hasattr(o, '__html__'):
+        return str(o.__html__())
+    raise TypeError(f'Object of type {type(o).__name__} is not JSON serializable')
+
+def strip_nulls(obj):
+    """Copy of obj without the dict keys whose value is None"""
+    if isinstance(obj, dict):
+        return {key: strip_nulls(value) for key, value in obj.items() if value is not None}
+    if isinstance(obj, (list, tuple)):
+        return [strip_nulls(value) for value in obj]
+    return obj
+
+class FastJSONProvider(DefaultJSONProvider):
+    """orjson-backed provider with a stdlib fallback"""
+
+    # Keep the field order of to_dict(); sorting every object costs time
+    sort_keys = False
+    compact_keys = False
+
+    def encode(self, obj):
+        """Encode obj to UTF-8 JSON bytes"""
+        if orjson is not None:
+            option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if self.sort_keys else 0)
+            return orjson.dumps(obj, default=_default, option=option)
+        return json.dumps(obj, default=_default, ensure_ascii=False, sort_keys=self.sort_keys,
+                          separators=(',', ':')).encode()
+
+    def dumps(self, obj, **kwargs):
+        # Callers passing options (the session serializer...) get the stdlib encoder
+        if kwargs:
+            kwargs.setdefault('default', _default)
+            kwargs.setdefault('ensure_ascii', self.ensure_ascii)
+            kwargs.setdefault('sort_keys', self.sort_keys)
+            return json.dumps(obj, **kwargs)
+        return self.encode(obj).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if self.compact_keys and has_request_context() and request.headers.get('X-Compact-Keys') == '1':
+            obj = strip_nulls(obj)
+        return self._app.response_class(self.encode(obj), mimetype=self.mimetype)
+
+def _choose_encoding():
+    offered = ['br', 'gzip'] if brotli is not None else ['gzip']
+    return request.accept_encodings.best_match(offered)
+
+def _compress_response(app, response):
+    config = app.config
+    if response.direct_passthrough or response.is_streamed or 'Content-Encoding' in response.headers \
+            or response.status_code < 200 or response.status_code in (204, 206, 304) \
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < config.get('COMPRESS_MIN_SIZE', DEFAULT_COMPRESS_MIN_SIZE):
+        return response
+
+    encoding = _choose_encoding()
+    if encoding == 'br':
+        data = brotli.compress(data, quality=config.get('COMPRESS_BROTLI_QUALITY', DEFAULT_BROTLI_QUALITY))
+    elif encoding == 'gzip':
+        data = gzip.compress(data, compresslevel=config.get('COMPRESS_LEVEL', DEFAULT_COMPRESS_LEVEL), mtime=0)
+    else:
+        return response
+
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+def init_serialization(app):
+    """Install the fast JSON provider and response compression"""
+    app.json = FastJSONProvider(app)
+    app.json.compact_keys = app.config.get('JSON_COMPACT_KEYS', False)
+
+    if app.config.get('COMPRESS_RESPONSES', True):
+        app.after_request(lambda response: _compress_response(app, response))
@@ -0,0 +1,362 @@
+"""Server-side sessions.
+
+The cookie only carries a signed, opaque session id; the session data (cart,
+OAuth state, pending payments...) lives in a backend.  ``SESSION_BACKEND``
+selects ``sqlite`` (default, ``SESSION_SQLITE_PATH``) or ``memory`` (tests).
+Sessions are written only when modified, recently read sessions are kept in a
+short per-process cache and expired rows are purged in batches, by a
+scheduler job once background services run (inline on save until then).
+A save is a compare-and-set on the data the request started from; when
+another request (or worker) saved the session meanwhile, or the cached copy
+was stale, the keys this request changed are applied again on top of the
+stored data, so concurrent requests don't drop each other's changes.
+Views that authenticate a user call regenerate_session() so the id used
+before the login is never the one that carries it (session fixation).
+rewrite_sessions() lets maintenance jobs edit stored session data in place.
+"""
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask.sessions import SessionInterface, SessionMixin
+from flask.json.tag import TaggedJSONSerializer
+from itsdangerous import Signer, BadSignature
+from werkzeug.datastructures import CallbackDict
+
+DEFAULT_CACHE_TTL = 2  # seconds
+DEFAULT_CACHE_SIZE = 2048
+DEFAULT_PURGE_INTERVAL = 300  # seconds
+DEFAULT_PURGE_BATCH_SIZE = 1000
+SAVE_RETRIES = 5
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session dict that remembers its id and whether it changed"""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.replaced_sid = None
+        self.loaded_data = None  # serialized data the session was opened from
+
+class MemorySessionBackend:
+    """Process-local backend, for tests and single-process development"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def load(self, sid):
+        return self._data.get(sid)
+
+    def save(self, sid, data, expires_at):
+        with self._lock:
+            self._data[sid] = (data, expires_at)
+
+    def touch(self, sid, expires_at):
+        with self._lock:
+            if sid in self._data:
+                self._data[sid] = (self._data[sid][0], expires_at)
+
+    def delete(self, sid):
+        with self._lock:
+            self._data.pop(sid, None)
+
+    def purge_expired(self, now, batch_size):
+        with self._lock:
+            expired = [sid for sid, (_, expires_at) in self._data.items() if expires_at < now][:batch_size]
+            for sid in expired:
+                del self._data[sid]
+        return len(expired)
+
+    def iter_sessions(self):
+        return [(sid, data) for sid, (data, _) in list(self._data.items())]
+
+    def replace(self, sid, old_data, new_data, expires_at=None):
+        with self._lock:
+            entry = self._data.get(sid)
+            if entry is None or entry[0] != old_data:
+                return False
+            self._data[sid] = (new_data, expires_at or entry[1])
+            return True
+
+class SQLiteSessionBackend:
+    """Sessions table in its own SQLite file, one connection per process and thread.
+
+    Nothing is opened before the first session is read or written, so
+    creating the app has no side effect and a preforking server never shares
+    a connection between its workers.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._ready_pid = None
+        self._ready_lock = threading.Lock()
+
+    def _connection(self):
+        pid = os.getpid()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != pid:
+            # A connection inherited through fork() belongs to the parent
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = pid
+            self._create_table(conn, pid)
+        return conn
+
+    def _create_table(self, conn, pid):
+        with self._ready_lock:
+            if self._ready_pid == pid:
+                return
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS sessions ('
+                'sid TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_sessions_expires_at ON sessions (expires_at)')
+            self._ready_pid = pid
+
+    def load(self, sid):
+        row = self._connection().execute(
+            'SELECT data, expires_at FROM sessions WHERE sid = ?', (sid,)
+        ).fetchone()
+        return tuple(row) if row else None
+
+    def save(self, sid, data, expires_at):
+        self._connection().execute(
+            'INSERT INTO sessions (sid, data, expires_at) VALUES (?, ?, ?) '
+            'ON CONFLICT(sid) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at',
+            (sid, data, expires_at)
+        )
+
+    def touch(self, sid, expires_at):
+        self._connection().execute('UPDATE sessions SET expires_at = ? WHERE sid = ?', (expires_at, sid))
+
+    def delete(self, sid):
+        self._connection().execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+
+    def purge_expired(self, now, batch_size):
+        cursor = self._connection().execute(
+            'DELETE FROM sessions WHERE sid IN '
+            '(SELECT sid FROM sessions WHERE expires_at < ? LIMIT ?)',
+            (now, batch_size)
+        )
+        return cursor.rowcount
+
+    def iter_sessions(self):
+        return self._connection().execute('SELECT sid, data FROM sessions').fetchall()
+
+    def replace(self, sid, old_data, new_data, expires_at=None):
+        cursor = self._connection().execute(
+            'UPDATE sessions SET data = ?, expires_at = COALESCE(?, expires_at) WHERE sid = ? AND data = ?',
+            (new_data, expires_at, sid, old_data)
+        )
+        return cursor.rowcount == 1
+
+class ServerSideSessionInterface(SessionInterface):
+    serializer = TaggedJSONSerializer()
+    salt = 'kitalamarket-session-id'
+
+    def __init__(self, backend, cache_ttl=DEFAULT_CACHE_TTL, cache_size=DEFAULT_CACHE_SIZE,
+                 purge_interval=DEFAULT_PURGE_INTERVAL, purge_batch_size=DEFAULT_PURGE_BATCH_SIZE):
+        self.backend = backend
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.purge_interval = purge_interval
+        self.purge_batch_size = purge_batch_size
+        self.purge_inline = True  # off once the purge job is scheduled
+        self._cache = OrderedDict()  # sid -> (cached_at, data, expires_at)
+        self._cache_lock = threading.Lock()
+        self._last_purge = time.time()
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt=self.salt)
+
+    def _store_ttl(self, app):
+        return app.config.get('SESSION_STORE_TTL', app.permanent_session_lifetime.total_seconds())
+
+    def _cache_get(self, sid):
+        entry = self._cache.get(sid)
+        if entry and time.monotonic() - entry[0] < self.cache_ttl:
+            return entry[1], entry[2]
+        return None
+
+    def _cache_put(self, sid, data, expires_at):
+        if self.cache_ttl <= 0:
+            return
+        with self._cache_lock:
+            self._cache[sid] = (time.monotonic(), data, expires_at)
+            self._cache.move_to_end(sid)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _cache_drop(self, sid):
+        with self._cache_lock:
+            self._cache.pop(sid, None)
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode()
+            except BadSignature:
+                sid = None
+
+            if sid:
+                stored = self._cache_get(sid)
+                if stored is None:
+                    stored = self.backend.load(sid)
+                    if stored:
+                        self._cache_put(sid, stored[0], stored[1])
+
+                if stored and stored[1] > time.time():
+                    session = ServerSideSession(self.serializer.loads(stored[0]), sid=sid)
+                    session.expires_at = stored[1]
+                    session.loaded_data = stored[0]
+                    return session
+
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def _write(self, session, expires_at):
+        """Store the session with a compare-and-set on the data it was opened from, returns what was stored"""
+        values = dict(session)
+        data = self.serializer.dumps(values)
+        base = None if session.new else session.loaded_data
+        if base is not None:
+            original = self.serializer.loads(base)
+            changed = {key: value for key, value in values.items() if key not in original or original[key] != value}
+            removed = original.keys() - values.keys()
+            for _ in range(SAVE_RETRIES):
+                if self.backend.replace(session.sid, base, data, expires_at):
+                    return data
+                # Saved by another request meanwhile, or our copy came from a
+                # stale cache entry: redo this request's changes on the stored data
+                stored = self.backend.load(session.sid)
+                if stored is None:
+                    break
+                base = stored[0]
+                merged = self.serializer.loads(base)
+                for key in removed:
+                    merged.pop(key, None)
+                merged.update(changed)
+                data = self.serializer.dumps(merged)
+        self.backend.save(session.sid, data, expires_at)
+        return data
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        now = time.time()
+
+        if self.purge_inline and now - self._last_purge > self.purge_interval:
+            self._last_purge = now
+            purge_expired_sessions(self, self.purge_batch_size)
+
+        if not session:
+            if session.modified and not session.new:
+                self.backend.delete(session.sid)
+                self._cache_drop(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if session.replaced_sid:
+            self.backend.delete(session.replaced_sid)
+            self._cache_drop(session.replaced_sid)
+            session.replaced_sid = None
+
+        ttl = self._store_ttl(app)
+        if session.modified:
+            data = self._write(session, now + ttl)
+            self._cache_put(session.sid, data, now + ttl)
+        elif getattr(session, 'expires_at', now) - now < ttl / 2:
+            # Slide the expiry of sessions that are read but never written
+            self.backend.touch(session.sid, now + ttl)
+            self._cache_drop(session.sid)
+
+        if session.new or self.should_set_cookie(app, session):
+            response.set_cookie(
+                name,
+                self._signer(app).sign(session.sid).decode(),
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app)
+            )
+
+def regenerate_session(session):
+    """Move the session to a fresh id, dropping the old one when the response is saved"""
+    if not session.new:
+        session.replaced_sid = session.replaced_sid or session.sid
+    session.sid = secrets.token_urlsafe(32)
+    session.new = True
+    session.modified = True
+
+def purge_expired_sessions(interface, batch_size=DEFAULT_PURGE_BATCH_SIZE):
+    """Delete expired sessions batch by batch, returns the number removed"""
+    total = 0
+    while True:
+        removed = interface.backend.purge_expired(time.time(), batch_size)
+        total += removed
+        if removed < batch_size:
+            return total
+
+def rewrite_sessions(interface, rewrite, marker=None):
+    """Apply rewrite(data) to every stored session, returns the number changed.
+
+    rewrite edits the session dict in place and returns whether it changed
+    it.  The write is a compare-and-set on the stored data, so a session the
+    user modified meanwhile is left alone.  marker, when given, skips the
+    sessions whose serialized data doesn't contain it without decoding them.
+    """
+    changed = 0
+    for sid, data in interface.backend.iter_sessions():
+        if marker is not None and marker not in data:
+            continue
+        values = interface.serializer.loads(data)
+        if not rewrite(values):
+            continue
+        if interface.backend.replace(sid, data, interface.serializer.dumps(values)):
+            interface._cache_drop(sid)
+            changed += 1
+    return changed
+
+def schedule_session_purge(scheduler, app):
+    """Move the expired-session purge from the save path to a scheduler job"""
+    interface = app.session_interface
+    interface.purge_inline = False
+    # Memory sessions are per process, each one purges its own
+    leader_only = not isinstance(interface.backend, MemorySessionBackend)
+    return scheduler.add_job('session-purge', lambda: purge_expired_sessions(interface, interface.purge_batch_size),
+                             interval=interface.purge_interval, leader_only=leader_only)
+
+def init_sessions(app):
+    """Install the server-side session interface configured for this app"""
+    backend_name = app.config.get('SESSION_BACKEND', 'sqlite')
+    if backend_name == 'memory':
+        backend = MemorySessionBackend()
+    else:
+        path = app.config.get('SESSION_SQLITE_PATH') or os.path.join(
+            os.path.dirname(os.path.dirname(__file__)), 'database', 'sessions.db'
+        )
+        backend = SQLiteSessionBackend(path)
+
+    app.session_interface = ServerSideSessionInterface(
+        backend,
+        cache_ttl=app.config.get('SESSION_CACHE_TTL', DEFAULT_CACHE_TTL),
+        cache_size=app.config.get('SESSION_CACHE_SIZE', DEFAULT_CACHE_SIZE),
+        purge_interval=app.config.get('SESSION_PURGE_INTERVAL', DEFAULT_PURGE_INTERVAL),
+        purge_batch_size=app.config.get('SESSION_PURGE_BATCH_SIZE', DEFAULT_PURGE_BATCH_SIZE)
+    )
+    return app.session_interface
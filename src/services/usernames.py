@@ -0,0 +1,75 @@
+"""Username allocation for signups that don't choose one (OAuth).
+
+The username is derived from a base (the email local part): the bare base
+first, then ``base1``, ``base2``...  Instead of probing candidates one SELECT
+at a time, a ``UsernameSequence`` row per base hands out the next suffix with
+one atomic ``UPDATE ... RETURNING``.  The first allocation of a base seeds its
+row from a single range scan of the username index (``base`` up to
+``base:``, i.e. the base followed by digits), so users created before the
+sequence existed are skipped too.
+
+Allocation commits on its own connection: a suffix is never handed out twice,
+even when the signup that took it rolls back (which only leaves a gap).
+Usernames picked by hand can still collide with an allocated one; callers
+insert without pre-checking and allocate again on a unique violation.
+"""
+import threading
+
+from sqlalchemy import select, update
+
+from src.models.user import db, User, UsernameSequence
+from src.services.database import dialect_insert
+
+MAX_BASE_LENGTH = 72  # leaves room for the suffix in User.username
+
+_stats_lock = threading.Lock()
+_stats = {'allocated': 0, 'seeded': 0}
+
+def _bump(key, amount=1):
+    with _stats_lock:
+        _stats[key] += amount
+
+def username_base(email):
+    """The base a username is derived from: the email local part, truncated"""
+    return email.split('@')[0][:MAX_BASE_LENGTH] or 'user'
+
+def _next_free_suffix(connection, base):
+    """One past the highest suffix already taken by base/baseN users, 0 when base is free"""
+    taken = connection.execute(
+        select(User.username).where(User.username >= base, User.username < base + ':')
+    ).scalars()
+    highest = -1
+    for username in taken:
+        suffix = username[len(base):]
+        if suffix == '':
+            highest = max(highest, 0)
+        elif suffix.isdigit():
+            highest = max(highest, int(suffix))
+    return highest + 1
+
+def allocate_username(base, engine=None):
+    """Reserve the next username for base and return it"""
+    with (engine or db.engine).begin() as connection:
+        suffix = connection.execute(
+            update(UsernameSequence.__table__)
+            .where(UsernameSequence.base == base)
+            .values(last_suffix=UsernameSequence.last_suffix + 1)
+            .returning(UsernameSequence.last_suffix)
+        ).scalar()
+        if suffix is None:
+            seed = _next_free_suffix(connection, base)
+            statement = dialect_insert(UsernameSequence.__table__, engine or db.engine).values(
+                base=base, last_suffix=seed)
+            # Another signup may have seeded the base in the meantime
+            statement = statement.on_conflict_do_update(
+                index_elements=['base'],
+                set_={'last_suffix': UsernameSequence.__table__.c.last_suffix + 1}
+            ).returning(UsernameSequence.last_suffix)
+            suffix = connection.execute(statement).scalar()
+            _bump('seeded')
+    _bump('allocated')
+    return base if suffix == 0 else f'{base}{suffix}'
+
+def get_username_stats():
+    with _stats_lock:
+        return dict(_stats)
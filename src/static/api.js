@@ -1,13 +1,26 @@
 // API Configuration
 const API_BASE_URL = window.location.origin;
+// Must not exceed BATCH_MAX_REQUESTS on the server
+const BATCH_MAX_REQUESTS = 20;
 
 // API Helper functions
 class KitalamarketAPI {
     constructor() {
         this.baseURL = API_BASE_URL;
+        // GET calls made in the same tick are sent together through /api/batch
+        this.batching = true;
+        this.pendingCalls = [];
     }
 
     async request(endpoint, options = {}) {
+        const method = (options.method || 'GET').toUpperCase();
+        if (this.batching && method === 'GET' && !options.headers && endpoint.startsWith('/api/')) {
+            return this.enqueue(endpoint);
+        }
+        return this.send(endpoint, options);
+    }
+
+    async send(endpoint, options = {}) {
         const url = `${this.baseURL}${endpoint}`;
         const config = {
             headers: {
@@ -33,6 +46,46 @@ class KitalamarketAPI {
         }
     }
 
+    enqueue(endpoint) {
+        return new Promise((resolve, reject) => {
+            this.pendingCalls.push({ endpoint, resolve, reject });
+            if (this.pendingCalls.length === 1) {
+                setTimeout(() => this.flush(), 0);
+            }
+        });
+    }
+
+    flush() {
+        const calls = this.pendingCalls;
+        this.pendingCalls = [];
+
+        if (calls.length === 1) {
+            this.send(calls[0].endpoint).then(calls[0].resolve, calls[0].reject);
+            return;
+        }
+
+        for (let start = 0; start < calls.length; start += BATCH_MAX_REQUESTS) {
+            const chunk = calls.slice(start, start + BATCH_MAX_REQUESTS);
+            this.send('/api/batch', {
+                method: 'POST',
+                body: JSON.stringify({
+                    requests: chunk.map((call, index) => ({ id: index, method: 'GET', path: call.endpoint }))
+                })
+            }).then(data => {
+                data.responses.forEach((result, index) => {
+                    const call = chunk[index];
+                    if (result.status >= 200 && result.status < 300) {
+                        call.resolve(result.body);
+                    } else {
+                        const error = new Error((result.body && result.body.error) || `HTTP error! status: ${result.status}`);
+                        console.error('API Request failed:', error);
+                        call.reject(error);
+                    }
+                });
+            }).catch(error => chunk.forEach(call => call.reject(error)));
+        }
+    }
+
     // Authentication
     async login(email, password) {
         return this.request('/api/auth/login', {
@@ -134,6 +187,10 @@ class KitalamarketAPI {
         return this.request('/api/messages/unread-count');
     }
 
+    async getDashboardSummary() {
+        return this.request('/api/dashboard/summary');
+    }
+
     async checkNewMessages(since = null) {
         const params = since ? `?since=${since}` : '';
         return this.request(`/api/messages/new-messages${params}`);